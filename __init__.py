@@ -16,13 +16,18 @@ GPL3
 """
 
 from argparse import ArgumentParser
+from array import array
+import bisect
 from collections import Iterable
+from collections import deque, namedtuple, OrderedDict
 from datetime import datetime, timedelta
+import concurrent.futures
 import copy
 import euclid3 as eu
 import gc
 import gettext as igettext
 import glob
+import heapq
 import imghdr
 import imp
 import itertools
@@ -36,6 +41,7 @@ from os.path import expanduser
 from pathlib import Path
 import pickle
 import queue
+import shlex
 from random import choice, randint, uniform
 import struct
 import subprocess
@@ -43,7 +49,9 @@ import sys
 import threading
 import time
 import traceback
+import tracemalloc
 import webbrowser
+import zlib
 
 # 3rd party modules
 from fontTools.ttLib import TTFont
@@ -52,6 +60,12 @@ import pyglet.clock
 
 PORT = 8000 + randint(0, 100)
 
+# vectorised particles for emitters
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 # Steam support for achievement manager
 try:
     from steampak import SteamApi  # Main API entry point.
@@ -140,7 +154,7 @@ def load_info(fname_raw):
             data = f.readlines()
             for d in data:
                 if len(d) > 2 and "=" in d:
-                    key, v = d.strip().split("=")
+                    key, v = d.strip().split("=", 1)
                     config[key] = v
     return config
 
@@ -162,7 +176,7 @@ def load_config():
     if not os.path.exists(fname):  # fallback on static directory
         fname = get_safe_path(fname_raw)
     config = {"editor": False, "mixer": "pygame", "mods": True, "language": None, "internet": None,
-              "lowmemory": None}  # defaults
+              "lowmemory": None, "resourcebudget": None, "options": None}  # defaults
     if os.path.exists(fname):
         with open(fname, "r") as f:
             data = f.readlines()
@@ -228,10 +242,22 @@ def set_language(new_language=None):
 set_language(language)
 
 
+def get_runtime_options(parser):
+    """ Parse the command line once into an immutable namedtuple. Arguments from the config
+        file (options=...) and the PYVIDA_OPTIONS environment variable go before the real
+        ones, eg PYVIDA_OPTIONS="-H -x -s 100" for a headless run on a build server. """
+    args = []
+    for extra in [CONFIG.get("options"), os.environ.get(OPTIONS_ENVIRONMENT)]:
+        if extra:
+            args.extend(shlex.split(extra))
+    values = vars(parser.parse_args(args + sys.argv[1:]))
+    return namedtuple("RuntimeOptions", sorted(values.keys()), rename=True)(**values)
+
+
 def set_language_for_session(game):
     # set the language using the settings or the cmdline override
     locale = game.settings.language if game.settings.language != "en" else None
-    options = game.parser.parse_args()
+    options = game.options
     if options.language_code:
         locale = options.language_code if options.language_code != "default" else None
     set_language(locale)
@@ -278,10 +304,15 @@ ENABLE_EDITOR = False and EDITOR_AVAILABLE  # default for editor. Caution: This
 ENABLE_PROFILING = False # allow profiling
 ENABLE_LOGGING = True
 DEFAULT_TEXT_EDITOR = "gedit"
+OPTIONS_ENVIRONMENT = "PYVIDA_OPTIONS"  # extra command line arguments, see get_runtime_options
 
 VERSION_MAJOR = 5  # major incompatibilities
 VERSION_MINOR = 1  # minor/bug fixes, can run same scripts
 VERSION_SAVE = 5  # save/load version, only change on incompatible changes
+SAVE_MAGIC = b"PYVIDASAVE"  # start of save files written as records (older saves are a run of pickles)
+SAVE_FORMAT = 1  # layout of the records after SAVE_MAGIC
+SAVE_RECORD = ">BHI"  # record type, key length, data length
+SAVE_STATE, SAVE_ACTORS, SAVE_ITEMS, SAVE_SCENES, SAVE_END = 0, 1, 2, 3, 255  # record types
 
 # AVAILABLE BACKENDS
 PYGAME19 = 0
@@ -309,6 +340,16 @@ DEFAULT_RESOLUTION = (1920, 1080)
 DEFAULT_FPS = 16
 DEFAULT_ACTOR_FPS = 16
 DEFAULT_ENGINE_FPS = 30  # if locking engine to a draw rate
+DEFAULT_RESOURCE_BUDGET = 1024  # MB of decoded images to keep before unloading objects that aren't on screen
+LOW_MEMORY_RESOURCE_BUDGET = 256  # as above, in low memory mode
+ASSET_LOADER_WORKERS = 4  # threads decoding spritesheets in the background
+PREFETCH_HOPS = 1  # warm the scenes this many portals away from the current scene
+PREFETCH_BUDGET = 128  # MB of decoded spritesheets to hold for scenes the player hasn't entered yet
+GENERATOR_BUDGET = 0.008  # seconds per frame spent advancing game._generator (eg loading a save game)
+DEPTH_FIELD_CELL = 8  # pixels per cell of the depth scaling grid for walkareas with more than two z waypoints
+METADATA_BUNDLE = "metadata.bundle"  # directory listings and metadata files under data/, see tools/metadata_bundle
+METADATA_EXTENSIONS = [".montage", ".defaults", ".details", ".motion", ".offset", ".quickload", ".atlas"]  # kept whole in the bundle
+SMART_LOAD_WORKERS = 4  # threads reading data/ ahead of Game._smart where the metadata bundle is out of date (0 for none)
 
 DIRECTORY_ACTORS = "data/actors"
 DIRECTORY_PORTALS = "data/portals"
@@ -421,6 +462,10 @@ PINGPONG = 2
 REVERSE = 3
 MANUAL = 4  # user sets the frame index
 
+# MOTION DELTA FIELDS (bits in MotionTrack.present)
+MOTION_FIELDS = ["x", "y", "z", "r", "scale", "f", "alpha"]
+MOTION_X, MOTION_Y, MOTION_Z, MOTION_R, MOTION_SCALE, MOTION_F, MOTION_ALPHA = [1 << i for i in range(7)]
+
 # EMITTER BEHAVIOURS
 BEHAVIOUR_CYCLE = 0  # continiously on
 BEHAVIOUR_FIRE = 1  # spawn one batch of particles then stop
@@ -660,6 +705,8 @@ GLOBALS (yuck)
 """
 _pyglet_fonts = {DEFAULT_MENU_FONT: "bitstream vera sans"}
 _resources = {}  # graphical assets for the game, #w,h, Sprite|None
+_atlas_pages = {}  # texture atlas pages (from tools/atlas) by filename, shared by the actions packed into them
+_atlas_page_users = {}  # resource names of the loaded actions using each atlas page
 _sound_resources = {}  # sound assets for the game, # PlayerPygameSFX
 
 """
@@ -766,24 +813,19 @@ scene_path = []
 
 
 def scene_search(game, scene, target):  # are scenes connected via portals?
+    """ Return the scene named target (upper case) if it can be reached from scene through portals, else False.
+        scene_path is set to the scenes on the way, including both ends. """
     global scene_path
     if not scene or not scene.name:
         if logging:
             log.warning("Strange scene search %s" % scene_path)
         return False
-    scene_path.append(scene)
-    if scene.name.upper() == target:
-        return scene
-    for obj_name in scene._objects:
-        i = get_object(game, obj_name)
-        if isinstance(i, Portal):  # if portal and has link, follow that portal
-            link = get_object(game, i._link)
-            if link and link.scene not in scene_path:
-                found_target = scene_search(game, link.scene, target)
-                if found_target != False:
-                    return found_target
-    scene_path.pop(-1)
-    return False
+    steps = game._scene_graph.path(game, scene.name, target)
+    if steps is None:
+        scene_path = []
+        return False
+    scene_path = [scene] + [game._scenes[scene_name] for portal_name, scene_name in steps]
+    return scene_path[-1]
 
 
 """
@@ -1029,47 +1071,133 @@ def get_point(game, destination, actor=None):
     return destination
 
 
+class NameIndex(object):
+    """ Look up game objects by display text and translated name/display text, and by lowercase name.
+
+        Maintained by Game._add/_remove and the display_text setters, and rebuilt
+        if the game's object dicts are swapped out (eg on load) or the language
+        changes. Where several objects share a key the old search order wins:
+        scenes, items, actors for names and items, actors, scenes for display text.
+        Lookups that find nothing are counted in .missed so scripts with bad
+        names show up.
+    """
+
+    def __init__(self):
+        self._names_lower = {}  # lowercase name: [(rank, obj), ...]
+        self._display = {}  # display text or translated name/display text: [(rank, obj), ...]
+        self._display_lower = {}
+        self._indexed = {}  # id(obj): (obj, [(table, key), ...])
+        self._signature = None
+        self.lookups = 0  # get_object calls with a name
+        self.misses = 0
+        self.missed = {}  # name: number of failed lookups
+
+    def _make_signature(self, game):
+        return (id(game._scenes), len(game._scenes), id(game._items), len(game._items),
+                id(game._actors), len(game._actors), _)
+
+    def _insert(self, table, key, rank, obj, entries):
+        objects = table.setdefault(key, [])
+        index = len(objects)
+        while index > 0 and objects[index - 1][0] > rank:
+            index -= 1
+        objects.insert(index, (rank, obj))
+        entries.append((table, key))
+
+    def _add(self, obj):
+        name = obj.name
+        display_text = getattr(obj, "display_text", None)
+        if isinstance(obj, Scene):
+            name_rank, display_rank = 0, 2
+        elif isinstance(obj, Item):
+            name_rank, display_rank = 1, 0
+        else:
+            name_rank, display_rank = 2, 1
+        keys = [name, display_text, _(name)]
+        if isinstance(display_text, str):
+            keys.append(_(display_text))
+        entries = []
+        self._insert(self._names_lower, name.lower(), name_rank, obj, entries)
+        for key in set([k for k in keys if isinstance(k, str) and k]):
+            self._insert(self._display, key, display_rank, obj, entries)
+            if key.lower() not in [k for t, k in entries if t is self._display_lower]:
+                self._insert(self._display_lower, key.lower(), display_rank, obj, entries)
+        self._indexed[id(obj)] = (obj, entries)
+
+    def _remove(self, obj):
+        indexed = self._indexed.pop(id(obj), None)
+        if not indexed:
+            return
+        for table, key in indexed[1]:
+            objects = [x for x in table.get(key, []) if x[1] is not obj]
+            if objects:
+                table[key] = objects
+            else:
+                table.pop(key, None)
+
+    def sync(self, game):
+        """ Rebuild the index if the game's objects or the language changed behind our back """
+        signature = self._make_signature(game)
+        if signature == self._signature:
+            return
+        self._names_lower, self._display, self._display_lower, self._indexed = {}, {}, {}, {}
+        for objects in [game._items, game._actors, game._scenes]:
+            for obj in objects.values():
+                self._add(obj)
+        self._signature = signature
+
+    def add(self, game, obj):
+        self.sync(game)
+        self._remove(obj)
+        self._add(obj)
+        self._signature = self._make_signature(game)
+
+    def remove(self, game, obj):
+        self.sync(game)
+        self._remove(obj)
+        self._signature = self._make_signature(game)
+
+    def update(self, obj):
+        """ Re-index an object whose name or display text has changed """
+        if id(obj) in self._indexed:
+            self._remove(obj)
+            self._add(obj)
+
+    def find(self, game, key, case_insensitive=False):
+        self.sync(game)
+        if case_insensitive:
+            objects = self._names_lower.get(key.lower()) or self._display_lower.get(key.lower())
+        else:
+            objects = self._display.get(key)
+        if objects:
+            return objects[0][1]
+        self.misses += 1
+        if key not in self.missed:
+            self.missed[key] = 0
+            if logging:
+                log.warning("get_object: unable to find an object called \"%s\"" % key)
+        self.missed[key] += 1
+        return None
+
+
 def get_object(game, obj, case_insensitive=False):
     """ get an object from a name or object 
         Case insensitive
     """
     if type(obj) != str:
         return obj
-    robj = None  # return object
-
-    # do a case insensitve search
-    if case_insensitive:
-        obj = obj.lower()
-        scenes_lower = {k.lower(): v for k, v in game._scenes.items()}
-        items_lower = {k.lower(): v for k, v in game._items.items()}
-        actors_lower = {k.lower(): v for k, v in game._actors.items()}
-    else:
-        scenes_lower = game._scenes
-        items_lower = game._items
-        actors_lower = game._actors
-
-    if obj in scenes_lower:  # a scene
-        robj = scenes_lower[obj]
-    elif obj in items_lower:
-        robj = items_lower[obj]
-    elif obj in actors_lower:
-        robj = actors_lower[obj]
-    else:
-        # look for the display names in _items in case obj is the name of an
-        # on_ask option or translated
-        for i in game._items.values():
-            if obj in [i.name, i.display_text, _(i.name), _(i.display_text)]:
-                robj = i
-                return i
-        for i in game._actors.values():
-            if obj in [i.name, i.display_text, _(i.name), _(i.display_text)]:
-                robj = i
-                return i
-        for i in game._scenes.values():
-            if obj in [i.name, i.display_text, _(i.name), _(i.display_text)]:
-                robj = i
-                return i
-    return robj
+
+    game._name_index.lookups += 1
+    if not case_insensitive:
+        if obj in game._scenes:  # a scene
+            return game._scenes[obj]
+        elif obj in game._items:
+            return game._items[obj]
+        elif obj in game._actors:
+            return game._actors[obj]
+
+    # look for the display names in case obj is the name of an on_ask option or translated
+    return game._name_index.find(game, obj, case_insensitive=case_insensitive)
 
 
 # LOS algorithm/code provided by David Clark (silenus at telus.net) from pygame code repository
@@ -1137,6 +1265,24 @@ def line_seg_intersect(line1point1, line1point2, line2point1, line2point2):
     return x, y
 
 
+def clear_path(polygon, start, end, solids):
+    """ Is there a clear path between these two points, staying inside polygon and missing the solids (Rects) """
+    clear_path = True
+    if polygon:  # test the walkarea
+        w0 = w1 = polygon[0]
+        for w2 in polygon[1:]:
+            if line_seg_intersect(end, start, w1, w2):
+                clear_path = False
+                return clear_path
+            w1 = w2
+        if line_seg_intersect(end, start, w2, w0): clear_path = False
+    for rect in solids:  # test the solids
+        collide = rect.intersect(start, end)
+        if collide is True:
+            clear_path = False
+    return clear_path
+
+
 def collide(rect, x, y):
     """ text is point x,y is inside rectangle """
     return not ((x < rect[0])
@@ -1213,6 +1359,7 @@ def close_on_says(game, obj, player):
         return
 
     try:
+        release_labels(game, actor.tmp_items)
         game._remove(actor.tmp_items)  # remove temporary items from game
     except AttributeError:
         log.warning("%s has no tmp_items in close_on_says. Might not be a problem in walkthrough_auto mode.",
@@ -1227,6 +1374,14 @@ def close_on_says(game, obj, player):
             actor.name, obj.tmp_text, actor.busy))
 
 
+def release_labels(game, names):
+    """ Give the labels of throwaway Text objects (eg a finished line of dialogue) back to the label pool """
+    for name in names or []:
+        obj = get_object(game, name)
+        if isinstance(obj, Text):
+            obj._release_label()
+
+
 def option_answer_callback(game, btn, player, *args):
     """ Called when the option is selected in on_asks """
     creator = get_object(game, btn.tmp_creator)
@@ -1241,6 +1396,7 @@ def option_answer_callback(game, btn, player, *args):
 
     # remove modals from game (mostly so we don't have to pickle the knotty
     # little bastard custom callbacks!)
+    release_labels(game, creator.tmp_items)
     game._remove(creator.tmp_items)
     game._remove(creator.tmp_modals)
     game._modals = []  # empty modals
@@ -1325,15 +1481,51 @@ def get_best_directory(game, d_raw_name):
     return None
 
 
+class BestFileCache(object):
+    """ Remember which file get_best_file picked for each raw path, keyed on the raw path and everything
+        that changes the answer (language, low memory, high contrast and mods) so that a warm lookup
+        doesn't touch the filesystem.
+
+        The files it picks from are looked up in game._metadata, which has the mod directory scanned
+        in alongside data/. Cleared with the metadata on Game._smart(refresh=True).
+    """
+
+    def __init__(self):
+        self._paths = {}  # (raw path, language, low memory, high contrast, mods): best file
+        self._scanned = False  # has the mod directory been read into game._metadata
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        self._paths = {}
+        self._scanned = False
+
+
 def get_best_file(game, f_raw):
     """ Test for mod high contrast, game high contrast, a mod directory, 
         the game directory or the pyvida directory and return the best option                 
         TODO: Low memory ignores high contrast.
     """
+    cache = game._best_files
+    key = (f_raw, language, game.low_memory, bool(game.settings and game.settings.high_contrast), CONFIG["mods"])
+    best = cache._paths.get(key)
+    if best is not None:
+        cache.hits += 1
+        return best
+    cache.misses += 1
+    if CONFIG["mods"] and not cache._scanned:
+        game._metadata.scan(["mod"])  # one walk of the mod directory, rather than a stat for every file
+        cache._scanned = True
+    best = cache._paths[key] = _find_best_file(game, f_raw)
+    return best
+
+
+def _find_best_file(game, f_raw):
+    exists = game._metadata.isfile
     if language:  # check for a locale override
         l = os.path.join(os.path.join('data', 'locale'), language)
         test_locale = os.path.join(l, f_raw)
-        if os.path.exists(test_locale):
+        if exists(test_locale):
             f_raw = test_locale
 
     d_raw, f_name = os.path.split(f_raw)
@@ -1369,17 +1561,37 @@ def get_best_file(game, f_raw):
             directories = [d]
     for directory in directories:
         test_f = get_safe_path(os.path.join(directory, f_name))
-        if os.path.exists(test_f):
+        if exists(test_f):
             return test_f
     return f_raw  # use default
 
 
+class FunctionCache(object):
+    """ Remember which function get_function found in the script modules for each name.
+
+        Cleared when the tracked modules change (Game.set_modules, check_modules,
+        reload_modules). Names that weren't found aren't remembered, so a function
+        defined (or attached to __main__) after it was first looked for is still
+        found. hits and misses count lookups answered from and added to the cache.
+    """
+
+    def __init__(self):
+        self._functions = {}  # name: function
+        self.calls = 0  # get_function calls
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        self._functions = {}
+
+
 def get_function(game, basic, obj=None, warn_on_empty=True):
     """ 
         Search memory for a function that matches this name 
         Also search any modules in game._modules (eg used when cProfile has
         taken control of __main__ )
         If obj provided then also search that object
+        The module search is remembered in game._function_cache
     """
     if not basic:
         if warn_on_empty:
@@ -1389,29 +1601,40 @@ def get_function(game, basic, obj=None, warn_on_empty=True):
         basic_name = basic.__name__
     else:
         basic_name = basic
+    if game:
+        game._function_cache.calls += 1
 
     if obj:
         fn = getattr(obj, basic_name, None)
         if fn and hasattr(fn, "__name__"):
             return fn
 
-    script = None
-    # which module to search for functions
-    module = "main" if android else "__main__"
-    extra_modules = game._modules if __name__ == "pyvida" and game else {}
-    modules = [module]
-    modules.extend(extra_modules.keys())
-    for m in modules:
-        if m not in sys.modules:
-            continue
-        if hasattr(sys.modules[m], basic_name):
-            script = getattr(sys.modules[m], basic_name)
-            break
-        elif hasattr(sys.modules[m], basic_name.lower()):
-            script = getattr(sys.modules[m], basic_name.lower())
-            break
-    if type(script) == tuple:
-        script = script[1]  # ungroup @answer fns
+    cache = game._function_cache if game else None
+    if cache and basic_name in cache._functions:
+        cache.hits += 1
+        script = cache._functions[basic_name]
+    else:
+        script = None
+        # which module to search for functions
+        module = "main" if android else "__main__"
+        extra_modules = game._modules if __name__ == "pyvida" and game else {}
+        modules = [module]
+        modules.extend(extra_modules.keys())
+        for m in modules:
+            if m not in sys.modules:
+                continue
+            if hasattr(sys.modules[m], basic_name):
+                script = getattr(sys.modules[m], basic_name)
+                break
+            elif hasattr(sys.modules[m], basic_name.lower()):
+                script = getattr(sys.modules[m], basic_name.lower())
+                break
+        if type(script) == tuple:
+            script = script[1]  # ungroup @answer fns
+        if cache:
+            cache.misses += 1
+            if script:  # not found might only mean not defined yet
+                cache._functions[basic_name] = script
     if not script and callable(basic):
         # basic function is already a function so fall back to that
         script = basic
@@ -1460,6 +1683,7 @@ def open_editor(game, filepath, track=True):
         if module_name not in game._modules and module_name != "__init__":
             print("ADDING %s TO MODULES" % module_name)
             game._modules[module_name] = 0
+            game._function_cache.clear()
             # add file directory to path so that import can find it
             if os.path.dirname(filepath) not in sys.path:
                 sys.path.append(os.path.dirname(filepath))
@@ -1492,6 +1716,25 @@ def update_progress_bar(game, obj):
         game._window.set_mouse_visible(True)
 
 
+def grab_screen():
+    """ The colour buffer as (w, h, RGB bytes from the top row down) for write_screenshot """
+    image = pyglet.image.get_buffer_manager().get_color_buffer().get_image_data()
+    return image.width, image.height, image.get_data("RGB", -image.width * 3)
+
+
+def write_screenshot(screen, filename, size=None):
+    """ Save a grab_screen, plus a png shrunk to fit size if requested. Safe to call from another thread. """
+    from PIL import Image
+    w, h, data = screen
+    img = Image.frombytes("RGB", (w, h), data)
+    fname, ext = os.path.splitext(filename)
+    if ext.lower() != ".png":
+        img.save(filename)
+    if size:
+        img.thumbnail(size, Image.ANTIALIAS)
+    img.save(fname + ".png")
+
+
 """
 Classes
 """
@@ -1817,6 +2060,93 @@ class MotionDelta(object):
         return n
 
 
+_motion_tracks = {}  # motion file: (text, destructive, MotionTrack), shared by every motion loaded from it
+
+
+class MotionTrack(object):
+    """ The deltas of a motion packed into one array of floats (0 where a delta doesn't set the field)
+        with a bitmask per delta of which fields it sets, and the running x, y and distance travelled
+        before each delta so path planning can look up how far along the motion a distance gets it.
+    """
+
+    def __init__(self, deltas=()):
+        self.values = array("d")  # len(MOTION_FIELDS) per delta
+        self.present = array("B")  # MOTION_X | MOTION_Y ... for each delta
+        self.fields = 0  # every field set by any delta
+        self.cumulative_x = array("d", [0])
+        self.cumulative_y = array("d", [0])
+        self.cumulative_distance = array("d", [0])
+        self.shared = False  # loaded from a file and used by other motions, so copy before changing
+        for d in deltas:
+            self.append(d)
+
+    def __len__(self):
+        return len(self.present)
+
+    def append(self, d):
+        d = list(d) + [None] * (len(MOTION_FIELDS) - len(d))
+        present = 0
+        for i, v in enumerate(d):
+            if v is not None:
+                present |= 1 << i
+        self.values.extend([v if v is not None else 0 for v in d])
+        self.present.append(present)
+        self.fields |= present
+        dx, dy = self.values[-len(MOTION_FIELDS)], self.values[-len(MOTION_FIELDS) + 1]
+        self.cumulative_x.append(self.cumulative_x[-1] + dx)
+        self.cumulative_y.append(self.cumulative_y[-1] + dy)
+        self.cumulative_distance.append(self.cumulative_distance[-1] + math.hypot(dx, dy))
+
+    def copy(self):
+        track = MotionTrack()
+        for name in ["values", "present", "cumulative_x", "cumulative_y", "cumulative_distance"]:
+            setattr(track, name, array(getattr(self, name).typecode, getattr(self, name)))
+        track.fields = self.fields
+        return track
+
+    def delta(self, i):
+        """ delta i as a tuple, with None for the fields it doesn't set """
+        base = i * len(MOTION_FIELDS)
+        present = self.present[i]
+        return tuple(self.values[base + field] if present & (1 << field) else None
+                     for field in range(len(MOTION_FIELDS)))
+
+    def column(self, field):
+        return self.values[field::len(MOTION_FIELDS)]
+
+
+def read_motion_file(fname, text):
+    """ Compile the text of a .motion file, returns (destructive, MotionTrack). Only compiled again if it changes """
+    if fname in _motion_tracks and _motion_tracks[fname][0] == text:
+        return _motion_tracks[fname][1:]
+    track = MotionTrack()
+    destructive = True
+    # first line is metadata (variable names and default)
+    data = text.splitlines(True)
+    meta = data[0]
+    if meta[0] == "*":  # flag to set motion to non-destructive
+        destructive = False
+        meta = meta[1:]
+    meta = meta.strip().split(",")
+    for line in data[1:]:
+        if line[0] == "#":
+            continue  # allow comments after metadata
+        if line == "\n":  # skip empty lines
+            continue
+        m = MotionDelta()
+        d = line.strip().split(",")
+        for i, key in enumerate(meta):
+            try:
+                setattr(m, key, float(d[i]))
+            except:
+                import pdb
+                pdb.set_trace()
+        track.append(m.flat)
+    track.shared = True
+    _motion_tracks[fname] = (text, destructive, track)
+    return destructive, track
+
+
 class Motion(object):
     """ A motion is an event independent set of displacement values for an Actor or Scene
         Perfect for setting up repetitive background motions.
@@ -1828,66 +2158,116 @@ class Motion(object):
         self.game = None
         self._filename = None
         # (x,y,z,rotate,scale) NOTE: scale is absolute, not a delta
-        self.deltas = []
+        self._track = MotionTrack()
         self.default = LOOP
         self.mode = self.default
         self.index = 0  # where in the motion we currently are
         self.blocking = False  # block events from firing
         self.destructive = True  # apply permanently to actor
 
-        self._average_dx = 0  # useful for pathplanning
-        self._average_dy = 0
-        self._total_dx = 0
-        self._total_dy = 0
-
     def __getstate__(self):
         self.game = None
         return self.__dict__
 
+    def __setstate__(self, state):
+        if "deltas" in state:  # saved before motions were packed into a MotionTrack
+            state["_track"] = MotionTrack(state.pop("deltas"))
+            for key in ["_average_dx", "_average_dy", "_total_dx", "_total_dy"]:
+                state.pop(key, None)
+        self.__dict__.update(state)
+
+    def get_deltas(self):
+        return [self._track.delta(i) for i in range(len(self._track))]
+
+    def set_deltas(self, deltas):
+        self._track = MotionTrack(deltas)
+
+    deltas = property(get_deltas, set_deltas)
+
+    @property
+    def num_of_deltas(self):
+        return len(self._track)
+
+    @property
+    def _average_dx(self):  # useful for pathplanning
+        return self._track.cumulative_x[-1] / len(self._track) if len(self._track) else 0
+
+    @property
+    def _average_dy(self):
+        return self._track.cumulative_y[-1] / len(self._track) if len(self._track) else 0
+
+    @property
+    def _total_dx(self):
+        return self._track.cumulative_x[-1]
+
+    @property
+    def _total_dy(self):
+        return self._track.cumulative_y[-1]
+
+    @property
+    def distance(self):
+        """ How far one pass of the motion travels """
+        return self._track.cumulative_distance[-1]
+
+    @property
+    def vectorisable(self):
+        """ Can apply_to_particles apply this motion to all of an emitter's particles at once? """
+        return np is not None and self.destructive is True and self.mode != ONCE and \
+            not self._track.fields & MOTION_F
+
     def add_delta(self, x=None, y=None, z=None, r=None, scale=None, f=None, alpha=None):
-        self.deltas.append([x, y, z, r, scale, f, alpha])
+        if self._track.shared:  # don't change the other motions loaded from the same file
+            self._track = self._track.copy()
+        self._track.append([x, y, z, r, scale, f, alpha])
 
     def add_deltas(self, deltas):
         for d in deltas:
             self.add_delta(*d)
 
-    def _apply_delta(self, actor, d):
-        dx, dy, z, r, scale, frame_index, alpha = d
-        if actor.scale != 1.0:
-            if dx != None: dx *= actor.scale
-            if dy != None: dy *= actor.scale
-
-        if self.destructive is True:  # apply to actor's actual co-ordinates
-            actor.x += dx if dx != None else 0
-            actor.y += dy if dy != None else 0
-        else:  # apply only to a temporary visual displacement
-            actor._vx += dx if dx != None else 0
-            actor._vy += dy if dy != None else 0
-        actor.z += d[2] if d[2] != None else 0
-        actor.rotate += d[3] if d[3] != None else 0
-        if d[4] != None: actor.scale = d[4]
-        if d[5] != None:
-            actor._frame(int(d[5]))
+    def _apply_delta(self, actor, i):
+        """ Apply delta i of the motion to actor, only touching the fields the delta sets """
+        track = self._track
+        present = track.present[i]
+        if not present:
+            return
+        values = track.values
+        base = i * len(MOTION_FIELDS)
+        if present & (MOTION_X | MOTION_Y):
+            dx, dy = values[base], values[base + 1]
+            if actor.scale != 1.0:
+                dx *= actor.scale
+                dy *= actor.scale
+            if self.destructive is True:  # apply to actor's actual co-ordinates
+                if present & MOTION_X: actor.x += dx
+                if present & MOTION_Y: actor.y += dy
+            else:  # apply only to a temporary visual displacement
+                if present & MOTION_X: actor._vx += dx
+                if present & MOTION_Y: actor._vy += dy
+        if present & MOTION_Z: actor.z += values[base + 2]
+        if present & MOTION_R: actor.rotate += values[base + 3]
+        if present & MOTION_SCALE: actor.scale = values[base + 4]
+        if present & MOTION_F:
+            actor._frame(int(values[base + 5]))
         #            if actor.action.mode != MANUAL:
 
         #                print("warning: %s action %s not in manual mode, so motion %s "
         #                      "frame requests fighting with auto frame advance"%
         #                      (actor.name, actor.action.name, self.name))
-        if d[6] != None: actor.alpha = d[6]
+        if present & MOTION_ALPHA: actor.alpha = values[base + 6]
 
     def apply_full_motion_to_actor(self, actor, index=None):
         """ Apply motion to an actor during headless mode. 
             Used in headless mode when motion is to be applied once.
         """
-        for d in self.deltas:
-            self._apply_delta(actor, d)
+        for i in range(len(self._track)):
+            self._apply_delta(actor, i)
 
     def apply_to_actor(self, actor, index=None):
         """ Apply the current frame to the actor and increment index, return
         False to delete the motion """
-        num_deltas = len(self.deltas)
+        num_deltas = len(self._track)
         delta_index = index if index else self.index
-        if len(self.deltas) < delta_index % num_deltas:
+        if num_deltas < delta_index % num_deltas:
             return True
         if self.mode == ONCE and delta_index == num_deltas:
             self.index = 0
@@ -1899,20 +2279,39 @@ class Motion(object):
                                  actor.name, self.name, actor.busy))
             return False
 
-        d = self.deltas[delta_index % num_deltas]
-        self._apply_delta(actor, d)
+        self._apply_delta(actor, delta_index % num_deltas)
         if index is None:
             self.index += 1
         return True
 
+    def apply_to_particles(self, particles, s):
+        """ apply_to_actor for the particles[s] of a ParticleArrays in one go, each at its own motion_index """
+        track = self._track
+        num_deltas = len(track)
+        if num_deltas == 0 or len(particles) == 0:
+            return
+        index = particles.motion_index[s]
+        index = np.where(index != 0, index, self.index) % num_deltas  # like apply_to_actor, 0 uses self.index
+        values = np.frombuffer(track.values, dtype=float).reshape(num_deltas, len(MOTION_FIELDS))[index]
+        present = np.frombuffer(track.present, dtype=np.uint8)[index]
+        scale = particles.scale[s]
+        particles.x[s] += values[:, 0] * scale  # unset fields are 0
+        particles.y[s] += values[:, 1] * scale
+        particles.z[s] += values[:, 2]
+        particles.rotate[s] += values[:, 3]
+        if track.fields & MOTION_SCALE:
+            particles.scale[s] = np.where(present & MOTION_SCALE, values[:, 4], scale)
+        if track.fields & MOTION_ALPHA:
+            particles.alpha[s] = np.where(present & MOTION_ALPHA, values[:, 6], particles.alpha[s])
+
     def apply_to_scene(self, scene, index=None):
         """ Motions applied to scenes are visual only and absolute (ie only the current value is applied 
             This function is called during pyglet_draw, after the scene has been centred.           
             TODO: only looping motions that affect scale are implemented
         """
-        num_deltas = len(self.deltas)
+        num_deltas = len(self._track)
         delta_index = index if index else self.index
-        d = self.deltas[delta_index % num_deltas]
+        d = self._track.delta(delta_index % num_deltas)
         dx, dy, z, r, scale, frame_index, alpha = d
         pyglet.gl.glScalef(scale, scale, 1)
         #        import pdb; pdb.set_trace()
@@ -1920,10 +2319,39 @@ class Motion(object):
             self.index += 1
         return True
 
+    def goto_deltas(self, distance, scale=1.0):
+        """ The (dx, dy) steps of the motion, at scale, that travel distance, the last one shortened to fit
+            (or dropped if less than half a step), and the total dy of those steps including a dropped one.
+            Finds how many whole steps fit from the running distance totals rather than stepping through.
+        """
+        track = self._track
+        num_deltas = len(track)
+        cycle = track.cumulative_distance[-1] * scale
+        if num_deltas == 0 or cycle <= 0:
+            return [], 0
+        cycles = int(distance // cycle)
+        remainder = (distance - cycles * cycle) / scale
+        whole = bisect.bisect_right(track.cumulative_distance, remainder) - 1  # whole steps in the last pass
+        xs, ys = track.column(0), track.column(1)
+        steps = [(x * scale, y * scale) for x, y in zip(xs, ys)]
+        deltas = steps * cycles + steps[:whole]
+        travelled_y = (cycles * track.cumulative_y[-1] + track.cumulative_y[whole]) * scale
+        left = remainder - track.cumulative_distance[whole]
+        i = whole % num_deltas
+        dd = math.hypot(xs[i], ys[i])
+        if left > 0 and dd > 0:  # overshoot, aim closer
+            ratio = left / dd
+            dx, dy = steps[i][0] * ratio, steps[i][1] * ratio
+            travelled_y += dy
+            if ratio >= 0.5:  # a very small last step is better not done
+                deltas.append((dx, dy))
+        return deltas, travelled_y
+
     def half_speed(self):
         new_deltas = []
-        for i in range(0, len(self.deltas) - 1):
-            a = MotionDelta(*self.deltas[i])
+        deltas = self.deltas  # rebuilt from the track on each access, so only once
+        for i in range(0, len(deltas) - 1):
+            a = MotionDelta(*deltas[i])
             a.x /= 2
             a.y /= 2
             #            b = MotionDelta(*self.deltas[i+1])
@@ -1933,9 +2361,10 @@ class Motion(object):
 
     def double_tempo(self):
         new_deltas = []
-        for i in range(0, len(self.deltas) - 1, 2):
-            a = MotionDelta(*self.deltas[i])
-            b = MotionDelta(*self.deltas[i + 1])
+        deltas = self.deltas
+        for i in range(0, len(deltas) - 1, 2):
+            a = MotionDelta(*deltas[i])
+            b = MotionDelta(*deltas[i + 1])
             nd = a + b
             new_deltas.append(nd.flat)
         self.deltas = new_deltas
@@ -1960,39 +2389,12 @@ class Motion(object):
         fname = fname + ".motion"
         self._filename = fname
         fname = get_safe_path(fname)
-        if not os.path.isfile(fname):
-            pass
-        else:
-            with open(fname, "r") as f:
-                # first line is metadata (variable names and default)
-                data = f.readlines()
-                meta = data[0]
-                if meta[0] == "*":  # flag to set motion to non-destructive
-                    #                    print("motion %s is non-destructive"%self.name)
-                    self.destructive = False
-                    meta = meta[1:]
-                meta = meta.strip().split(",")
-                for line in data[1:]:
-                    if line[0] == "#":
-                        continue  # allow comments after metadata
-                    if line == "\n":  # skip empty lines
-                        continue
-                    m = MotionDelta()
-                    d = line.strip().split(",")
-                    for i, key in enumerate(meta):
-                        try:
-                            setattr(m, key, float(d[i]))
-                        except:
-                            import pdb
-                            pdb.set_trace()
-                    self.deltas.append(m.flat)
-                    self._average_dx += m.x if m.x else 0
-                    self._average_dy += m.y if m.y else 0
-                    self._total_dx += m.x if m.x else 0
-                    self._total_dy += m.y if m.y else 0
-        if len(self.deltas) > 0:
-            self._average_dx /= len(self.deltas)
-            self._average_dy /= len(self.deltas)
+        text = game._metadata.read(fname)
+        if text is not None:
+            destructive, self._track = read_motion_file(fname, text)
+            if destructive is False:
+                #                    print("motion %s is non-destructive"%self.name)
+                self.destructive = False
         return self
 
 
@@ -2009,6 +2411,19 @@ def set_resource(key, w=False, h=False, resource=False, subkey=None):
     _resources[key] = (ow, oh, oresource)
 
 
+def _use_atlas_page(page, user):
+    _atlas_page_users.setdefault(page, set()).add(user)
+
+
+def _release_atlas_page(page, user):
+    """ user (an action's resource name) is done with this atlas page, unload the page if no other action uses it """
+    users = _atlas_page_users.get(page, set())
+    users.discard(user)
+    if not users:
+        _atlas_page_users.pop(page, None)
+        _atlas_pages.pop(page, None)
+
+
 def get_resource(key, subkey=None):
     if subkey: key = "%s_%s" % (key, subkey)
     r = _resources[key] if key in _resources else (0, 0, None)
@@ -2017,13 +2432,13 @@ def get_resource(key, subkey=None):
 
 def load_defaults(game, obj, name, filename):
     """ Load defaults from a json file into the obj, used by Actors and Actions """
-    if os.path.isfile(filename):
-        with open(filename, 'r') as f:
-            try:
-                defaults = json.loads(f.read())
-            except ValueError:
-                if logging: log.error("Error loading %s.defaults file." % name)
-                defaults = {}
+    text = game._metadata.read(filename)
+    if text is not None:
+        try:
+            defaults = json.loads(text)
+        except ValueError:
+            if logging: log.error("Error loading %s.defaults file." % name)
+            defaults = {}
         for key, val in defaults.items():
             if key == "interact_key":
                 key = "_interact_key"
@@ -2093,6 +2508,7 @@ class Action(object):
         self._manual_index = 0  # used by MANUAL mode to lock animation at a single frame
         self._x, self._y = 0, 0  # is this action offset from the regular actor's x,y
         self._displace_clickable = False  # if action is displaced, also displace clickable_area
+        self._atlas_page = None  # the atlas page this action's frames are on, while loaded
 
     def __getstate__(self):
         self.game = None
@@ -2124,22 +2540,23 @@ class Action(object):
     def _load_montage(self, filename):
         fname = os.path.splitext(filename)[0]
         montage_fname = get_safe_path(fname + ".montage")
+        metadata = self.game._metadata
 
-        if not os.path.isfile(montage_fname):
-            if not os.path.isfile(get_safe_path(filename)):
+        montage = metadata.read(montage_fname)
+        if montage is None:
+            if not metadata.isfile(filename):
                 w, h = 0, 0
             else:
-                w, h = get_image_size(filename)
+                w, h = metadata.image_size(filename)
             num = 1  # single frame animation
         else:
-            with open(montage_fname, "r") as f:
-                try:
-                    num, w, h = [int(i) for i in f.readlines()]
-                except ValueError as err:
-                    if logging:
-                        log.error("Can't read values in %s (%s)" %
-                                  (self.name, montage_fname))
-                    num, w, h = 0, 0, 0
+            try:
+                num, w, h = [int(i) for i in montage.splitlines()]
+            except ValueError as err:
+                if logging:
+                    log.error("Can't read values in %s (%s)" %
+                              (self.name, montage_fname))
+                num, w, h = 0, 0, 0
         self.num_of_frames = num
         return (w, h, num)
 
@@ -2159,19 +2576,68 @@ class Action(object):
         #        self.load_assets(game)
 
         # backwards compat to v1 offset files
-        if os.path.isfile(fname + ".offset"):  # load per-action displacement (on top of actor displacement)
-            with open(fname + ".offset", "r") as f:
-                try:
-                    self._x, self._y = [int(i) for i in f.readlines()]
-                    self._x = -self._x  # inverted for backwards compat
-                except ValueError:
-                    if logging: log.error("Can't read values in %s.%s.offset" % (self.name, fname))
-                    self._x, self._y = 0, 0
+        offset = game._metadata.read(fname + ".offset")
+        if offset is not None:  # load per-action displacement (on top of actor displacement)
+            try:
+                self._x, self._y = [int(i) for i in offset.splitlines()]
+                self._x = -self._x  # inverted for backwards compat
+            except ValueError:
+                if logging: log.error("Can't read values in %s.%s.offset" % (self.name, fname))
+                self._x, self._y = 0, 0
         return self
 
+    def _atlas_file(self, game, fname):
+        """ The .atlas for this action if tools/atlas has packed it and the spritesheet hasn't changed since """
+        atlas = get_best_file(game, fname + ".atlas")
+        image = get_best_file(game, self._image)
+        if os.path.dirname(atlas) != os.path.dirname(image):
+            return None
+        atlas_time = game._metadata.mtime(atlas)
+        if atlas_time is None:
+            return None
+        image_time = game._metadata.mtime(image)
+        if image_time is not None and image_time > atlas_time:
+            return None
+        return atlas
+
+    def _load_atlas(self, game, fname):
+        """ If tools/atlas has packed this action, return its frames as regions of the shared atlas page.
+            Ignored if the spritesheet is newer than the .atlas or is being overridden (eg by a mod).
+        """
+        atlas = self._atlas_file(game, fname)
+        if not atlas:
+            return None
+        try:
+            data = json.loads(game._metadata.read(atlas) or "")
+        except (IOError, ValueError):
+            if logging:
+                log.error("Can't read atlas %s for %s" % (atlas, self.name))
+            return None
+        if len(data["frames"]) != self.num_of_frames:
+            return None
+        page = os.path.normpath(os.path.join(os.path.dirname(atlas), data["page"]))
+        texture = _atlas_pages.get(page)
+        if texture is None:
+            page_image = load_image(page)
+            if not page_image:
+                return None
+            texture = _atlas_pages[page] = page_image.get_texture()
+        _use_atlas_page(page, self.resource_name)
+        if page != getattr(self, "_atlas_page", page):  # repacked onto a different page
+            self._release_atlas()
+        self._atlas_page = page
+        return [texture.get_region(x, texture.height - y - h, w, h) for x, y, w, h in data["frames"]]
+
+    def _release_atlas(self):
+        page = getattr(self, "_atlas_page", None)  # older saves predate atlases
+        if page:
+            _release_atlas_page(page, self.resource_name)
+        self._atlas_page = None
+
     def unload_assets(self):  # action.unload
         #        log.debug("UNLOAD ASSETS %s %s"%(self.actor, self.name))
         set_resource(self.resource_name, resource=None)
+        self._release_atlas()
         self._loaded = False
 
     def load_assets(self, game, skip_if_loaded=False):  # action.load_assets
@@ -2195,13 +2661,13 @@ class Action(object):
         full_load = True
         resource = False  # don't update resource
         if game._headless:  # only load defaults
-            if os.path.isfile(quickload):  # read w,h without loading full image
+            data = game._metadata.read(quickload)
+            if data is not None:  # read w,h without loading full image
                 try:
-                    with open(quickload, "r") as f:
-                        # first line is metadata (variable names and default)
-                        data = f.readlines()
-                        w, h = data[1].split(",")
-                        w, h = int(w), int(h)
+                    # first line is metadata (variable names and default)
+                    data = data.splitlines()
+                    w, h = data[1].split(",")
+                    w, h = int(w), int(h)
                     full_load = False
                 except IndexError:  # problem with quickload file, so nuke it and full load and rebuild.
                     print("Problem with", quickload)
@@ -2211,12 +2677,18 @@ class Action(object):
                         pass
 
         if full_load:
-            image = load_image(get_best_file(game, self._image))
-            if not image:
-                log.error("Load action {} assets for actor {} has not loaded an image".format(
-                    self.name, getattr(actor, "name", actor)))
-                return
-            image_seq = pyglet.image.ImageGrid(image, 1, self.num_of_frames)
+            image_seq = self._load_atlas(game, fname)  # frames packed by tools/atlas
+            if not image_seq:
+                self._release_atlas()  # the atlas is stale, so back to the spritesheet
+                image_file = get_best_file(game, self._image)
+                image = game._asset_loader.take(image_file)  # already decoded in the background?
+                if not image:
+                    image = load_image(image_file)
+                if not image:
+                    log.error("Load action {} assets for actor {} has not loaded an image".format(
+                        self.name, getattr(actor, "name", actor)))
+                    return
+                image_seq = pyglet.image.ImageGrid(image, 1, self.num_of_frames)
             frames = []
             if game is None:
                 log.error("Load assets for {} has no game object".format(
@@ -2226,16 +2698,17 @@ class Action(object):
                 frames.append(pyglet.image.AnimationFrame(
                     frame, 1 / getattr(game, "default_actor_fps", DEFAULT_ACTOR_FPS)))
             resource = pyglet.image.Animation(frames)  # update the resource
-            w = image_seq.item_width
-            h = image_seq.item_height
+            w = frames[0].image.width
+            h = frames[0].image.height
 
         set_resource(self.resource_name, resource=resource, w=w, h=h)
         self._loaded = True
-        if full_load is True and not os.path.isfile(quickload):
+        if full_load is True and not game._metadata.isfile(quickload):
             try:
                 with open(quickload, "w") as f:
                     f.write("w,h\n")
                     f.write("%s,%s\n" % (w, h))
+                game._metadata.forget(quickload)
             except IOError:
                 print("unable to create", quickload)
 
@@ -2576,7 +3049,7 @@ class MotionManager(metaclass=use_on_events):
 
     def _smart_motions(self, game, exclude=[]):
         """ smart load the motions """
-        motions = glob.glob(os.path.join(self.directory, "*.motion"))
+        motions = game._metadata.glob(self.directory, ".motion")
         for motion_file in motions:
             motion_name = os.path.splitext(os.path.basename(motion_file))[0]
             if motion_name in exclude:
@@ -2596,7 +3069,7 @@ class MotionManager(metaclass=use_on_events):
             motion.mode = mode
             motion.blocking = block
             if index == -1:
-                motion.index = randint(0, len(motion.deltas))
+                motion.index = randint(0, motion.num_of_deltas)
             else:
                 motion.index = index
             if destructive is not None:
@@ -2643,6 +3116,7 @@ class MotionManager(metaclass=use_on_events):
 
 
 class Actor(MotionManager, metaclass=use_on_events):
+    _busy_wakes_events = True  # set_busy tells game._events when this actor is free
 
     def __init__(self, name, interact=None, display_text=None, look=None, drag=None):
         super().__init__()
@@ -2786,6 +3260,8 @@ class Actor(MotionManager, metaclass=use_on_events):
         for action in self._actions.values():
             action.unload_assets()
         set_resource(self.resource_name, resource=None)
+        if self.game:
+            self.game._resource_cache.forget(self)
 
     def load_assets(self, game, skip_if_loaded=False):  # actor.load_assets
         self.game = game
@@ -2794,7 +3270,9 @@ class Actor(MotionManager, metaclass=use_on_events):
         for action in self._actions.values():
             action.load_assets(game, skip_if_loaded=skip_if_loaded)
 
-        return self.switch_asset(self.action)
+        sprite = self.switch_asset(self.action)
+        game._resource_cache.loaded(game, self)
+        return sprite
 
     def on_refresh_assets(self, game):
         self.unload_assets()
@@ -2909,11 +3387,23 @@ class Actor(MotionManager, metaclass=use_on_events):
              self.set_editing_save, bool),
         ]
 
+    def get_display_text(self):
+        return self.__dict__.get("display_text", None)
+
+    def set_display_text(self, v):
+        self.__dict__["display_text"] = v  # stored under the old attribute name so existing saves still load
+        if getattr(self, "game", None):
+            self.game._name_index.update(self)
+
+    display_text = property(get_display_text, set_display_text)
+
     def get_busy(self):
         return self._busy
 
     def set_busy(self, v):
         self._busy = v
+        if v <= 0 and getattr(self, "game", None):  # let the event queue retire this actor's events
+            self.game._events.wake(self)
 
     busy = property(get_busy, set_busy)
 
@@ -2973,6 +3463,31 @@ class Actor(MotionManager, metaclass=use_on_events):
             self.resource._animation.anchor_x = self._ax
             self.resource._animation.anchor_y = self._ay
 
+    # changing these can move the clickable area, so the game's HitIndex needs to know
+    _hit_attributes = frozenset(["_x", "_y", "_ax", "_ay", "_scale", "_clickable_area", "_clickable_fullscreen",
+                                 "_parent", "_action"])
+
+    # changing these can move or remove a solid area, so the game's SolidIndex needs to know
+    _solid_attributes = frozenset(["_x", "_y", "_ax", "_ay", "_scale", "_solid_area", "_allow_update"])
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        game = self.__dict__.get("game")
+        if not game:
+            return
+        if name in self._hit_attributes:
+            hit_index = getattr(game, "_hit_index", None)
+            if hit_index:
+                hit_index.moved(self)
+        if name in self._solid_attributes:
+            solid_index = getattr(game, "_solid_index", None)
+            if solid_index:
+                solid_index.moved(self)
+        if name not in SaveCache.transient:
+            save_cache = getattr(game, "_save_cache", None)
+            if save_cache:
+                save_cache.mark(self.__dict__.get("name"))
+
     def get_x(self):  # actor.x
         return self._x
 
@@ -3235,6 +3750,8 @@ class Actor(MotionManager, metaclass=use_on_events):
 
     @property
     def resource(self):
+        if self.game and self.name in self.game._resource_cache.evicted:  # unloaded to save memory, so reload
+            self.game._resource_cache.restore(self.game, self)
         return get_resource(self.resource_name)[-1]
 
     @property
@@ -3475,7 +3992,17 @@ class Actor(MotionManager, metaclass=use_on_events):
     #        else:
     # return collide(self._image().get_rect().move(self.x, self.y), x, y)
 
+    def _mark_scripted(self, *objects):
+        """ Scripts run straight away (not as events) may change their objects in place,
+            eg appending to a list, so tell the save cache to record them again """
+        if not self.game:
+            return
+        for obj in (self, self.game.player) + objects:
+            if obj:
+                self.game._save_cache.mark(obj.name)
+
     def trigger_interact(self):
+        self._mark_scripted()
         if self.interact:  # if user has supplied an interact override
             if type(self.interact) in [str]:
                 interact = get_memorable_function(self.game, self.interact)
@@ -3544,6 +4071,7 @@ class Actor(MotionManager, metaclass=use_on_events):
     def trigger_use(self, actor, execute=True):
         # user actor on this actee
         actor = get_object(self.game, actor)
+        self._mark_scripted(actor)
 
         slug_actor = slugify(actor.name)
         slug_actee = slugify(self.name)
@@ -3596,6 +4124,7 @@ class Actor(MotionManager, metaclass=use_on_events):
 
 
     def trigger_look(self):
+        self._mark_scripted()
         # do the signals for pre_look
         for receiver, sender in pre_look.receivers:
             if isinstance(self, sender):
@@ -3813,13 +4342,14 @@ class Actor(MotionManager, metaclass=use_on_events):
             absd = myd
         else:
             absd = os.path.join(working_dir, myd)
-        if not os.path.isdir(absd):  # fallback to pyvida defaults
+        metadata = game._metadata
+        if not metadata.isdir(absd):  # fallback to pyvida defaults
             this_dir, this_filename = os.path.split(script_filename)  # script_filename is absolute location of pyvida
             log.debug("Unable to find %s, falling back to %s" %
                       (myd, this_dir))
             myd = os.path.join(this_dir, get_relative_path(d), name)
             absd = get_safe_path(myd)
-        if not os.path.isdir(absd) and not image:  # fallback to deprecated menu default if item 
+        if not metadata.isdir(absd) and not image:  # fallback to deprecated menu default if item 
             log.warning(
                 "***WARNING %s %s might need to be moved to items/ or emitters/, trying menu/ for now." % (d, name))
             if "data/items" in d:
@@ -3832,8 +4362,8 @@ class Actor(MotionManager, metaclass=use_on_events):
         if image:
             images = image if type(image) == list else [image]
         else:
-            images = glob.glob(os.path.join(absd, "*.png"))
-            if os.path.isdir(absd) and len(glob.glob("%s/*" % absd)) == 0:
+            images = metadata.glob(absd, ".png")
+            if metadata.isdir(absd) and len(metadata.glob(absd)) == 0:
                 if logging:
                     log.info(
                         "creating placeholder file in empty %s dir" % name)
@@ -3933,6 +4463,23 @@ class Actor(MotionManager, metaclass=use_on_events):
         y += self._vy
         return x, y
 
+    def _batchable(self):
+        """ Can this actor be drawn as part of a shared batch (see RenderPipeline)?
+            Not if it needs its own gl transforms, extra draws or debug info.
+        """
+        if type(self).pyglet_draw is not Actor.pyglet_draw:
+            return False
+        return not (self._rotate or self._fx_sway or self._flip_horizontal or self._flip_vertical or
+                    self._scroll_dx or self._use_astar or self.show_debug)
+
+    def _pyglet_batch_position(self, sprite, absolute=False, window=None):
+        """ Place this actor's sprite for drawing in a batch, the batched equivalent of pyglet_draw """
+        x, y = self.pyglet_draw_coords(absolute, window, sprite.height)
+        # if action mode is manual (static), force the frame index to the manual frame
+        if self.action and self.action.mode == MANUAL:
+            sprite._frame_index = self.action._manual_index
+        sprite.position = (x, y)
+
     def pyglet_draw(self, absolute=False, force=False, window=None):  # actor.draw
         if self.game and self.game._headless and not force:
             return
@@ -3940,7 +4487,7 @@ class Actor(MotionManager, metaclass=use_on_events):
             print(self.name, "has no game attribute")
             return
 
-        sprite = get_resource(self.resource_name)[-1]
+        sprite = self.resource
         if sprite and self.allow_draw:
             glPushMatrix()
             x, y = self.pyglet_draw_coords(absolute, window, sprite.height)
@@ -3984,108 +4531,9 @@ class Actor(MotionManager, metaclass=use_on_events):
                 y -= sprite.height
 
             if self._use_astar and self.game.scene:  # scale based on waypoints
-                distances = []
-                total_distances = 0
-
-                # get waypoints with z values
-                # So for a triangle p1, p2, p3, if the vector U = p2 - p1 and the vector V = p3 - p1 then the normal N = U x V and can be calculated by:
-
-                # Nx = UyVz - UzVy
-                # Ny = UzVx - UxVz
-                # Nz = UxVy - UyVx
-                def normal2(p1, p2, p3):
-                    U = tuple(map(sub, p2, p1))
-                    V = tuple(map(sub, p3, p1))
-                    #                    normal = itertools.product([a,b])
-                    Nx = U[1] * V[2] - U[2] * V[1]
-                    Ny = U[2] * V[0] - U[0] * V[2]
-                    Nz = U[0] * V[1] - U[1] * V[0]
-                    return Nx, Ny, Nz
-
-                def solvez(vs, x, y):
-                    a, b, c = normal2(*vs)
-                    x0, y0, z0 = v0 = vs[0]
-
-                    # a*(x-x0) + b*(y-y0) + c*(z-z0) = 0
-                    #                    c = (c*z0 - a*(x-x0) - b*(y-y0))/z
-                    if c == 0:
-                        print("c is zero", vs)
-                        return 0
-                    z = (-a * (x - x0) - b * (y - y0) + c * z0) / c
-                    return z
-
-                def solvez2(vs, x, y):
-                    x1, y1, z1 = vs[0]
-                    x2, y2, z2 = vs[1]
-                    x3, y3, z3 = vs[2]
-                    A = y1 * (z2 - z3) + y2 * (z3 - z1) + y3 * (z1 - z2)
-                    B = z1 * (x2 - x3) + z2 * (x3 - x1) + z3 * (x1 - x2)
-                    C = x1 * (y2 - y3) + x2 * (y3 - y1) + x3 * (y1 - y2)
-                    D = -x1 * (y2 * z3 - y3 * z2) - x2 * (y3 * z1 - y1 * z3) - x3 * (y1 * z2 - y2 * z1)
-                    if C == 0:
-                        print("c is zero", vs)
-                        return 0
-                    z = (D - A * x - B * y) / C
-                    return z
-
-                def normal(v1, v2, v3):
-                    a = tuple(map(sub, v1, v2))
-                    b = tuple(map(sub, v1, v3))
-                    return itertools.product([a, b])
-
-                px, py = self.x, self.y
-                wps = [w for w in self.game.scene.walkarea._waypoints if len(w) == 3]
-                # 1. Find nearest wp
-                # 2. check other wps to find if we form two angles less than 90 degrees, if so, use those wps.
-                # 3. use the (one or) two points to work out scale factor
-                # XXX current implementation only uses 1 or 2 z-scaling waypoints.
-                for wp in wps:
-                    #                    pt = wp[0], height-wp[1] # invert waypoint y for pyglet
-                    d = distance(wp, (px, py))  # XXX ignores parents, scrolling.
-                    distances.append((d, wp))
-                    total_distances += d
-                if total_distances >= 2:  # only use first two z-values, scenes should only have two.
-                    distances.sort()  # for many waypoints, we would sort and use nearest as basic for finding best triangle.
-                    nearest = distances.pop(0)[1]
-                    second = distances.pop(0)[1]
-                    a = distance((px, py), nearest)
-                    b = distance((px, py), second)
-                    c = distance(nearest, second)
-                    angle_c = math.acos((a ** 2 + b ** 2 - c ** 2) / (2 * a * b))
-                    angle_a = math.acos((b ** 2 + c ** 2 - a ** 2) / (2 * b * c))
-                    angle_b = math.acos((c ** 2 + a ** 2 - b ** 2) / (2 * c * a))
-                    # self.game.scene.walkarea._editing = True
-                    if angle_a < math.pi / 2 and angle_b < math.pi / 2:  # player is "between" the two weigh points, so scale
-                        total_distance = a + b
-                        a_scale = nearest[-1]
-                        b_scale = second[-1]
-                        # we need to project onto C, create new right triangle using player and nearest and perp to full triangle
-
-                        # project = a * cos(angle_a) = 20.59 #should be 20 exactly?
-                        angle_a2 = (math.pi / 2) - angle_b
-                        c2 = a
-                        angle_c2 = math.pi / 2  # 90 degrees
-                        project = a2 = sin(angle_a2) * (c2 / sin(angle_c2))
-                        z = (1 - (project / c)) * a_scale + ((project / c)) * b_scale
-                        # print((px, py), nearest, second, total_distance, "project",project, "distance from a to player",a, "distance from a to b", c, a_scale, b, b_scale, z)
-                        """
-                        Easing method to animate between two points
-
-                        t = current position of tween
-                        b = initial value
-                        c = total change in value
-                        d = total time
-                        """
-
-                        # import pdb; pdb.set_trace()
-                        def easeInQuad(t, b, c, d):
-                            t /= d
-                            return c * t * t + b
-                    # z = easeInQuad(project, a_scale, b_scale-a_scale, c)
-                    else:  # use nearest
-                        z = a_scale = nearest[-1]
+                z = self.game.scene.walkarea.depth_scale(self.x, self.y)  # XXX ignores parents, scrolling.
+                if z is not None:
                     self.scale = self.scale * z
-            # elif total_distances==1:
 
             sprite.position = (x, y)
             if self._scroll_dx != 0 and self._scroll_dx + self.w < self.game.resolution[0]:
@@ -4309,6 +4757,7 @@ class Actor(MotionManager, metaclass=use_on_events):
         # close speech after continues.
         def _close_on_continues(game, obj, player):
             game._modals.remove(label.name)
+            label._release_label()
             game._remove(label)
             self.busy -= 1
             if logging:
@@ -5029,20 +5478,7 @@ class Actor(MotionManager, metaclass=use_on_events):
 
     def clear_path(self, polygon, start, end, solids):
         """ Is there a clear path between these two points """
-        clear_path = True
-        if polygon:  # test the walkarea
-            w0 = w1 = polygon[0]
-            for w2 in polygon[1:]:
-                if line_seg_intersect(end, start, w1, w2):
-                    clear_path = False
-                    return clear_path
-                w1 = w2
-            if line_seg_intersect(end, start, w2, w0): clear_path = False
-        for rect in solids:  # test the solids
-            collide = rect.intersect(start, end)
-            if collide is True:
-                clear_path = False
-        return clear_path
+        return clear_path(polygon, start, end, solids)
 
     def neighbour_nodes(self, polygon, nodes, current, solids):
         """ only return nodes:
@@ -5067,74 +5503,18 @@ class Actor(MotionManager, metaclass=use_on_events):
         return return_nodes
 
     def aStar(self, walkarea, nodes, start, destination, solids, ignore=False):
-        # courtesy http://stackoverflow.com/questions/4159331/python-speed-up-an-a-star-pathfinding-algorithm
-
-        openList = []
-        closedList = []
-        path = []
-
-        class Node():
-            def __init__(self, x, y, z=None):
-                self.x = x
-                self.y = y
-                self.H = 100000
-                self.parent = None
-
-            @property
-            def point(self):
-                return self.x, self.y
-
-        current = Node(*start)
-        end = Node(*destination)
-
-        # don't test for inside walkarea if ignoring walkarea
-        walkarea_polygon = None if ignore else walkarea._polygon
-        direct = self.clear_path(walkarea_polygon, start, destination, solids)
-        if direct:  # don't astar, just go direct
-            return [current, end]
-
-        # create a graph of nodes where each node is connected to all the others.
-        graph = {}
-        nodes = [Node(*n) for n in nodes]  # convert points to nodes
-        nodes.extend([current, end])
-        #        print()
-        for key in nodes:
-            # add nodes that the key node can access to the key node's map.
-            graph[key] = self.neighbour_nodes(walkarea_polygon, nodes, key, solids)
-            # graph[key] = [node for node in nodes if node != n] #nodes link to visible nodes
-
-        #        print("So our node graph is",graph)
-        #        for key in nodes:
-        #            print("node",key.point,"can see:",end="")
-        #            for n in graph[key]:
-        #                print(n.point,", ",end="")
-        #            print()
-        def retracePath(c):
-            path.insert(0, c)
-            if c.parent == None:
-                return
-            retracePath(c.parent)
-
-        openList.append(current)
-        while openList:
-            current = min(openList, key=lambda inst: inst.H)
-            #            print("openlist current",current.x, current.y)
-            if current == end:
-                retracePath(current)
-                #                print("retrace path: ",end="")
-                #                print("found path",path)
-                return path
-
-            openList.remove(current)
-            closedList.append(current)
-            for tile in graph[current]:
-                if tile not in closedList:
-                    tile.H = (abs(end.x - tile.x) + abs(end.y - tile.y)) * 10
-                    if tile not in openList:
-                        openList.append(tile)
-                    tile.parent = current
-        #        print("end of astar",path)
-        return path
+        """ Path from start to destination through nodes, avoiding solids (list of Rects)
+            Builds a throwaway VisibilityGraph, _calculate_path uses the scene's cached one.
+        """
+        graph = VisibilityGraph(ignore=ignore)
+        graph._polygon = None if ignore else walkarea._polygon
+        for i, rect in enumerate(solids):
+            graph._add_solid(i, rect)
+        for pt in nodes:
+            pt = (pt[0], pt[1])
+            if pt not in graph._nodes:
+                graph._add_node(pt)
+        return graph.path(start, destination)
 
     def _calculate_path(self, start, end, ignore=False):
         """ Using the scene's walkarea and waypoints, calculate a list of points that reach our destination
@@ -5156,28 +5536,15 @@ class Actor(MotionManager, metaclass=use_on_events):
             return [start, end]
         walkarea = scene.walkarea
 
-        # initial way points are the manual waypoints and the edges of the walkarea polygon
-        available_points = copy.copy(walkarea._waypoints)
-        available_points.extend(copy.copy(walkarea._polygon_waypoints))
-
-        #        available_points.extend([start, end]) #add the current start, end points (assume valid)
-        solids = []
-        for o in scene._objects:
-            obj = get_object(self.game, o)
-            if not obj:
-                print("ERROR: Unable to find %s in scene even though it is recorded in scene." % o)
-                continue
-            if obj._allow_draw == True and obj != self.game.player and not isinstance(obj, Emitter):
-                #                print("using solid",o.name,o.solid_area.flat2)
-                solids.append(obj.solid_area)
-                # add more waypoints based on the edges of the solid areas of objects in scene
-                for pt in obj.solid_area.waypoints:
-                    if pt not in available_points:
-                        available_points.append(pt)
-        available_points = [pt for pt in available_points if walkarea.valid(*pt)]  # scrub out non-valid points.
-        #        print("scene available points",available_points,"solids",[x.flat for x in solids])
-        goto_points = self.aStar(walkarea, available_points, start, end, solids, ignore=ignore)
-        return [g.point for g in goto_points]
+        # the waypoints and which can see each other are cached per scene and
+        # only patched when solids move or the walkarea changes
+        key = (scene.name, ignore)
+        graph = self.game._visibility_graphs.get(key)
+        if not graph:
+            graph = self.game._visibility_graphs[key] = VisibilityGraph(ignore=ignore)
+        graph.sync(self.game, walkarea)
+        goto_points = graph.path(start, end)
+        return goto_points
 
     def _calculate_goto(self, destination, block=False):
         """ Calculate and apply action to get from current point to another point via a straight line """
@@ -5212,7 +5579,7 @@ class Actor(MotionManager, metaclass=use_on_events):
         for action in self._actions.values():
             if action.available_for_pathplanning and angle > action.angle_start and angle <= action.angle_end:
                 goto_action = action
-                if action.name in self._motions:
+                if action.name in self._motions and self._motions[action.name].distance > 0:
                     goto_motion = action.name
                 break
 
@@ -5226,31 +5593,10 @@ class Actor(MotionManager, metaclass=use_on_events):
             self._goto_deltas_average_speed = action.speed
         else:  # use the goto_motion to create a list of deltas
             motion = self._motions[goto_motion]
-            speed = math.hypot(motion._average_dx, motion._average_dy)
             self._goto_deltas_average_speed = 5  # Not used when the motion provides its own deltas.
-            distance_travelled = 0
-            distance_travelled_x = 0
-            distance_travelled_y = 0
-            steps = 0
-            while (distance_travelled < distance):
-                delta = motion.deltas[steps % len(motion.deltas)]
-                dx = delta[0] * self.scale if delta[0] != None else 0
-                dy = delta[1] * self.scale if delta[1] != None else 0
-                dd = math.hypot(dx, dy)
-                ratio = 1.0
-                if distance_travelled + dd > distance:  # overshoot, aim closer
-                    ratio = (distance - distance_travelled) / dd
-                    dx *= ratio
-                    dy *= ratio
-
-                distance_travelled += math.hypot(dx, dy)
-                distance_travelled_x += dx
-                distance_travelled_y += dy
-                if ratio < 0.5:  # this new step is very large, so better to not do it.
-                    pass
-                else:
-                    self._goto_deltas.append((dx, dy))
-                    steps += 1
+            self._goto_deltas, distance_travelled_y = motion.goto_deltas(distance, self.scale)
+            distance_travelled = distance
+            steps = len(self._goto_deltas)
 
             # if x or y distance travelled is beneath the needed x or y travel distances, create the missing deltas for that axis, and subtract it from the other.
             raw_angle = math.atan2(y, x)
@@ -5380,6 +5726,13 @@ class Portal(Actor, metaclass=use_on_events):
 
     link = property(get_link, set_link)
 
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name in ["_link", "_scene"]:  # moved or relinked, so scenes may connect differently
+            scene_graph = getattr(self.__dict__.get("game"), "_scene_graph", None)
+            if scene_graph:
+                scene_graph.invalidate()
+
     def set_editable(self):
         """ Set which attributes are editable in the editor """
         super().set_editable()
@@ -5588,6 +5941,69 @@ class Particle(object):
         self.terminate = False  # don't renew this particle if True
 
 
+class ParticleArrays(object):
+    """ An Emitter's particles stored as one numpy array per Particle attribute """
+    FIELDS = [("x", float), ("y", float), ("z", float), ("ax", float), ("ay", float), ("speed", float),
+              ("direction", float), ("scale", float), ("alpha", float), ("rotate", float),
+              ("index", int), ("action_index", int), ("motion_index", int), ("hidden", bool), ("terminate", bool)]
+
+    def __init__(self):
+        for name, dtype in self.FIELDS:
+            setattr(self, name, np.zeros(0, dtype=dtype))
+        self._views = []
+
+    def __len__(self):
+        return len(self.x)
+
+    def __getstate__(self):
+        d = dict(self.__dict__)
+        d["_views"] = []  # rebuilt on demand
+        return d
+
+    def extend(self, **values):
+        """ Add particles, values are equal length arrays keyed by field, missing fields use Particle's defaults """
+        num = len(values["x"])
+        defaults = {"z": 1.0, "alpha": 1.0, "hidden": True}
+        for name, dtype in self.FIELDS:
+            new = values.get(name, np.full(num, defaults.get(name, 0), dtype=dtype))
+            setattr(self, name, np.concatenate([getattr(self, name), np.asarray(new, dtype=dtype)]))
+
+    def remove(self, mask):
+        """ Drop the particles where mask is True """
+        keep = ~mask
+        for name, _ in self.FIELDS:
+            setattr(self, name, getattr(self, name)[keep])
+
+    def views(self):
+        """ Particle-like objects for each particle, for scripts that want to work one particle at a time """
+        if len(self._views) != len(self):
+            self._views = [ParticleView(self, i) for i in range(len(self))]
+        return self._views
+
+
+class ParticleView(object):
+    """ Looks like a Particle but reads and writes through to a ParticleArrays """
+    __slots__ = ["_arrays", "_i"]
+
+    def __init__(self, arrays, i):
+        self._arrays = arrays
+        self._i = i
+
+
+def _particle_view_field(name, dtype):
+    def get(self):
+        return dtype(getattr(self._arrays, name)[self._i])
+
+    def set(self, v):
+        getattr(self._arrays, name)[self._i] = v
+
+    return property(get, set)
+
+
+for _name, _dtype in ParticleArrays.FIELDS:
+    setattr(ParticleView, _name, _particle_view_field(_name, _dtype))
+
+
 class Emitter(Item, metaclass=use_on_events):
     #    def __init__(self, name, *args, **kwargs):
 
@@ -5599,6 +6015,10 @@ class Emitter(Item, metaclass=use_on_events):
         """ This object's solid_mask|solid_area is used for spawning 
             direction: what is the angle of the emitter
             fov: what is the arc of the emitter's 'nozzle'?
+
+            If numpy is available particles are stored and updated as arrays
+            and drawn as a single vertex list, otherwise each particle is a
+            Particle object.
         """
         super().__init__(name)
         self.name = name
@@ -5619,7 +6039,10 @@ class Emitter(Item, metaclass=use_on_events):
         self.random_motion_index = random_motion_index # should each particle start mid-motion?
         self.size_spawn_min, self.size_spawn_max = size_spawn_min, size_spawn_max
         self.speed_spawn_min, self.speed_spawn_max = speed_spawn_min, speed_spawn_max
-        self.particles = []
+        self._particles = ParticleArrays() if np is not None else []
+        self._particle_batch = None  # pyglet batch, vertex list and texture for drawing array particles
+        self._particle_vertex_list = None
+        self._particle_texture = None  # (action's animation, texture, frames)
         self.behaviour = behaviour
         #        self.persist = False # particles are added to the scene and remain.
         self._editable.append(
@@ -5627,6 +6050,44 @@ class Emitter(Item, metaclass=use_on_events):
         # self._solid_area = Rect(0,0,0,0) #used for the spawn area
         self.test_terminate = test_terminate
 
+    def __getstate__(self):  # emitter.getstate
+        self._particle_batch = None  # rebuilt on next draw
+        self._particle_vertex_list = None
+        self._particle_texture = None
+        return super().__getstate__()
+
+    def __setstate__(self, d):
+        if "particles" in d:  # backwards compat, saves from before particles were stored as arrays
+            d["_particles"] = d.pop("particles")
+        self.__dict__.update(d)
+        if np is not None and type(self._particles) == list:
+            particles = self._particles
+            self._particles = ParticleArrays()
+            if particles:
+                values = {}
+                for name, _ in ParticleArrays.FIELDS:
+                    values[name] = [getattr(p, name) for p in particles]
+                self._particles.extend(**values)
+
+    def get_particles(self):
+        if type(self._particles) == list:
+            return self._particles
+        return self._particles.views()
+
+    def set_particles(self, v):
+        self._particles = ParticleArrays() if np is not None else []
+        if v:
+            log.warning("emitter.particles can only be cleared, use add_particles to create particles")
+
+    particles = property(get_particles, set_particles)
+
+    @property
+    def _vectorised(self):
+        """ Can the particles be updated without calling out for each one? """
+        return type(self._particles) != list and \
+            all([getattr(motion, "vectorisable", False) for motion in self._applied_motions]) and \
+            get_function(self.game, self.test_terminate, self) == terminate_by_frame
+
     @property
     def summary(self):
         fields = ["name", "number", "frames", "direction", "fov", "speed", "acceleration", "size_start",
@@ -5696,6 +6157,29 @@ class Emitter(Item, metaclass=use_on_events):
         if self.random_motion_index:
             p.motion_index = randint(0, 1000)  # XXX we don't have the length of any motions here.
 
+    def _reset_particles(self, mask):
+        """ reset_particle for every array particle where mask is True """
+        particles = self._particles
+        num = int(mask.sum())
+        if num == 0:
+            return
+        x, y = self.x, self.y
+        if self._parent:
+            parent = get_object(self.game, self._parent)
+            x += parent.x
+            y += parent.y
+        particles.x[mask] = x + np.random.randint(0, self._solid_area.w + 1, num)
+        particles.y[mask] = y + np.random.randint(0, self._solid_area.h + 1, num)
+        particles.scale[mask] = np.random.uniform(self.size_spawn_min, self.size_spawn_max, num)
+        particles.speed[mask] = self.speed * np.random.uniform(self.speed_spawn_min, self.speed_spawn_max, num)
+        particles.alpha[mask] = self.alpha_start
+        if self.random_age:
+            particles.index[mask] = np.random.randint(0, self.frames + 1, num)
+        if self.random_index and self.action:
+            particles.action_index[mask] = np.random.randint(0, self.action.num_of_frames + 1, num)
+        if self.random_motion_index:
+            particles.motion_index[mask] = np.random.randint(0, 1001, num)
+
     def _update_particle(self, dt, p):
         r = math.radians(p.direction)
         a = p.speed * math.cos(r)
@@ -5729,13 +6213,129 @@ class Emitter(Item, metaclass=use_on_events):
         #if self.resource:
         #    print(p.particle_id, self.resource._frame_index, p.action_index, self.action.num_of_frames,  p.action_index % self.action.num_of_frames)
 
+    def _update_particles(self, start=0):
+        """ _update_particle for all the array particles from start onwards in one go """
+        particles = self._particles
+        if len(particles) <= start:
+            return
+        s = slice(start, None)
+        r = np.radians(particles.direction[s])
+        speed = particles.speed[s]
+        index = particles.index[s]
+        particles.y[s] -= speed * np.cos(r) + self.acceleration[1] * index
+        particles.x[s] += speed * np.sin(r) - self.acceleration[0] * index
+        particles.alpha[s] = np.maximum(self.alpha_start + self.alpha_delta * index, 0)
+
+        vectorised = self._vectorised
+        if vectorised:
+            for motion in self._applied_motions:
+                motion.apply_to_particles(particles, s)
+        else:  # motions and custom terminate tests still see one particle at a time
+            views = particles.views()[start:]
+            for motion in self._applied_motions:
+                for p in views:
+                    motion.apply_to_actor(p, p.motion_index)
+        particles.motion_index[s] += 1
+        particles.index[s] += 1
+        particles.action_index[s] += 1
+
+        if vectorised:
+            finished = particles.index >= self.frames
+        else:
+            test_terminate = get_function(self.game, self.test_terminate, self)
+            finished = np.zeros(len(particles), dtype=bool)
+            finished[s] = [bool(test_terminate(self.game, self, p)) for p in particles.views()[start:]]
+        finished[:start] = False
+        if finished.any():
+            self._reset_particles(finished)
+            particles.hidden[finished] = False
+            dead = finished & particles.terminate
+            if dead.any():
+                particles.remove(dead)
+
     def _update(self, dt, obj=None):  # emitter.update
         Item._update(self, dt, obj=obj)
         if self.game and self.game._headless:
             return
+        if type(self._particles) != list:
+            self._update_particles()
+            return
         for i, p in enumerate(self.particles):
             self._update_particle(dt, p)
 
+    def _get_particle_texture(self):
+        """ All the frames of the current action on one texture, so the particles can be drawn in one call.
+            Uses the action's atlas page if it has one, otherwise copies its loaded frames onto a new texture.
+            Returns (texture, [frames as regions of it]) or None if the action isn't loaded.
+        """
+        action = self.action
+        animation = action.resource
+        if self._particle_texture and self._particle_texture[0] is animation:
+            return self._particle_texture[1:]
+        if not animation or not animation.frames:
+            return None
+        images = [frame.image for frame in animation.frames]
+        owners = set(getattr(image, "owner", None) for image in images)
+        if len(owners) == 1 and None not in owners:  # regions of one atlas page
+            texture, frames = owners.pop(), images
+        else:
+            w, h = images[0].width, images[0].height
+            texture = pyglet.image.Texture.create(w * len(images), h)
+            for i, image in enumerate(images):
+                texture.blit_into(image.get_image_data(), i * w, 0, 0)
+            frames = [texture.get_region(i * w, 0, w, h) for i in range(len(images))]
+        self._particle_texture = (animation, texture, frames)
+        self._particle_batch = None  # texture changed, so rebuild the vertex list
+        return texture, frames
+
+    def _pyglet_draw_particles(self, absolute=False):
+        """ Draw the array particles as a single vertex list """
+        particle_texture = self._get_particle_texture()
+        if not particle_texture:
+            return
+        texture, frames = particle_texture
+        particles = self._particles
+        num = len(particles)
+        if not self._particle_batch:
+            self._particle_batch = pyglet.graphics.Batch()
+            self._particle_vertex_list = None
+        vertex_list = self._particle_vertex_list
+        if vertex_list is None or vertex_list.get_size() != num * 4:
+            if vertex_list is not None:
+                vertex_list.delete()
+            group = pyglet.sprite.SpriteGroup(texture, GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+            vertex_list = self._particle_batch.add(num * 4, GL_QUADS, group, 'v2f/stream', 't3f/stream',
+                                                   'c4B/stream')
+            self._particle_vertex_list = vertex_list
+        if num == 0:
+            return
+
+        dx, dy = self.ax, -self.ay
+        if not absolute and self.game.scene:
+            dx += self.game.scene.x * self.z
+            dy -= self.game.scene.y * self.z
+            if self.game.camera:
+                dx += self.game.camera._shake_dx
+                dy += self.game.camera._shake_dy
+        scale = self.scale * particles.scale
+        w = frames[0].width * scale
+        h = frames[0].height * scale
+        x = np.floor(particles.x + dx)
+        y = np.floor(self.game.resolution[1] - particles.y - h + dy)
+        vertices = np.ctypeslib.as_array(vertex_list.vertices).reshape(num, 4, 2)
+        vertices[:, 0, 0] = vertices[:, 3, 0] = x
+        vertices[:, 1, 0] = vertices[:, 2, 0] = x + w
+        vertices[:, 0, 1] = vertices[:, 1, 1] = y
+        vertices[:, 2, 1] = vertices[:, 3, 1] = y + h
+
+        frame_tex_coords = np.array([frame.tex_coords for frame in frames], dtype=np.float32)
+        indices = particles.action_index % len(frames)
+        np.ctypeslib.as_array(vertex_list.tex_coords)[:] = frame_tex_coords[indices].ravel()
+
+        colours = np.ctypeslib.as_array(vertex_list.colors).reshape(num, 4, 4)
+        colours[:, :, :3] = 255
+        colours[:, :, 3] = np.clip(np.round(particles.alpha * 255), 0, 255)[:, None]
+        self._particle_batch.draw()
 
     def pyglet_draw(self, absolute=False, force=False):  # emitter.draw
         #        if self.resource and self._allow_draw: return
@@ -5750,6 +6350,12 @@ class Emitter(Item, metaclass=use_on_events):
             return
 
         self._rect = Rect(self.x, self.y, 0, 0)
+        if type(self._particles) != list and self.resource is not None:
+            self._pyglet_draw_particles(absolute=absolute)
+            if self.show_debug:
+                self.debug_pyglet_draw(absolute=absolute)
+            return
+
         for i, p in enumerate(self.particles):
             x, y = p.x, p.y
 
@@ -5795,6 +6401,11 @@ class Emitter(Item, metaclass=use_on_events):
     def on_cease(self):
         """ Cease spawning new particles and finish """
         self.behaviour = BEHAVIOUR_FIRE
+        if type(self._particles) != list:
+            self._particles.terminate[:] = True
+            if self.game and self.game._headless:
+                self.particles = []
+            return
         for p in self.particles:
             p.terminate = True
             if self.game and self.game._headless:
@@ -5824,6 +6435,9 @@ class Emitter(Item, metaclass=use_on_events):
         ay = -pt[1] if self.game and self.game.flip_anchor else pt[1]
 
         self._ax, self._ay = ax, ay
+        if type(self._particles) != list:
+            self._particles.ax[:], self._particles.ay[:] = self._ax, self._ay
+            return
         for p in self.particles:
             p.ax, p.ay = self._ax, self._ay
 
@@ -5842,6 +6456,9 @@ class Emitter(Item, metaclass=use_on_events):
             self.speed_spawn_min = speed_spawn_min
         if speed_spawn_max:
             self.speed_spawn_max = speed_spawn_max
+        if type(self._particles) != list:
+            self._add_particle_arrays(num, terminate)
+            return
         for x in range(0, num):
             d = self.get_a_direction()
             scale = self.get_a_scale()
@@ -5860,11 +6477,34 @@ class Emitter(Item, metaclass=use_on_events):
             p.hidden = True
             p.terminate = terminate
 
+    def _add_particle_arrays(self, num, terminate):
+        """ _add_particles for array particles """
+        if num <= 0:
+            return
+        particles = self._particles
+        start = len(particles)
+        low, high = int(self.direction - float(self.fov / 2)), int(self.direction + float(self.fov / 2))
+        particles.extend(x=np.zeros(num), y=np.zeros(num), ax=np.full(num, self._ax), ay=np.full(num, self._ay),
+                         direction=np.random.randint(low, high + 1, num))
+        new = np.zeros(len(particles), dtype=bool)
+        new[start:] = True
+        self._reset_particles(new)
+        if self.behaviour == BEHAVIOUR_CYCLE:
+            # fast forward particles through one full cycle so they are
+            # mid-stream when they start
+            for j in range(0, self.frames):
+                self._update_particles(start=start)
+        particles.hidden[start:] = True
+        particles.terminate[start:] = terminate
+
     def on_add_particles(self, num, speed_spawn_min=None, speed_spawn_max=None):
         self._add_particles(num=num)
 
     def on_limit_particles(self, num):
         """ restrict the number of particles to num through attrition """
+        if type(self._particles) != list:
+            self._particles.terminate[num:] = True
+            return
         for p in self.particles[num:]:
             p.terminate = True
 
@@ -5970,6 +6610,215 @@ UNLOCKED = 1
 FREEROAM = 2
 
 
+class VisibilityGraph(object):
+    """ Which of a scene's waypoints can walk straight to each other, for Actor._calculate_path
+
+        Nodes are the walkarea's waypoints and polygon waypoints plus the
+        waypoints around each solid, if walkarea.valid. Built on the first goto
+        in a scene and then patched as solids appear, move or disappear; a
+        changed walkarea rebuilds it. Lives in game._visibility_graphs.
+    """
+
+    def __init__(self, ignore=False):
+        self.ignore = ignore  # ignore the walkarea polygon (but not solids)
+        self._signature = None
+        self._polygon = None
+        self._solids = {}  # object name: Rect
+        self._obstacles = None  # the solids walkarea.valid tests points against
+        self._valid = {}  # point: walkarea.valid(*point)
+        self._nodes = {}  # point: set of points it can see
+        self._blocked = {}  # (point, point): set of solids in the way, only for pairs inside the polygon
+        self.builds = 0
+
+    def _pair(self, a, b):
+        return (a, b) if a <= b else (b, a)
+
+    def _add_node(self, pt):
+        visible = set()
+        for other in self._nodes:
+            if other == pt or not clear_path(self._polygon, pt, other, []):
+                continue
+            blocked = set(name for name, rect in self._solids.items() if rect.intersect(pt, other) is True)
+            self._blocked[self._pair(pt, other)] = blocked
+            if not blocked:
+                visible.add(other)
+                self._nodes[other].add(pt)
+        self._nodes[pt] = visible
+
+    def _remove_node(self, pt):
+        for other in self._nodes.pop(pt):
+            self._nodes[other].discard(pt)
+        for other in self._nodes:
+            self._blocked.pop(self._pair(pt, other), None)
+
+    def _add_solid(self, name, rect):
+        self._solids[name] = rect
+        for (a, b), blocked in self._blocked.items():
+            if rect.intersect(a, b) is True:
+                if not blocked:
+                    self._nodes[a].discard(b)
+                    self._nodes[b].discard(a)
+                blocked.add(name)
+
+    def _remove_solid(self, name):
+        self._solids.pop(name)
+        for (a, b), blocked in self._blocked.items():
+            if name in blocked:
+                blocked.discard(name)
+                if not blocked:
+                    self._nodes[a].add(b)
+                    self._nodes[b].add(a)
+
+    def sync(self, game, walkarea):
+        """ Catch up with any changes to the walkarea or the solids in its scene """
+        signature = (list(walkarea._polygon), list(walkarea._polygon_x), list(walkarea._polygon_y),
+                     list(walkarea._waypoints), list(walkarea._polygon_waypoints), walkarea._state)
+        if signature != self._signature:
+            self._signature = signature
+            self._polygon = None if self.ignore else list(walkarea._polygon)
+            self._solids, self._obstacles, self._valid, self._nodes, self._blocked = {}, None, {}, {}, {}
+            self.builds += 1
+
+        scene = walkarea.scene
+        solids = {}
+        obstacles = []
+        for name in scene._objects:
+            obj = get_object(game, name)
+            if not obj:
+                print("ERROR: Unable to find %s in scene even though it is recorded in scene." % name)
+                continue
+            if isinstance(obj, Emitter):
+                continue
+            rect = obj.solid_area
+            if obj.allow_update:
+                obstacles.append((name, rect.flat))
+            if obj._allow_draw == True and obj != game.player:
+                solids[name] = rect
+        if obstacles != self._obstacles:  # points may have become (in)valid
+            self._obstacles = obstacles
+            self._valid = {}
+
+        for name in list(self._solids.keys()):
+            if name not in solids or solids[name].flat != self._solids[name].flat:
+                self._remove_solid(name)
+        for name, rect in solids.items():
+            if name not in self._solids:
+                self._add_solid(name, rect)
+
+        # initial way points are the manual waypoints and the edges of the walkarea polygon
+        points = [(pt[0], pt[1]) for pt in walkarea._waypoints + walkarea._polygon_waypoints]
+        # add more waypoints based on the edges of the solid areas of objects in scene
+        for rect in solids.values():
+            points.extend(rect.waypoints)
+        unchecked = list(dict.fromkeys(pt for pt in points if pt not in self._valid))
+        self._valid.update(zip(unchecked, walkarea.valid_points(unchecked)))
+        wanted = set()
+        for pt in points:
+            if self._valid[pt]:
+                wanted.add(pt)
+        for pt in list(self._nodes.keys()):
+            if pt not in wanted:
+                self._remove_node(pt)
+        for pt in points:
+            if pt in wanted and pt not in self._nodes:
+                self._add_node(pt)
+
+    def path(self, start, end):
+        """ Shortest list of points from start to end via the nodes (A*), [] if there is no way through """
+        start, end = (start[0], start[1]), (end[0], end[1])
+        solids = list(self._solids.values())
+        if clear_path(self._polygon, start, end, solids):  # don't astar, just go direct
+            return [start, end]
+
+        def visible(pt):
+            return [node for node in self._nodes if node != pt and clear_path(self._polygon, pt, node, solids)]
+
+        reaches_end = set(visible(end))
+        costs = {start: 0}
+        parents = {start: None}
+        closed = set()
+        open_heap = [(distance(start, end), 0, start)]
+        while open_heap:
+            f, cost, current = heapq.heappop(open_heap)
+            if current in closed:
+                continue
+            if current == end:
+                path = []
+                while current is not None:
+                    path.insert(0, current)
+                    current = parents[current]
+                return path
+            closed.add(current)
+            neighbours = visible(start) if current == start else list(self._nodes.get(current, ()))
+            if current in reaches_end:
+                neighbours.append(end)
+            for node in neighbours:
+                if node in closed:
+                    continue
+                node_cost = cost + distance(current, node)
+                if node_cost < costs.get(node, node_cost + 1):
+                    costs[node] = node_cost
+                    parents[node] = current
+                    heapq.heappush(open_heap, (node_cost + distance(node, end), node_cost, node))
+        return []
+
+
+def depth_between(nearest, second, x, y):
+    """ The z (actor scale) at (x, y) from two z waypoints: interpolated along the line between them
+        if (x, y) is between the two, otherwise the z of the nearer one """
+    dx, dy = second[0] - nearest[0], second[1] - nearest[1]
+    length = dx * dx + dy * dy
+    if length == 0:
+        return nearest[2]
+    t = ((x - nearest[0]) * dx + (y - nearest[1]) * dy) / length  # projection onto the line between
+    if t <= 0:
+        return nearest[2]
+    if t >= 1:
+        return second[2]
+    return (1 - t) * nearest[2] + t * second[2]
+
+
+class DepthField(object):
+    """ Actor.pyglet_draw's scale for any point in a walkarea, worked out from the waypoints with z values
+        when they change rather than for every actor every frame.
+
+        One z waypoint scales everywhere by its z and two interpolate between them exactly. With more,
+        each point uses its two nearest z waypoints, precomputed on a grid of DEPTH_FIELD_CELL pixels
+        covering the walkarea and looked up by cell.
+    """
+
+    def __init__(self, walkarea):
+        self.waypoints = [w for w in walkarea._waypoints if len(w) == 3]
+        self._grid = None
+        if len(self.waypoints) > 2:
+            self._build_grid(walkarea)
+
+    def _nearest_two(self, x, y):
+        wps = sorted(self.waypoints, key=lambda w: (w[0] - x) ** 2 + (w[1] - y) ** 2)
+        return depth_between(wps[0], wps[1], x, y)
+
+    def _build_grid(self, walkarea):
+        points = [(pt[0], pt[1]) for pt in list(walkarea._polygon) + self.waypoints]
+        self._left = min([pt[0] for pt in points])
+        self._top = min([pt[1] for pt in points])
+        self._columns = int((max([pt[0] for pt in points]) - self._left) // DEPTH_FIELD_CELL) + 1
+        self._rows = int((max([pt[1] for pt in points]) - self._top) // DEPTH_FIELD_CELL) + 1
+        half = DEPTH_FIELD_CELL / 2
+        self._grid = array("d", [self._nearest_two(self._left + column * DEPTH_FIELD_CELL + half,
+                                                   self._top + row * DEPTH_FIELD_CELL + half)
+                                 for row in range(self._rows) for column in range(self._columns)])
+
+    def scale(self, x, y):
+        """ The scale at (x, y), or None if no waypoints have a z value """
+        if self._grid is not None:
+            column = min(max(int((x - self._left) // DEPTH_FIELD_CELL), 0), self._columns - 1)
+            row = min(max(int((y - self._top) // DEPTH_FIELD_CELL), 0), self._rows - 1)
+            return self._grid[row * self._columns + column]
+        if len(self.waypoints) == 2:
+            return depth_between(self.waypoints[0], self.waypoints[1], x, y)
+        return self.waypoints[0][2] if self.waypoints else None
+
+
 class WalkAreaManager(metaclass=use_on_events):
     """ Walkarea with waypoints """
 
@@ -5980,11 +6829,13 @@ class WalkAreaManager(metaclass=use_on_events):
         self._polygon = []
         self._polygon_waypoints = []  # autogenerated waypoints from polygon
         self._state = UNLOCKED
+        self._depth_field = None  # DepthField from the waypoints, built when first needed
 
         # for fast calculation of collisions
         self._polygon_count = len(self._polygon)
         self._polygon_x = []
         self._polygon_y = []
+        self._polygon_bounds = None  # (min x, min y, max x, max y), worked out when first needed
         self._fill_colour = None
 
         self._editing = False
@@ -6121,9 +6972,11 @@ class WalkAreaManager(metaclass=use_on_events):
         self._update_walkarea()
 
     def _update_walkarea(self):
+        self._depth_field = None
         self._polygon_count = len(self._polygon)
         self._polygon_x = [float(p[0]) for p in self._polygon]
         self._polygon_y = [float(p[1]) for p in self._polygon]
+        self._polygon_bounds = None
         self.generate_waypoints()
 
     def on_polygon(self, points):
@@ -6169,9 +7022,18 @@ class WalkAreaManager(metaclass=use_on_events):
 
     def on_add_waypoint(self, point):
         self._waypoints.append(point)
+        self._depth_field = None
 
     def on_waypoints(self, points):
         self._waypoints = points
+        self._depth_field = None
+
+    def depth_scale(self, x, y):
+        """ How much to scale an actor standing at (x, y), None if no waypoints have a z value """
+        field = getattr(self, "_depth_field", None)  # not in older save games
+        if field is None:
+            field = self._depth_field = DepthField(self)
+        return field.scale(x, y)
 
     def on_toggle_editor(self):
         self._editing = not self._editing
@@ -6197,6 +7059,12 @@ class WalkAreaManager(metaclass=use_on_events):
             return False
         elif self._state == FREEROAM or ignore == True:  # always inside walkarea
             return True
+        bounds = getattr(self, "_polygon_bounds", None)  # not in older save games
+        if bounds is None and self._polygon_count:
+            bounds = self._polygon_bounds = (min(self._polygon_x), min(self._polygon_y),
+                                             max(self._polygon_x), max(self._polygon_y))
+        if not bounds or x < bounds[0] or x > bounds[2] or y < bounds[1] or y >= bounds[3]:
+            return False
         c = False
         i = 0
         npol = self._polygon_count
@@ -6216,21 +7084,21 @@ class WalkAreaManager(metaclass=use_on_events):
          1. Check inside polygon
          2. Check not inside scene's objects' solid area
         """
-        inside_polygon = self.collide(x, y)
-        outside_solids = True
-
-        if self._scene:
-            scene = get_object(self.game, self._scene)
-            for obj_name in scene._objects:
-                obj = get_object(scene.game, obj_name)
-                if not obj:
-                    print("ERROR: %s not found in scene even though recorded in scene" % obj_name)
-                    continue
-                if obj.allow_update and obj.solid_area.collidepoint(x, y) and not isinstance(obj, Emitter):
-                    outside_solids = False
-                    break
-        safe = True if inside_polygon and outside_solids else False
-        return safe
+        return self.valid_points([(x, y)])[0]
+
+    def valid_points(self, points):
+        """ valid() for a list of (x, y) points, returns a list of bools """
+        scene = get_object(self.game, self._scene) if self._scene else None
+        grid = self.game._solid_index.sync(self.game, scene) if scene else None
+        results = []
+        for pt in points:
+            x, y = pt[0], pt[1]
+            inside_polygon = self.collide(x, y)
+            if inside_polygon and grid is not None:
+                results.append(not self.game._solid_index.solid(self.game, grid, x, y))
+            else:
+                results.append(inside_polygon)
+        return results
 
     def _pyglet_draw(self, debug=False):
         ypts = [self.game.resolution[1] - y for y in self._polygon_y]
@@ -6311,6 +7179,13 @@ class Scene(MotionManager, metaclass=use_on_events):
         self.game = None
         return self.__dict__
 
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name not in SaveCache.transient:
+            save_cache = getattr(self.__dict__.get("game"), "_save_cache", None)
+            if save_cache:
+                save_cache.mark(self.__dict__.get("name"))
+
     def get_x(self):  # scene.x
         return self._x
 
@@ -6352,6 +7227,16 @@ class Scene(MotionManager, metaclass=use_on_events):
 
     game = property(get_game, set_game)
 
+    def get_display_text(self):
+        return self.__dict__.get("display_text", None)
+
+    def set_display_text(self, v):
+        self.__dict__["display_text"] = v  # stored under the old attribute name so existing saves still load
+        if getattr(self, "game", None):
+            self.game._name_index.update(self)
+
+    display_text = property(get_display_text, set_display_text)
+
     def has(self, obj):
         obj = get_object(self.game, obj)
         return True if obj.name in self._objects else False
@@ -6406,10 +7291,10 @@ class Scene(MotionManager, metaclass=use_on_events):
 
         # if there is an initial state, load that automatically
         state_name = os.path.join(sdir, "initial.py")
-        if os.path.isfile(state_name):
+        if game._metadata.isfile(state_name):
             game.load_state(self, "initial")
         ambient_name = os.path.join(sdir, "ambient.ogg")  # ambient sound to
-        if os.path.isfile(ambient_name):
+        if game._metadata.isfile(ambient_name):
             self._ambient_filename = ambient_name
 
         self._smart_motions(game)  # load the motions
@@ -6422,21 +7307,24 @@ class Scene(MotionManager, metaclass=use_on_events):
 
     def load_assets(self, game):  # scene.load
         #        print("loading assets for scene",self.name)
-        for i in self.load_assets_responsive(game):
+        for i in self.load_assets_responsive(game, block=True):
             pass
 
-    def load_assets_responsive(self, game):
+    def load_assets_responsive(self, game, block=False):
+        """ Load the scene's objects, yielding between them. If block, wait on the
+            decoding threads instead of yielding until they have finished """
         if not self.game: self.game = game
-        for obj_name in self._objects:
-            obj = get_object(self.game, obj_name)
-            if obj:
-                obj.load_assets(self.game)
-                yield
-        for obj_name in self._layer:
-            obj = get_object(self.game, obj_name)
-            if obj:
-                obj.load_assets(self.game)
-                yield
+        objects = [get_object(self.game, obj_name) for obj_name in self._objects + self._layer]
+        objects = [obj for obj in objects if obj]
+        # decode every spritesheet in the scene on the asset loader's threads
+        files = [game._asset_loader.submit(game, obj) for obj in objects]
+        game._progress_bar_count += len(objects)
+        for obj, obj_files in zip(objects, files):
+            while not block and not game._asset_loader.ready(obj_files):
+                yield  # still decoding, let the game loop carry on
+            obj.load_assets(self.game)
+            game._progress_bar_index += 1
+            yield
 
     def unload_assets(self):  # scene.unload
         for obj_name in self._objects:
@@ -6485,19 +7373,18 @@ class Scene(MotionManager, metaclass=use_on_events):
     def _load_layers(self, game, wildcard=None, cls=Item):
         sdir = os.path.join(game.directory_scenes, self.name)
         absdir = get_safe_path(sdir)
-        wildcard = wildcard if wildcard else os.path.join(absdir, "*.png")
+        elements = glob.glob(wildcard) if wildcard else game._metadata.glob(absdir, ".png")
         self._layer = []  # clear old layers
         layers = []
-        for element in glob.glob(wildcard):  # add layers
+        for element in elements:  # add layers
             fname = os.path.splitext(os.path.basename(element))[0]
             details_filename = os.path.join(absdir, fname + ".details")
             # find a details file for each element
-            if os.path.isfile(details_filename):
+            data = game._metadata.read(details_filename)
+            if data is not None:
                 layer = self._load_layer(os.path.join(sdir, os.path.basename(element)), cls=cls)
                 layers.append(layer)
                 try:
-                    with open(details_filename, 'r') as f:
-                        data = f.read()
                     layer_defaults = json.loads(data)
                     for key, val in layer_defaults.items():
                         if type(val) is str:
@@ -6515,8 +7402,9 @@ class Scene(MotionManager, metaclass=use_on_events):
                     log.error("Unable to load details from %s" %
                               details_filename)
         if len(layers) == 0:  # fall back to loading any "background.png"
-            wildcard = os.path.join(absdir, "background.png")
-            for element in glob.glob(wildcard):  # add layers
+            for element in [os.path.join(absdir, "background.png")]:  # add layers
+                if not game._metadata.isfile(element):
+                    continue
                 fname = os.path.splitext(os.path.basename(element))[0]
                 layer = self._load_layer(os.path.join(sdir, os.path.basename(element)), cls=cls)
                 layers.append(layer)
@@ -6546,6 +7434,9 @@ class Scene(MotionManager, metaclass=use_on_events):
             elif "actors" in self.scales.keys() and not isinstance(obj, Item) and not isinstance(obj, Portal):
                 obj.scale = self.scales["actors"]
             self._objects.append(obj.name)
+            if self.game:
+                self.game._invalidate_update_list()
+                self.game._save_cache.mark(self.name)
 
     def _remove(self, obj):
         """ remove object from the scene """
@@ -6558,6 +7449,9 @@ class Scene(MotionManager, metaclass=use_on_events):
         obj.scene = None
         if obj.name in self._objects:
             self._objects.remove(obj.name)
+            if self.game:
+                self.game._invalidate_update_list()
+                self.game._save_cache.mark(self.name)
         elif self._:
             log.warning("%s not in scene %s" % (obj.name, self.name))
 
@@ -6757,6 +7651,101 @@ class Label(pyglet.text.Label):
     pass
 
 
+class LabelPool(object):
+    """ Labels for Text to reuse, so a line of dialogue doesn't build a new Label and lay out
+        its glyphs every time.
+
+        Free labels are kept by what they are laid out for, (text, font name, size, wrap),
+        and one asked for with the same key is handed back as it is. Otherwise the
+        least recently freed label is laid out again, and a new Label is only made when
+        there are none free. The size of each text is cached by the same key.
+    """
+    MAX_FREE = 64  # free labels kept for reuse, older ones are deleted
+    MAX_SIZES = 1024  # text sizes remembered
+
+    def __init__(self):
+        self._free = OrderedDict()  # id(label): label, least recently freed first
+        self._keys = {}  # (text, font name, size, wrap): [ids of free labels laid out for it]
+        self._sizes = OrderedDict()  # (text, font name, size, wrap): (width, height)
+        self.hits = 0
+        self.relayouts = 0
+        self.created = 0
+
+    def _key(self, text, font_name, size, wrap):
+        return text, font_name, size, wrap if wrap > 0 else 1  # don't allow 0 width labels
+
+    def _label_key(self, label):
+        return label.text, label.font_name, label.font_size, label.width
+
+    def _forget(self, label):
+        key = self._label_key(label)
+        ids = self._keys[key]
+        ids.remove(id(label))
+        if not ids:
+            del self._keys[key]
+
+    def take(self, text, font_name, size, wrap, colour=None):
+        """ A Label laid out for text, left and top anchored """
+        key = self._key(text, font_name, size, wrap)
+        if key in self._keys:
+            ids = self._keys[key]
+            same_colour = [i for i in ids if colour and tuple(self._free[i].color) == tuple(colour)]
+            label = self._free.pop(same_colour[-1] if same_colour else ids[-1])
+            self._forget(label)
+            self.hits += 1
+        elif self._free:
+            label = self._free.popitem(last=False)[1]
+            self._forget(label)
+            label.begin_update()
+            label.text, label.font_name, label.font_size, label.width = key
+            label.end_update()
+            self.relayouts += 1
+        else:
+            label = Label(text, font_name=font_name, font_size=size, multiline=True, width=key[3],
+                          anchor_x='left', anchor_y='top')
+            self.created += 1
+        if colour and tuple(label.color) != tuple(colour):
+            label.color = colour  # pyglet 1.3 lays the label out again for this, so free labels keep their colour
+        return label
+
+    def release(self, label):
+        """ Give a label back for reuse, it mustn't be drawn again """
+        if label is None or id(label) in self._free:
+            return
+        self._free[id(label)] = label
+        self._keys.setdefault(self._label_key(label), []).append(id(label))
+        while len(self._free) > self.MAX_FREE:
+            old = self._free.popitem(last=False)[1]
+            self._forget(old)
+            old.delete()
+
+    def measure(self, text, font_name, size, wrap):
+        """ Returns the (width, height) of text laid out in a label """
+        key = self._key(text, font_name, size, wrap)
+        if key in self._sizes:
+            self._sizes.move_to_end(key)
+            return self._sizes[key]
+        label = self.take(text, font_name, size, wrap)
+        result = self._sizes[key] = (label.content_width, label.content_height)
+        self.release(label)  # laid out, so ready for the Text's create_label
+        while len(self._sizes) > self.MAX_SIZES:
+            self._sizes.popitem(last=False)
+        return result
+
+    def clear(self):
+        for label in self._free.values():
+            label.delete()
+        self._free, self._keys, self._sizes = OrderedDict(), {}, OrderedDict()
+
+    @property
+    def stats(self):
+        return {"hits": self.hits, "relayouts": self.relayouts, "created": self.created, "free": len(self._free),
+                "sizes": len(self._sizes)}
+
+
+_label_pool = LabelPool()  # shared by every Text
+
+
 from pyglet.text import decode_html, HTMLLabel, DocumentLabel
 
 
@@ -6854,15 +7843,7 @@ class Text(Item, metaclass=use_on_events):
         self.wrap = wrap
         #        self.create_label()
 
-        wrap = self.wrap if self.wrap > 0 else 1  # don't allow 0 width labels
-        tmp = Label(self._display_text,
-                    font_name=font_name,
-                    font_size=size,
-                    multiline=True,
-                    width=wrap,
-                    anchor_x='left', anchor_y='top')
-        h = self._height = tmp.content_height
-        w = self._width = tmp.content_width
+        w, h = self._width, self._height = _label_pool.measure(self._display_text, font_name, size, self.wrap)
 
         self._idle_colour = colour  # mimick menu "over" behaviour using this colour
         self._over_colour = None  # mimick menu "over" behaviour using this colour
@@ -6883,6 +7864,17 @@ class Text(Item, metaclass=use_on_events):
         self.game = game
         return self.create_label()
 
+    def unload_assets(self):  # text.unload
+        self._release_label()
+        super().unload_assets()
+
+    def _release_label(self):
+        """ Give the label (and shadow) back to the pool for another Text to use """
+        _label_pool.release(self.resource)
+        _label_pool.release(self.resource_offset)
+        set_resource(self.resource_name, resource=None)
+        set_resource(self.resource_name, resource=None, subkey="offset")
+
     def set_over_colour(self, colour):
         if colour and len(colour) == 3:
             # add an alpha value if needed
@@ -6921,30 +7913,15 @@ class Text(Item, metaclass=use_on_events):
             self._text_index = len(self._display_text)
 
         self._animated_text = self._display_text[:self._text_index]
-        wrap = self.wrap if self.wrap > 0 else 1  # don't allow 0 width labels
-        label = Label(self._animated_text,
-                      font_name=self.font_name,
-                      font_size=self.size,
-                      color=c,
-                      multiline=True,
-                      width=wrap,
-                      x=self.x, y=self.y,
-                      anchor_x='left', anchor_y='top')
-        #        import pdb; pdb.set_trace()
-        #        except TypeError:
-        #            print("ERROR: Unable to create Label for '%s'"%self._animated_text)
-
+        self._release_label()  # usually handed straight back if the text hasn't changed
+        label = _label_pool.take(self._animated_text, self.font_name, self.size, self.wrap, c)
+        label.x, label.y = self.x, self.y
         set_resource(self.resource_name, resource=label)
 
-        if self.offset:
-            label_offset = Label(self._animated_text,
-                                 font_name=self.font_name,
-                                 font_size=self.size,
-                                 color=(0, 0, 0, 255),
-                                 multiline=True,
-                                 width=wrap,
-                                 x=self.x + self.offset, y=self.y - self.offset,
-                                 anchor_x='left', anchor_y='top')
+        if self.offset:  # a second label, as recolouring one label lays it out again in pyglet 1.3
+            label_offset = _label_pool.take(self._animated_text, self.font_name, self.size, self.wrap,
+                                            (0, 0, 0, 255))
+            label_offset.x, label_offset.y = self.x + self.offset, self.y - self.offset
             set_resource(self.resource_name, resource=label_offset, subkey="offset")
 
     def get_display_text(self):
@@ -6953,17 +7930,17 @@ class Text(Item, metaclass=use_on_events):
     def set_display_text(self, v):
         if v is None: return
         self._display_text = v
+        if getattr(self, "game", None):
+            self.game._name_index.update(self)
         # if there are special display requirements for this text, format it here
         if self.format_text:
             fn = get_function(self.game, self.format_text, self)
             text = fn(v)
         else:
             text = v
-        if self.resource:
-            self.resource.text = text
-
-        if self.resource_offset:
-            self.resource_offset.text = text
+        for label in [self.resource, self.resource_offset]:
+            if label and label.text != text:  # setting it lays out the label again
+                label.text = text
 
     display_text = property(get_display_text, set_display_text)
 
@@ -7271,6 +8248,7 @@ class MenuManager(metaclass=use_on_events):
             obj.load_assets(self.game)
             obj._usage(draw=True, interact=True)
             self.game._menu.append(obj.name)
+        self.game._invalidate_update_list()
 
     def on_set(self, objects):
         self.on_clear()
@@ -7325,6 +8303,7 @@ class MenuManager(metaclass=use_on_events):
             i_name = obj.name
             if i_name in self.game._menu:
                 self.game._menu.remove(i_name)
+        self.game._invalidate_update_list()
 
     def on_remove(self, menu_items=None):
         self._remove(menu_items)
@@ -7389,6 +8368,7 @@ class MenuManager(metaclass=use_on_events):
                 obj = get_object(self.game, i)
                 if obj and obj.name in self.game._menu:
                     self.game._menu.remove(obj.name)
+            self.game._invalidate_update_list()
 
     def on_enter_exit_sounds(self, enter_filename=None, exit_filename=None):
         """ Sounds to play when mouse moves over a menu item """
@@ -7585,6 +8565,8 @@ class Camera(metaclass=use_on_events):  # the view manager
             scene.load_assets(self.game)
         if not scene.game: scene.game = self.game
         self.game._resident.append(scene.name)
+        self.game._resource_cache.touch(scene._layer + scene._objects)
+        self.game._prefetcher.arrived(self.game, scene)  # decode the scenes the player can go to next
 
         # unload assets from older scenes 
         KEEP_SCENES_RESIDENT = 10
@@ -7797,22 +8779,21 @@ class Camera(metaclass=use_on_events):  # the view manager
     def on_on(self):
         self._overlay = None
 
-    def on_screenshot(self, filename, size=None):
+    def on_screenshot(self, filename, size=None, background=False):
         """ Save the current screen to a file
         :param filename:
+        :param size: shrink to fit (w, h) and save as a png
+        :param background: encode and write the file on the game's save writer thread
         :return:
         """
         # from PIL import ImageGrab
         # im = ImageGrab.grab()
         # im.save(filename)
-        pyglet.image.get_buffer_manager().get_color_buffer().save(filename)
-        from PIL import Image
-        img = Image.open(filename)
-        img = img.convert('RGB')  # remove alpha
-        fname, ext = os.path.splitext(filename)
-        if size:
-            img.thumbnail(size, Image.ANTIALIAS)
-        img.save(fname + ".png")
+        screen = grab_screen()
+        if background:
+            self.game._save_writer.submit(write_screenshot, screen, filename, size, fname=filename)
+        else:
+            write_screenshot(screen, filename, size)
 
     def on_relocate(self, position):  # camera.relocate
         self.game.scene.x, self.game.scene.y = position
@@ -8181,7 +9162,7 @@ class Mixer(metaclass=use_on_events):
     def on_publish_volumes(self):
         """ Use game.settings to set various volumes """
         if self.game:
-            options = self.game.parser.parse_args()
+            options = self.game.options
             self._session_mute = True if options.mute == True else False
         v = self.game.settings.music_volume
         if self.game.settings.mute == True:
@@ -8651,6 +9632,963 @@ Game class
 """
 
 
+class RenderPipeline(object):
+    """ Draw a list of objects in (z, rank) order with as few draw calls as possible
+
+        Runs of actors that can share a batch (Actor._batchable) are drawn
+        with one pyglet Batch per run, one OrderedGroup per object to keep
+        the order. Their sprites stay registered with the batch while they
+        keep their place, so a steady scene only moves sprites each frame.
+        Anything else (emitters, text, rotated, swayed, flipped or scrolling
+        actors) ends the run and draws itself. The game has one pipeline for
+        each of the background layers, scene objects, foreground layers and
+        menu.
+    """
+
+    def __init__(self):
+        self._keys = None  # [(id, z, rank), ...] of the last objects sorted
+        self._order = []
+        self._batches = []  # one pyglet Batch per run of batchable objects
+        self._registered = {}  # object name: (sprite, batch index, position)
+
+    def sort(self, objects):
+        """ Objects ordered by z then rank (ties keep their order), only re-sorted if a z or rank changed """
+        keys = [(id(obj), obj.z, obj.rank) for obj in objects]
+        if keys != self._keys:
+            self._keys = keys
+            self._order = sorted(objects, key=lambda obj: (obj.z, obj.rank))
+        return self._order
+
+    def _unregister(self, name):
+        sprite = self._registered.pop(name)[0]
+        # not deleted or already taken by another pipeline
+        if sprite._vertex_list is not None and sprite.batch in self._batches:
+            sprite.batch = None
+
+    def _register(self, obj, sprite, index, position):
+        record = self._registered.get(obj.name)
+        if record == (sprite, index, position) and sprite.batch is self._batches[index] and \
+                sprite.group.order == position:
+            return
+        if record and record[0] is not sprite:  # action has changed
+            self._unregister(obj.name)
+        while len(self._batches) <= index:
+            self._batches.append(pyglet.graphics.Batch())
+        sprite.batch = self._batches[index]
+        sprite.group = pyglet.graphics.OrderedGroup(position)
+        self._registered[obj.name] = (sprite, index, position)
+
+    def clear(self):
+        for name in list(self._registered.keys()):
+            self._unregister(name)
+        self._keys = None
+
+    def draw(self, objects, absolute=False):
+        """ Draw objects (already in order) """
+        batched = []
+        for obj in objects:
+            batchable = getattr(obj, "_batchable", None)
+            if batchable and batchable():
+                sprite = obj.resource
+                # pyglet_draw would draw nothing for these
+                batched.append(sprite if sprite and obj.allow_draw else False)
+            else:
+                batched.append(None)
+
+        # take sprites out of the batches before they're drawn if they now draw themselves or not at all
+        names = set(obj.name for obj, sprite in zip(objects, batched) if sprite)
+        for name in list(self._registered.keys()):
+            if name not in names:
+                self._unregister(name)
+
+        # move every sprite to its batch for this frame before drawing any, as a sprite that has changed
+        # batch would otherwise still be drawn from its old one
+        index, position = 0, 0
+        for obj, sprite in zip(objects, batched):
+            if sprite:
+                obj._pyglet_batch_position(sprite, absolute=absolute)
+                self._register(obj, sprite, index, position)
+                position += 1
+            elif sprite is None and position > 0:
+                index, position = index + 1, 0
+
+        index, position = 0, 0
+        for obj, sprite in zip(objects, batched):
+            if sprite:
+                position += 1
+            elif sprite is None:
+                if position > 0:
+                    self._batches[index].draw()
+                    index, position = index + 1, 0
+                obj.pyglet_draw(absolute=absolute)
+        if position > 0:
+            self._batches[index].draw()
+
+
+class HitGrid(object):
+    """ Uniform grid of clickable areas (left, top, right, bottom) by object name """
+    CELL = 128
+    MAX_CELLS = 256  # areas covering more cells than this are tested everywhere
+
+    def __init__(self):
+        self._cells = {}  # (column, row): set of names
+        self._bounds = {}  # name: bounds, or None if the object can be hit anywhere
+        self._anywhere = set()
+
+    def __contains__(self, name):
+        return name in self._bounds
+
+    def _keys(self, bounds):
+        left, top, right, bottom = [int(v // self.CELL) for v in bounds]
+        if (right - left + 1) * (bottom - top + 1) > self.MAX_CELLS:
+            return None
+        return [(i, j) for i in range(left, right + 1) for j in range(top, bottom + 1)]
+
+    def add(self, name, bounds):
+        keys = self._keys(bounds) if bounds else None
+        self._bounds[name] = bounds if keys else None
+        if not keys:
+            self._anywhere.add(name)
+            return
+        for key in keys:
+            self._cells.setdefault(key, set()).add(name)
+
+    def remove(self, name):
+        if name not in self._bounds:
+            return
+        bounds = self._bounds.pop(name)
+        if bounds is None:
+            self._anywhere.discard(name)
+            return
+        for key in self._keys(bounds):
+            cell = self._cells[key]
+            cell.discard(name)
+            if not cell:
+                del self._cells[key]
+
+    def query(self, x, y):
+        """ Names of the objects whose bounds might contain x, y """
+        names = self._cells.get((int(x // self.CELL), int(y // self.CELL)))
+        return names | self._anywhere if names else self._anywhere
+
+
+class HitIndex(object):
+    """ Spatial index of clickable areas for the mouse handlers, with one HitGrid each
+        for the scene, the menu and the modals.
+
+        A layer is rebuilt when its list of names changes, and Actor.__setattr__
+        reports anything that could move a clickable area so only those objects
+        are re-filed. Objects with a parent or a fullscreen clickable area are
+        always candidates. hits() confirms candidates with obj.collide, so the
+        index only ever saves work, it never decides what was clicked.
+    """
+
+    def __init__(self):
+        self._grids = {}  # layer: HitGrid
+        self._names = {}  # layer: the list of names the grid was built from
+        self._positions = {}  # layer: {name: place in the list}
+        self._dirty = set()  # names of objects whose clickable area may have moved
+
+    def moved(self, obj):
+        name = obj.__dict__.get("name")
+        if name:
+            self._dirty.add(name)
+
+    def _bounds(self, obj):
+        if obj._clickable_fullscreen or obj._parent:
+            return None
+        r = obj.clickable_area
+        return (r.x, r.y, r.x + r.w, r.y + r.h)
+
+    def sync(self, game):
+        layers = {"scene": game.scene._objects if game.scene else [], "menu": game._menu, "modals": game._modals}
+        for layer, names in layers.items():
+            if layer in self._grids and self._names[layer] == names:
+                continue
+            grid = self._grids[layer] = HitGrid()
+            self._names[layer] = list(names)
+            self._positions[layer] = {}
+            for i, name in enumerate(names):
+                self._positions[layer].setdefault(name, i)
+                obj = get_object(game, name)
+                if obj:
+                    grid.add(name, self._bounds(obj))
+        for name in self._dirty:
+            obj = None
+            for grid in self._grids.values():
+                if name in grid:
+                    obj = obj or get_object(game, name)
+                    grid.remove(name)
+                    if obj:
+                        grid.add(name, self._bounds(obj))
+        self._dirty.clear()
+
+    def hits(self, game, layer, x, y):
+        """ Objects in layer ("scene", "menu" or "modals") that collide with x, y,
+            scene objects in highest z first order (like Scene.objects_sorted),
+            menu and modals in list order.
+        """
+        self.sync(game)
+        positions = self._positions[layer]
+        objects = []
+        for name in self._grids[layer].query(x, y):
+            obj = get_object(game, name)
+            if obj and obj.collide(x, y):
+                objects.append((-obj.z if layer == "scene" else 0, positions[name], obj))
+        objects.sort(key=lambda hit: hit[:2])
+        return [hit[2] for hit in objects]
+
+    def clear(self):
+        self._grids, self._names, self._positions = {}, {}, {}
+        self._dirty.clear()
+
+
+class SolidIndex(object):
+    """ Spatial index of the solid areas in each scene, for WalkAreaManager.valid.
+
+        A scene's HitGrid is rebuilt when its list of objects changes, and
+        Actor.__setattr__ reports anything that could move a solid area so only
+        those objects are re-filed. Only objects that block walking (allow_update
+        and not an Emitter) are filed, and candidates are confirmed with
+        solid_area.collidepoint, so the answer is the same as testing every object.
+    """
+
+    def __init__(self):
+        self._grids = {}  # scene name: HitGrid
+        self._names = {}  # scene name: the list of names the grid was built from
+        self._dirty = set()  # names of objects whose solid area may have moved
+        self.queries = 0
+
+    def moved(self, obj):
+        name = obj.__dict__.get("name")
+        if name:
+            self._dirty.add(name)
+
+    def _add(self, grid, name, obj):
+        if obj.allow_update and not isinstance(obj, Emitter):
+            r = obj.solid_area
+            grid.add(name, (r.x, r.y, r.x + r.w, r.y + r.h))
+
+    def sync(self, game, scene):
+        """ Catch up with the objects in scene, returns its HitGrid """
+        grid = self._grids.get(scene.name)
+        if grid is None or self._names[scene.name] != scene._objects:
+            grid = self._grids[scene.name] = HitGrid()
+            self._names[scene.name] = list(scene._objects)
+            for name in scene._objects:
+                obj = get_object(game, name)
+                if not obj:
+                    print("ERROR: %s not found in scene even though recorded in scene" % name)
+                    continue
+                self._add(grid, name, obj)
+        if self._dirty:
+            for name in self._dirty:
+                obj = None
+                for scene_name, other in self._grids.items():
+                    if name in self._names[scene_name]:
+                        obj = obj or get_object(game, name)
+                        other.remove(name)
+                        if obj:
+                            self._add(other, name, obj)
+            self._dirty.clear()
+        return grid
+
+    def solid(self, game, grid, x, y):
+        """ True if x, y is inside a solid area filed in grid """
+        self.queries += 1
+        for name in grid.query(x, y):
+            obj = get_object(game, name)
+            if obj and obj.solid_area.collidepoint(x, y):
+                return True
+        return False
+
+    def clear(self):
+        self._grids, self._names = {}, {}
+        self._dirty.clear()
+
+
+class MetadataBundle(object):
+    """ Smart loading's view of data/: directory listings, the text of small metadata files
+        (METADATA_EXTENSIONS) and the size of each png, read from one file written by tools/metadata_bundle.
+
+        Each entry is checked against the modified time of its file or directory the first time it is
+        used. A stale or missing entry (or no bundle at all) falls back to the filesystem, so the bundle
+        only ever saves time. A name missing from an up to date directory listing doesn't exist.
+    """
+
+    def __init__(self, fname=None, root=None):
+        self.fname = fname
+        self.root = root  # the bundle's paths are relative to this, the directory with data/ in it
+        self._dirs = {}  # path: [modified time, [names]]
+        self._files = {}  # path: [modified time, text]
+        self._images = {}  # path: [modified time, w, h]
+        self._checked = {}  # path: is the entry up to date
+        self._loaded = False
+        self.hits = 0
+        self.misses = 0
+        self.scanned = 0  # directories read by scan
+
+    def _load(self):
+        self._loaded = True
+        if not self.fname or not os.path.isfile(self.fname):
+            return
+        try:
+            with open(self.fname, "r") as f:
+                data = json.loads(f.read())
+        except (IOError, ValueError):
+            log.error("Unable to read metadata bundle %s, using the filesystem" % self.fname)
+            return
+        self._dirs, self._files, self._images = data["dirs"], data["files"], data["images"]
+        if logging:
+            log.info("Loaded metadata bundle %s with %i directories" % (self.fname, len(self._dirs)))
+
+    def clear(self):
+        self._dirs, self._files, self._images, self._checked = {}, {}, {}, {}
+        self._loaded = False
+
+    def recheck(self):
+        """ Check entries against the filesystem again as they are used (eg files edited since they were loaded) """
+        self._checked = {}
+
+    def _key(self, path):
+        root = self.root if self.root else working_dir
+        key = os.path.relpath(os.path.abspath(get_safe_path(path)), root).replace("\\", "/")
+        return None if key.startswith("..") else key
+
+    def _lookup(self, table, path):
+        """ The up to date entry for path in table ("_dirs", "_files" or "_images"), or None """
+        if not self._loaded:
+            self._load()
+        if not self._dirs:
+            return None
+        key = self._key(path)
+        entry = getattr(self, table).get(key) if key else None
+        if entry is None:
+            return None
+        if key not in self._checked:
+            try:
+                self._checked[key] = os.stat(get_safe_path(path)).st_mtime == entry[0]
+            except OSError:
+                self._checked[key] = False
+        return entry if self._checked[key] else None
+
+    def _missing(self, path):
+        """ Does an up to date listing of path's directory say it doesn't exist? """
+        entry = self._lookup("_dirs", os.path.dirname(get_safe_path(path)))
+        return entry is not None and os.path.basename(path) not in entry[1]
+
+    def listdir(self, path):
+        """ Like os.listdir, but [] if there is no such directory """
+        entry = self._lookup("_dirs", path)
+        if entry is not None:
+            self.hits += 1
+            return list(entry[1])
+        self.misses += 1
+        path = get_safe_path(path)
+        return os.listdir(path) if os.path.isdir(path) else []
+
+    def glob(self, path, extension=""):
+        """ Like glob.glob(os.path.join(path, "*" + extension)) """
+        return [os.path.join(path, name) for name in self.listdir(path)
+                if name.endswith(extension) and not name.startswith(".")]
+
+    def isdir(self, path):
+        if self._lookup("_dirs", path) is not None:
+            self.hits += 1
+            return True
+        if self._missing(path):
+            self.hits += 1
+            return False
+        self.misses += 1
+        return os.path.isdir(get_safe_path(path))
+
+    def isfile(self, path):
+        if self._lookup("_files", path) is not None or self._lookup("_images", path) is not None:
+            self.hits += 1
+            return True
+        if self._missing(path):
+            self.hits += 1
+            return False
+        self.misses += 1
+        return os.path.isfile(get_safe_path(path))
+
+    def read(self, path):
+        """ The text of a metadata file, or None if there is no such file """
+        entry = self._lookup("_files", path)
+        if entry is not None:
+            self.hits += 1
+            return entry[1]
+        if self._missing(path):
+            self.hits += 1
+            return None
+        self.misses += 1
+        path = get_safe_path(path)
+        if not os.path.isfile(path):
+            return None
+        with open(path, "r") as f:
+            return f.read()
+
+    def mtime(self, path):
+        """ Like os.path.getmtime, but None if there is no such file """
+        entry = self._lookup("_files", path) or self._lookup("_images", path)
+        if entry is not None:
+            self.hits += 1
+            return entry[0]
+        if self._missing(path):
+            self.hits += 1
+            return None
+        self.misses += 1
+        path = get_safe_path(path)
+        return os.path.getmtime(path) if os.path.isfile(path) else None
+
+    def image_size(self, path):
+        entry = self._lookup("_images", path)
+        if entry is not None:
+            self.hits += 1
+            return entry[1], entry[2]
+        self.misses += 1
+        return get_image_size(path)
+
+    def forget(self, path):
+        """ path has just been written, so check it and its directory's listing against the filesystem again """
+        for key in [self._key(path), self._key(os.path.dirname(get_safe_path(path)))]:
+            self._checked.pop(key, None)
+
+    def _merge(self, entries):
+        """ Add entries from scan_metadata, they have just been read so are up to date """
+        for table, path, entry in entries:
+            key = self._key(path)
+            getattr(self, table)[key] = entry
+            self._checked[key] = True
+
+    def build(self, directory):
+        """ Walk directory (eg data/ under self.root) and keep everything smart loading reads from it """
+        self.clear()
+        self._loaded = True
+        self._merge(scan_metadata(get_safe_path(directory)))
+
+    def scan(self, paths, workers=None):
+        """ Read the directories in paths (eg one per object) on worker threads, ahead of smart loading them.
+            Directories the bundle already has up to date are skipped. The results are merged in the order of
+            paths, so the bundle is the same however the threads were scheduled.
+            workers defaults to SMART_LOAD_WORKERS as it is when called, 0 turns the scan off.
+        """
+        if workers is None:
+            workers = SMART_LOAD_WORKERS
+        paths = [path for path in paths if self._lookup("_dirs", path) is None]
+        if workers < 1 or len(paths) == 0:
+            return
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            for entries in executor.map(scan_metadata, [get_safe_path(path) for path in paths]):
+                self._merge(entries)
+        self.scanned += len(paths)
+
+    def write(self, fname=None):
+        fname = fname if fname else self.fname
+        with open(fname + ".tmp", "w") as f:
+            f.write(json.dumps({"dirs": self._dirs, "files": self._files, "images": self._images}))
+        os.replace(fname + ".tmp", fname)
+
+    @property
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "directories": len(self._dirs), "files": len(self._files),
+                "images": len(self._images), "scanned": self.scanned}
+
+
+def scan_metadata(directory):
+    """ Everything under directory a MetadataBundle keeps, as [(table, path, entry), ...].
+        Only touches the filesystem so it can run on any thread. """
+    entries = []
+    for path, dirs, files in os.walk(directory):
+        dirs.sort()
+        entries.append(("_dirs", path, [os.stat(path).st_mtime, os.listdir(path)]))
+        for name in files:
+            fname = os.path.join(path, name)
+            extension = os.path.splitext(name)[1].lower()
+            try:
+                if extension in METADATA_EXTENSIONS:
+                    with open(fname, "r") as f:
+                        entries.append(("_files", fname, [os.stat(fname).st_mtime, f.read()]))
+                elif extension == ".png":
+                    size = get_image_size(fname)
+                    if size:
+                        entries.append(("_images", fname, [os.stat(fname).st_mtime, size[0], size[1]]))
+            except (IOError, UnicodeDecodeError):  # leave it to smart loading to report
+                continue
+    return entries
+
+
+class ResourceCache(object):
+    """ Keep the decoded images of loaded objects within a memory budget
+
+        Objects are remembered least recently used first as they load their
+        assets or their scene becomes current. When the estimated size of
+        their frames (w*h*4 bytes each) goes over budget, the least recently
+        used objects not referenced by the current scene, menu, modals or
+        player are unloaded. An unloaded (evicted) object reloads itself the
+        next time its resource is asked for (see Actor.resource).
+
+        Frames packed by tools/atlas are charged as whole atlas pages instead,
+        for as long as any loaded action uses the page.
+    """
+
+    def __init__(self, budget=DEFAULT_RESOURCE_BUDGET, low_memory_budget=LOW_MEMORY_RESOURCE_BUDGET):
+        self.budget = budget  # MB
+        self.low_memory_budget = low_memory_budget  # MB, used if game.low_memory
+        self._objects = OrderedDict()  # object name: bytes, least recently used first
+        self._pages = {}  # atlas page filename: bytes
+        self.evicted = set()  # names of objects unloaded to stay within budget
+        self.bytes = 0  # estimated bytes resident
+        self.hits = 0  # objects already loaded when they were needed
+        self.misses = 0  # objects that had to load
+        self.evictions = 0
+
+    def _object_bytes(self, obj):
+        total = 0
+        for action in getattr(obj, "_actions", {}).values():
+            if getattr(action, "_atlas_page", None):
+                continue  # charged with its page
+            if action._loaded and action.resource:
+                total += action.w * action.h * 4 * max(1, action.num_of_frames)
+        return total
+
+    def loaded(self, game, obj):
+        """ obj has loaded its assets """
+        self.evicted.discard(obj.name)  # reloaded some other way (eg by its scene), so no need to restore it
+        self.forget(obj)
+        self.misses += 1
+        size = self._object_bytes(obj)
+        self._objects[obj.name] = size
+        self.bytes += size
+        self._charge_pages()
+        self.trim(game, keep=obj.name)
+
+    def forget(self, obj):
+        """ obj has unloaded its assets """
+        self.bytes -= self._objects.pop(obj.name, 0)
+        self._charge_pages()
+
+    def _charge_pages(self):
+        """ Charge the atlas pages that are loaded, and stop charging the released ones """
+        for page in list(self._pages.keys()):
+            if page not in _atlas_pages:
+                self.bytes -= self._pages.pop(page)
+        for page, texture in _atlas_pages.items():
+            if page not in self._pages:
+                self._pages[page] = texture.width * texture.height * 4
+                self.bytes += self._pages[page]
+
+    def restore(self, game, obj):
+        """ Reload an evicted object """
+        self.evicted.discard(obj.name)
+        obj.load_assets(game)
+
+    def touch(self, names):
+        """ These objects are in use, so make them the most recently used """
+        for name in names:
+            if name in self._objects:
+                self.hits += 1
+                self._objects.move_to_end(name)
+
+    def _pinned(self, game):
+        pinned = set(game._menu) | set(game._modals)
+        if game.scene:
+            pinned.update(game.scene._objects)
+            pinned.update(game.scene._layer)
+        if game.player:
+            pinned.add(game.player.name)
+        return pinned
+
+    def trim(self, game, keep=None):
+        """ Unload the least recently used objects that aren't on screen until within budget """
+        budget = (self.low_memory_budget if game.low_memory else self.budget) * 1024 * 1024
+        if self.bytes <= budget or game._headless:
+            return
+        pinned = self._pinned(game)
+        if keep:
+            pinned.add(keep)
+        for name in list(self._objects.keys()):
+            if self.bytes <= budget:
+                break
+            if name in pinned:
+                continue
+            obj = get_object(game, name)
+            if obj:
+                obj.unload_assets()
+            self.bytes -= self._objects.pop(name, 0)
+            self._charge_pages()
+            self.evicted.add(name)
+            self.evictions += 1
+
+    @property
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "bytes": self.bytes, "objects": len(self._objects), "pages": len(self._pages)}
+
+
+class AssetLoader(object):
+    """ Decode action spritesheets on worker threads
+
+        Scene.load_assets_responsive queues the spritesheets of all its
+        objects up front. The workers decode them into ImageData (no GL calls)
+        and Action.load_assets takes the decoded image instead of reading the
+        file, so the main thread only builds the animation and uploads
+        textures.
+    """
+
+    def __init__(self, workers=ASSET_LOADER_WORKERS):
+        self.workers = workers
+        self._executor = None
+        self._images = OrderedDict()  # filename: future decoding it
+        self.queued = 0  # spritesheets sent to the workers
+        self.taken = 0  # decoded spritesheets used by Action.load_assets
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def _action_files(self, game, obj):
+        files = []
+        for action in getattr(obj, "_actions", {}).values():
+            if action._atlas_file(game, os.path.splitext(action._image)[0]):
+                continue  # packed by tools/atlas, so loads from an atlas page instead
+            files.append(get_best_file(game, action._image))
+        return files
+
+    def submit(self, game, obj):
+        """ Start decoding the spritesheets of obj's actions, returns their filenames """
+        if game._headless:
+            return []
+        files = self._action_files(game, obj)
+        self.decode(files)
+        return files
+
+    def decode(self, files):
+        """ Start decoding these spritesheets """
+        if self.workers < 1:
+            return
+        for fname in files:
+            if fname not in self._images and os.path.isfile(fname):
+                self._images[fname] = self._get_executor().submit(load_image, fname)
+                self.queued += 1
+
+    def ready(self, files):
+        """ True if none of these files are still decoding """
+        for fname in files:
+            future = self._images.get(fname)
+            if future and not future.done():
+                return False
+        return True
+
+    def take(self, fname):
+        """ The decoded image for fname (waiting for it if still decoding) or None if it wasn't submitted """
+        future = self._images.pop(fname, None)
+        if future is None:
+            return None
+        try:
+            image = future.result()
+        except Exception as e:  # the caller falls back to loading it on the main thread
+            log.warning("Unable to decode %s in the background: %s" % (fname, e))
+            return None
+        if image:
+            self.taken += 1
+        return image
+
+    def discard(self, files):
+        """ Drop these decoded images if they haven't been used """
+        for fname in files:
+            future = self._images.pop(fname, None)
+            if future:
+                future.cancel()
+
+    def cancel(self):
+        """ Drop any decoded images that haven't been used """
+        for future in self._images.values():
+            future.cancel()
+        self._images.clear()
+
+    @property
+    def stats(self):
+        return {"queued": self.queued, "taken": self.taken, "pending": len(self._images)}
+
+
+class SceneGraph(object):
+    """ Which scenes lead to which through portals
+
+        Built from every scene's portals the first time it is needed and
+        thrown away when a portal is added, removed, moved or relinked (see
+        Portal.__setattr__ and Game._add/_remove), so walkthrough gotos and
+        the scene prefetcher don't have to search the scenes each time.
+    """
+
+    def __init__(self):
+        self._exits = None  # scene name: [(portal name, destination scene name), ...]
+        self.builds = 0
+
+    def invalidate(self):
+        self._exits = None
+
+    def _build(self, game):
+        self._exits = {}
+        for scene in game._scenes.values():
+            exits = self._exits[scene.name] = []
+            for obj_name in scene._objects:
+                portal = get_object(game, obj_name)
+                if not isinstance(portal, Portal):
+                    continue
+                link = get_object(game, portal._link)
+                destination = link.scene if link else None
+                if destination and destination.name:
+                    exits.append((portal.name, destination.name))
+        self.builds += 1
+
+    def exits(self, game, scene_name):
+        """ [(portal name, destination scene name), ...] for the portals in this scene """
+        if self._exits is None:
+            self._build(game)
+        return self._exits.get(scene_name, [])
+
+    def path(self, game, start, target):
+        """ The shortest way from scene start to the scene whose upper case name is target,
+            as [(portal name, scene name it leads to), ...], or None if there isn't one """
+        if start.upper() == target:
+            return []
+        previous = {start: None}  # scene name: (scene name, portal name) it was reached through
+        frontier = deque([start])
+        while frontier:
+            scene_name = frontier.popleft()
+            for portal_name, destination in self.exits(game, scene_name):
+                if destination in previous:
+                    continue
+                previous[destination] = (scene_name, portal_name)
+                if destination.upper() == target:
+                    steps = []
+                    while previous[destination]:
+                        scene_name, portal_name = previous[destination]
+                        steps.append((portal_name, destination))
+                        destination = scene_name
+                    return steps[::-1]
+                frontier.append(destination)
+        return None
+
+    def neighbours(self, game, scene_name, hops=1):
+        """ Names of the scenes within hops portals of this one, nearest first """
+        found = OrderedDict([(scene_name, 0)])
+        frontier = [scene_name]
+        for hop in range(hops):
+            next_frontier = []
+            for name in frontier:
+                for portal_name, destination in self.exits(game, name):
+                    if destination not in found:
+                        found[destination] = hop + 1
+                        next_frontier.append(destination)
+            frontier = next_frontier
+        return [name for name in found if name != scene_name]
+
+
+class ScenePrefetcher(object):
+    """ Warm the scenes the player can walk to next
+
+        When the camera changes scene, the scenes up to `hops` portals away
+        have the spritesheets of their unloaded objects decoded by the
+        AssetLoader, nearest first, while the estimated size of the decoded
+        images stays within budget. Going through a portal then finds the
+        next scene already decoded and only has to build its animations.
+    """
+
+    def __init__(self, hops=PREFETCH_HOPS, budget=PREFETCH_BUDGET):
+        self.hops = hops
+        self.budget = budget  # MB
+        self._warm = OrderedDict()  # scene name: spritesheets queued for it, nearest scene first
+        self.bytes = 0  # estimated bytes of the queued spritesheets
+        self.hits = 0  # scene changes to a warm scene
+        self.misses = 0  # scene changes to a cold scene
+
+    def neighbours(self, game, scene):
+        """ Names of the scenes within self.hops portals of scene, nearest first """
+        return game._scene_graph.neighbours(game, scene.name, self.hops)
+
+    def _forget(self, game, scene_name):
+        files = self._warm.pop(scene_name, {})
+        game._asset_loader.discard(files.keys())
+        self.bytes -= sum(files.values())
+
+    def arrived(self, game, scene):
+        """ The camera has moved to scene, so stop holding its images and warm its neighbours """
+        if scene.name in self._warm:
+            self.hits += 1
+            self._forget(game, scene.name)  # anything it didn't use by now isn't needed
+        else:
+            self.misses += 1
+        if game._headless:
+            return
+        neighbours = [name for name in self.neighbours(game, scene) if name not in game._resident]
+        for name in list(self._warm.keys()):
+            if name not in neighbours:
+                self._forget(game, name)
+        queued = set()
+        for files in self._warm.values():
+            queued.update(files)
+        budget = self.budget * 1024 * 1024
+        full = False  # stop looking at files once the budget is spent
+        for name in neighbours:
+            if full:
+                break
+            if name in self._warm:
+                continue
+            neighbour = get_object(game, name)
+            if not neighbour:
+                continue
+            files = self._warm[name] = OrderedDict()  # fname: estimated bytes
+            for obj_name in neighbour._objects + neighbour._layer:
+                if full:
+                    break
+                obj = get_object(game, obj_name)
+                if not obj or obj.name in game._resource_cache._objects:
+                    continue  # already loaded
+                for fname in game._asset_loader._action_files(game, obj):
+                    if fname in queued or not os.path.isfile(fname):
+                        continue
+                    size = get_image_size(fname)
+                    size = size[0] * size[1] * 4 if size else 0
+                    if self.bytes + size > budget:
+                        full = True
+                        break
+                    files[fname] = size
+                    queued.add(fname)
+                    self.bytes += size
+            game._asset_loader.decode(files.keys())
+
+    @property
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "bytes": self.bytes, "scenes": len(self._warm)}
+
+
+class EventQueue(object):
+    """ The game's scripting event queue, a drop-in for the old list of (fn, args, kwargs).
+
+        Unstarted events wait in a deque in the order they were queued. Started
+        events whose owner (the first arg) is still busy sit in a per-object
+        channel. Actors tell the queue when their busy count drops to zero (see
+        Actor.set_busy) so each tick only those channels are checked and
+        retired; owners that can't do that (scenes, camera, mixer, etc) are
+        polled. Iterating or indexing the queue gives the started events first,
+        then the pending ones, as before.
+    """
+
+    def __init__(self):
+        self._pending = deque()  # events not yet started
+        self._started = OrderedDict()  # seq: event, started but not yet retired
+        self._channels = {}  # id(owner): [owner, [seq, ...]] for owners with started events
+        self._ready = set()  # channels whose owner may no longer be busy
+        self._polled = set()  # channels whose owner doesn't wake the queue, so check every time
+        self._owners = OrderedDict()  # id(owner): [owner, number of events in the queue]
+        self._seq = 0
+        self.version = 0  # bumped whenever the set of owners may have changed
+
+    def __len__(self):
+        return len(self._started) + len(self._pending)
+
+    def __iter__(self):
+        return itertools.chain(list(self._started.values()), list(self._pending))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        if index < 0:
+            index += len(self)
+        started = len(self._started)
+        if 0 <= index < started:
+            return next(itertools.islice(self._started.values(), index, None))
+        if started <= index < len(self):
+            return self._pending[index - started]
+        raise IndexError("event queue index out of range")
+
+    @property
+    def started(self):
+        """ Number of events that have started but not yet been retired (the old game._event_index) """
+        return len(self._started)
+
+    def append(self, event):
+        self._pending.append(event)
+        owner = event[1][0]
+        count = self._owners.get(id(owner))
+        if count:
+            count[1] += 1
+        else:
+            self._owners[id(owner)] = [owner, 1]
+            self.version += 1
+
+    def clear(self):
+        self._pending.clear()
+        self._started.clear()
+        self._channels = {}
+        self._ready = set()
+        self._polled = set()
+        self._owners = OrderedDict()
+        self.version += 1
+
+    def owners(self):
+        """ The objects that own an event in the queue, each once, in the order they first queued """
+        return [owner for owner, _ in self._owners.values()]
+
+    def peek(self):
+        """ The next event to start, or None """
+        return self._pending[0] if self._pending else None
+
+    def start(self):
+        """ Move the next pending event into its owner's channel and return it """
+        event = self._pending.popleft()
+        owner = event[1][0]
+        key = id(owner)
+        self._seq += 1
+        self._started[self._seq] = event
+        if key in self._channels:
+            self._channels[key][1].append(self._seq)
+        else:
+            self._channels[key] = [owner, [self._seq]]
+        self._ready.add(key)  # may finish without ever becoming busy
+        if not getattr(owner, "_busy_wakes_events", False):
+            self._polled.add(key)
+        return event
+
+    def wake(self, owner):
+        """ Called by an owner when its busy count drops to zero """
+        key = id(owner)
+        if key in self._channels:
+            self._ready.add(key)
+
+    def any_busy(self):
+        """ Is the owner of any started event still busy? """
+        candidates = self._ready | self._polled
+        for key in candidates:
+            if self._channels[key][0].busy > 0:
+                return True
+        # any channel that hasn't woken since it was last checked is still busy
+        return len(self._channels) > len(candidates)
+
+    def retire(self):
+        """ Drop the started events of every owner that is no longer busy, return how many were dropped """
+        retired = 0
+        candidates = self._ready | self._polled if self._polled else self._ready
+        self._ready = set()
+        for key in candidates:
+            owner, seqs = self._channels[key]
+            if owner.busy == 0:
+                for seq in seqs:
+                    del self._started[seq]
+                del self._channels[key]
+                self._polled.discard(key)
+                retired += len(seqs)
+                count = self._owners[key]
+                count[1] -= len(seqs)
+                if count[1] <= 0:
+                    del self._owners[key]
+                    self.version += 1
+        return retired
+
+
 def restore_object(game, obj):
     """ Call after restoring an object from a pickle """
     obj.game = game
@@ -8665,65 +10603,256 @@ def restore_object(game, obj):
         obj.set_editable()
 
 
-def save_game_pickle(game, fname):
-    log.info("Saving game to %s" % fname)
+class SaveCache(object):
+    """ The record of each game object as of the last save or load
+
+        Actors and scenes mark themselves dirty when an attribute is set, as
+        do the objects passed to each event and each interact, use or look
+        script the game runs (a walkarea marks its scene, see Actor._mark_scripted,
+        Actor.__setattr__, Scene.__setattr__ and Game._handle_events), so a
+        save only pickles the objects that have changed since the last one.
+        The player and everything in the current scene are always pickled
+        again (see snapshot_game) as in place changes don't mark anything.
+        New records hold the plain pickle until write_save_game compresses
+        them, which may be on the save writer's thread.
+    """
+    transient = frozenset(["game", "_editable", "_tk_edit"])  # cleared for pickling and repopulated after
+
+    def __init__(self):
+        self._records = {}  # (record type, key): (id of object, pickle, is the pickle compressed)
+        self._lock = threading.Lock()  # write_save_game may swap in compressed records from another thread
+        self.dirty = set()  # names of objects changed since their record was made
+        self.pickled = 0
+        self.reused = 0
+
+    def mark(self, name):
+        self.dirty.add(name)
+
+    def record(self, game, kind, key, obj):
+        """ The record for obj, reusing the last one if obj hasn't changed since """
+        with self._lock:
+            cached = self._records.get((kind, key))
+        if cached and cached[0] == id(obj) and obj.name not in self.dirty:
+            self.reused += 1
+            return cached
+        try:
+            record = (id(obj), pickle.dumps(obj), False)
+        finally:
+            restore_object(game, obj)  # restore game object and editables that were cleansed for pickle
+        with self._lock:
+            self._records[(kind, key)] = record
+        self.pickled += 1
+        return record
+
+    def compressed(self, kind, key, record):
+        """ Compress a record, keeping the compressed version if it is still the current one """
+        if record[2]:
+            return record[1]
+        data = zlib.compress(record[1])
+        with self._lock:
+            if self._records.get((kind, key)) is record:
+                self._records[(kind, key)] = (record[0], data, True)
+        return data
+
+    def saved(self, keys):
+        """ Everything in keys has just been recorded, forget any other records """
+        with self._lock:
+            for key in set(self._records.keys()) - set(keys):
+                del self._records[key]
+        self.dirty = set()
+
+    def loaded(self, records):
+        """ Start from the records of a save game, {(record type, key): (object, compressed pickle)} """
+        with self._lock:
+            self._records = {key: (id(obj), data, True) for key, (obj, data) in records.items()}
+        self.dirty = set()
+
+    def clear(self):
+        with self._lock:
+            self._records = {}
+        self.dirty = set()
+
+    @property
+    def stats(self):
+        return {"pickled": self.pickled, "reused": self.reused, "records": len(self._records)}
+
+
+def write_save_record(f, kind, key, data):
+    key = key.encode("utf-8")
+    f.write(struct.pack(SAVE_RECORD, kind, len(key), len(data)))
+    f.write(key)
+    f.write(data)
+
+
+def read_save_header(f):
+    """ The metadata at the start of a save file, without reading the rest.
+        Returns None and leaves f at the start if it is an older save that's just a run of pickles. """
+    if f.read(len(SAVE_MAGIC)) != SAVE_MAGIC:
+        f.seek(0)
+        return None
+    version, length = struct.unpack(">HI", f.read(struct.calcsize(">HI")))
+    if version > SAVE_FORMAT:
+        raise ValueError("Save file is format %i, this version of pyvida reads up to %i" % (version, SAVE_FORMAT))
+    return pickle.loads(zlib.decompress(f.read(length)))
+
+
+def read_save_records(f):
+    """ Yield (record type, key, compressed pickle) for each record after the header """
+    size = struct.calcsize(SAVE_RECORD)
+    while True:
+        kind, key_length, length = struct.unpack(SAVE_RECORD, f.read(size))
+        if kind == SAVE_END:
+            return
+        key = f.read(key_length).decode("utf-8")
+        yield kind, key, f.read(length)
+
+
+def read_save_values(game, f):
+    """ Yield the values in a save file after its metadata, in the order save_game_pickle stores them """
+    objects = {SAVE_ACTORS: {}, SAVE_ITEMS: {}, SAVE_SCENES: {}}
+    state = []
+    records = {}
+    for kind, key, data in read_save_records(f):
+        if kind == SAVE_STATE:
+            state = pickle.loads(zlib.decompress(data))
+        else:
+            obj = objects[kind][key] = pickle.loads(zlib.decompress(data))
+            records[(kind, key)] = (obj, data)
+    game._save_cache.loaded(records)
+    for value in state:
+        yield value
+    for kind in [SAVE_ACTORS, SAVE_ITEMS, SAVE_SCENES]:
+        yield objects[kind]
+
+
+def read_legacy_save_values(game, f):
+    """ As read_save_values, for saves from before the record format """
+    game._save_cache.clear()
+    while True:
+        yield pickle.load(f)
+
+
+def snapshot_game(game):
+    """ Pickle the game as it is now, ready for write_save_game.
+        Only objects changed since the last save are pickled, the rest reuse their last record. """
     # time since game created or loaded
     dt = datetime.now() - game.storage._last_load_time
     game.storage._total_time_in_game += dt
     game.storage._last_save_time = game.storage._last_load_time = datetime.now()
-    with open(fname, 'wb') as f:
-        # dump some metadata (eg date, title, etc)
-        pickle.dump(game.get_game_info, f)
-        # dump info about the player, including history
-        pickle.dump(game.get_player_info, f)
-        pickle.dump(game.get_engine, f)
-        pickle.dump(game.storage, f)
-        mixer1, sfx_mixers, mixer3 = game.mixer._music_player, game.mixer._sfx_players, game.mixer._ambient_player
-        pickle.dump(game.mixer, f)
-        game.mixer._music_player, game.mixer._sfx_players, game.mixer._ambient_player = mixer1, sfx_mixers, mixer3
-        game.mixer.game = game
-        pickle.dump(_pyglet_fonts, f)
-        pickle.dump(game._menu, f)
-        pickle.dump(game._menus, f)
-        pickle.dump(game._modals, f)
-        pickle.dump(game.visited, f)
-        pickle.dump(game._selected_options, f)
-        pickle.dump(game._modules, f)
-        pickle.dump(game._sys_paths, f)
-        pickle.dump(game._resident, f)
-
-        pyvida_classes = [
-            Actor, Item, Scene, Portal, Text, Emitter, Collection]
-        # dump info about all the objects and scenes in the game
-        for objects in [game._actors, game._items, game._scenes]:
-#            objects_to_pickle = []
-            for o in objects.values():  # test objects
-                if o.__class__ not in pyvida_classes:
-                    log.warning("Pickling {}, a NON-PYVIDA CLASS {}".format(o.name, o.__class__))
-                #                    continue
-                try:
-                    pickle.dumps(o)
-                except:
-                    for k, x in o.__dict__.items():
-                        try:
-                            pickle.dumps(x)
-                        except:
-                            print("failed on", k, x)
-                    print("Error:", sys.exc_info())
-                    print("failed pickling", o.name)
-                    if game and not game.fullscreen:
-                        import pdb;
-                        pdb.set_trace()
-            pickle.dump(objects, f)
-            # restore game object and editables that were cleansed for pickle
-            for o in objects.values():
-                restore_object(game, o)
-        for o in game._resident:
-            scene = get_object(game, o)
-            if scene: restore_object(game, scene)
 
+    # metadata (eg date, title, etc)
+    meta = pickle.dumps(game.get_game_info)
+
+    # info about the player (including history), the engine, storage, mixer, fonts, menus, etc
+    mixer1, sfx_mixers, mixer3 = game.mixer._music_player, game.mixer._sfx_players, game.mixer._ambient_player
+    state = pickle.dumps([game.get_player_info, game.get_engine, game.storage, game.mixer, _pyglet_fonts,
+                          game._menu, game._menus, game._modals, game.visited, game._selected_options,
+                          game._modules, game._sys_paths, game._resident])
+    game.mixer._music_player, game.mixer._sfx_players, game.mixer._ambient_player = mixer1, sfx_mixers, mixer3
+    game.mixer.game = game
+
+    pyvida_classes = [
+        Actor, Item, Scene, Portal, Text, Emitter, Collection]
+    # a record for each of the objects and scenes in the game
+    records = []
+    # in place changes (eg to an action or motion of an actor) don't mark anything, so always record what's on
+    # screen again, the rest rely on being marked
+    on_screen = [game.player.name] if game.player else []
+    if game.scene:
+        on_screen += [game.scene.name] + game.scene._objects + game.scene._layer
+    for name in on_screen:
+        game._save_cache.mark(name)
+    for kind, objects in [(SAVE_ACTORS, game._actors), (SAVE_ITEMS, game._items), (SAVE_SCENES, game._scenes)]:
+        for key, o in list(objects.items()):
+            if o.__class__ not in pyvida_classes:
+                log.warning("Pickling {}, a NON-PYVIDA CLASS {}".format(o.name, o.__class__))
+            try:
+                records.append((kind, key, game._save_cache.record(game, kind, key, o)))
+            except:
+                for k, x in o.__dict__.items():
+                    try:
+                        pickle.dumps(x)
+                    except:
+                        print("failed on", k, x)
+                print("Error:", sys.exc_info())
+                print("failed pickling", o.name)
+                if game and not game.fullscreen:
+                    import pdb;
+                    pdb.set_trace()
+                raise
+    game._save_cache.saved([(kind, key) for kind, key, record in records])
+    return meta, state, records
+
+
+def write_save_game(snapshot, fname, save_cache):
+    """ Write a snapshot_game as a header with the save's metadata (see load_game_meta_pickle), a record
+        of game wide state and a zlib compressed record for each actor, item and scene.
+        Doesn't touch any game objects, so is safe to call from another thread. """
+    meta, state, records = snapshot
+    with open(fname + ".tmp", 'wb') as f:
+        meta = zlib.compress(meta)
+        f.write(SAVE_MAGIC)
+        f.write(struct.pack(">HI", SAVE_FORMAT, len(meta)))
+        f.write(meta)
+        write_save_record(f, SAVE_STATE, "", zlib.compress(state))
+        for kind, key, record in records:
+            write_save_record(f, kind, key, save_cache.compressed(kind, key, record))
+        write_save_record(f, SAVE_END, "", b"")
+    os.replace(fname + ".tmp", fname)  # only replace the old save once the new one is complete
+
+
+def save_game_pickle(game, fname):
+    log.info("Saving game to %s" % fname)
+    write_save_game(snapshot_game(game), fname, game._save_cache)
+
+
+class SaveWriter(object):
+    """ Write save games and screenshots on a worker thread
+
+        The main thread takes the snapshot (see snapshot_game) or grabs the
+        screen, and the worker compresses, encodes and writes the files, one
+        job at a time in the order they were submitted. The game loop picks
+        up finished jobs in Game.update and queues their callbacks as events.
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._futures = []
+        self._finished = queue.Queue()  # (callback, fname) of jobs the worker has finished
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        return self._executor
+
+    def _run(self, fn, args, callback, fname):
+        try:
+            fn(*args)
+        except Exception as e:
+            log.error("Unable to write %s in the background: %s" % (fname, e))
+            callback = None
+        self._finished.put((callback, fname))
+
+    def submit(self, fn, *args, callback=None, fname=None):
+        """ Call fn(*args) on the worker, then queue callback(game, fname) as an event """
+        self._futures.append(self._get_executor().submit(self._run, fn, args, callback, fname))
+
+    @property
+    def pending(self):
+        return len(self._futures)
+
+    def finished(self, game):
+        """ Queue the callbacks of the jobs the worker has finished, called from the game loop """
+        self._futures = [future for future in self._futures if not future.done()]
+        while not self._finished.empty():
+            callback, fname = self._finished.get()
+            if callback:
+                game.queue_event(callback, game, fname)
+
+    def wait(self):
+        """ Block until every job so far has been written """
+        concurrent.futures.wait(self._futures)
 
-#    log.warning("POST PICKLE inventory %s"%game.inventory.name)
 
 def load_menu_assets(game):
     for menu_item in game._menu:
@@ -8743,7 +10872,9 @@ def load_menu_assets(game):
 
 def load_game_meta_pickle(game, fname):
     with open(fname, "rb") as f:
-        meta = pickle.load(f)
+        meta = read_save_header(f)
+        if meta is None:  # older save
+            meta = pickle.load(f)
     return meta
 
 
@@ -8759,18 +10890,23 @@ def load_game_pickle(game, fname, meta_only=False, keep=[], responsive=False):
             print(i, "not in game")
 
     with open(fname, "rb") as f:
-        meta = pickle.load(f)
+        meta = read_save_header(f)
+        if meta is None:  # older save
+            meta = pickle.load(f)
+            values = read_legacy_save_values(game, f)
+        else:
+            values = read_save_values(game, f)
         if meta_only is False:
-            player_info = pickle.load(f)
-            engine_info = pickle.load(f)
+            player_info = next(values)
+            engine_info = next(values)
             game.set_engine(engine_info)
-            game.storage = pickle.load(f)
+            game.storage = next(values)
             game.storage._last_load_time = datetime.now()
             if game.mixer:  # stop all music and ambient noise before rebuilding mixer
                 game.mixer.on_music_stop()
                 game.mixer.on_ambient_stop()
 
-            game.mixer = pickle.load(f)
+            game.mixer = next(values)
             game.mixer._sfx_mixers = getattr(game.mixer, "_sfx_mixers", [])
 
             # restore mixer
@@ -8778,25 +10914,30 @@ def load_game_pickle(game, fname, meta_only=False, keep=[], responsive=False):
             game.mixer.initialise_players(game)
             game.mixer.resume()
 
-            _pyglet_fonts = pickle.load(f)
+            _pyglet_fonts = next(values)
 
-            game._menu = pickle.load(f)
-            game._menus = pickle.load(f)
-            game._modals = pickle.load(f)
-            game.visited = pickle.load(f)
-            game._selected_options = pickle.load(f)
-            game._modules = pickle.load(f)
-            paths = pickle.load(f)
+            game._menu = next(values)
+            game._menus = next(values)
+            game._modals = next(values)
+            game.visited = next(values)
+            game._selected_options = next(values)
+            game._modules = next(values)
+            game._function_cache.clear()
+            paths = next(values)
             paths = [get_relative_path(x) for x in paths]
             game._sys_paths = paths
             for path in paths:
                 if path not in sys.path:
                     sys.path.append(get_safe_path(path))
-            game._resident = pickle.load(f)
-            game._actors = pickle.load(f)
-            new_items = pickle.load(f)
+            game._resident = next(values)
+            game._actors = next(values)
+            new_items = next(values)
             game._items = new_items
-            game._scenes = pickle.load(f)
+            game._scenes = next(values)
+            game._invalidate_update_list()
+            game._scene_graph.invalidate()
+            game._hit_index.clear()  # unpickling doesn't report moves, so rebuild from the loaded objects
+            game._solid_index.clear()
             for obj in keep_scene_objects:
                 game.add(obj, replace=True)
                 scene = get_object(game, obj._scene)
@@ -8884,6 +11025,7 @@ def save_game(game, fname):
 
 
 def load_game(game, fname, meta_only=False, keep=[]):
+    game._save_writer.wait()  # finish writing any autosaves first
     meta = load_game_meta_pickle(game, fname)
     if meta_only:
         return meta
@@ -8900,6 +11042,8 @@ def load_game_responsive(game, fname, meta_only=False, keep=[], callback=None, p
     """
     if meta_only:
         raise Exception("responsive doesn't handle meta_only)")
+    game._save_writer.wait()  # finish writing any autosaves first
+    game._progress_bar_index = game._progress_bar_count = 0  # counted up as the scenes load
     game._generator = load_game_pickle(game, fname, meta_only=meta_only, keep=keep, responsive=True)
     game._generator_progress = progress
     game._generator_callback = callback
@@ -8915,7 +11059,7 @@ def save_settings(game, fname):
 def load_or_create_settings(game, fname, settings_cls=Settings):
     """ load the game settings (eg volume, accessibilty options) """
     existing = True
-    options = game.parser.parse_args()
+    options = game.options
     if options.nuke and os.path.isfile(get_safe_path(fname)):  # nuke
         os.remove(fname)
     game.settings = settings_cls()  # setup default settings
@@ -8980,6 +11124,59 @@ def reset_mouse_cursor(game):
     game.mouse_cursor = MOUSE_POINTER if game.mouse_mode != MOUSE_LOOK else game.mouse_cursor  # reset mouse pointer
 
 
+class WalkthroughRecorder(object):
+    """ Measure each walkthrough step for --report: its wall time and, if benchmarking, the events
+        it ran, _handle_events calls, get_object and get_function calls and the memory it allocated
+        (traced with tracemalloc, which slows the game down) """
+
+    def __init__(self, benchmark=False):
+        self.benchmark = benchmark
+        self.steps = []
+        self._step = None  # the step being measured
+        self._start = None  # the counters when it started
+        if benchmark and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _counters(self, game):
+        counters = {"seconds": time.perf_counter()}
+        if self.benchmark:
+            counters.update({"events": game._events_done, "handle_events": game._handle_events_calls,
+                             "get_object": game._name_index.lookups, "get_function": game._function_cache.calls,
+                             "memory": tracemalloc.get_traced_memory()[0]})
+        return counters
+
+    def start(self, game, index, function_name, name):
+        """ Step index of the walkthrough is starting """
+        self.finish(game)
+        self._step = {"index": index, "function": function_name, "name": name}
+        if self.benchmark and hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        self._start = self._counters(game)
+
+    def finish(self, game):
+        """ The current step, if any, is over """
+        if not self._step:
+            return
+        for key, value in self._counters(game).items():
+            self._step[key] = value - self._start[key]
+        if self.benchmark:  # highest memory use during the step, above where it started
+            self._step["memory_peak"] = tracemalloc.get_traced_memory()[1] - self._start["memory"]
+        self.steps.append(self._step)
+        self._step = None
+
+    def write(self, game, fname, error=None):
+        self.finish(game)
+        totals = {}
+        for step in self.steps:
+            for key, value in step.items():
+                if key not in ["index", "function", "name", "memory_peak"]:
+                    totals[key] = totals.get(key, 0) + value
+        with open(fname, "w") as f:
+            f.write(json.dumps({"segment": game._walkthrough_segment, "benchmark": self.benchmark,
+                                "steps": self.steps, "seconds": totals.get("seconds", 0), "totals": totals,
+                                "error": error}))
+
+
 LOCK_UPDATES_TO_DRAWS = False  # deprecated
 
 
@@ -8994,6 +11191,7 @@ class Game(metaclass=use_on_events):
         self.setup_saves()
         self.parser = ArgumentParser()
         self.add_arguments()
+        self._options = None  # parsed on first use, see Game.options
 
         self.name = name
         self.section_name = name  # for save files, what is this segment/section/part of the game called
@@ -9007,6 +11205,7 @@ class Game(metaclass=use_on_events):
         self._generator = None  # are we calling a generator while inside the run loop, block inputs
         self._generator_callback = None
         self._generator_progress = None
+        self._generator_budget = GENERATOR_BUDGET  # seconds per frame to spend on the generator
 
         # this session's graphical settings
         self.fullscreen = fullscreen
@@ -9054,6 +11253,16 @@ class Game(metaclass=use_on_events):
 
         self._actors = {}
         self._items = {}
+        self._name_index = NameIndex()  # display text lookups for get_object
+        self._metadata = MetadataBundle(get_safe_path(METADATA_BUNDLE))  # what smart loading would read from data/
+        self._best_files = BestFileCache()  # which variant (mod, locale, low memory, ...) of a file to use
+        self._save_cache = SaveCache()  # last saved record of each object, reused by the next save if unchanged
+        self._save_writer = SaveWriter()  # writes autosaves and screenshots in the background
+        self._resource_cache = ResourceCache()  # unloads off screen objects to stay within a memory budget
+        self._asset_loader = AssetLoader()  # decodes scene spritesheets in the background
+        self._prefetcher = ScenePrefetcher()  # warms the scenes next to the current one
+        self._scene_graph = SceneGraph()  # portal links between scenes, for walkthrough gotos and prefetching
+        self._visibility_graphs = {}  # (scene name, ignore walkarea): VisibilityGraph for pathfinding
         self._modals = []  # list of object names
         self._menu = []
         self._menus = []  # a stack of menus
@@ -9073,6 +11282,11 @@ class Game(metaclass=use_on_events):
         #        self._window.on_joybutton_release = self.on_joybutton_release
         self.last_mouse_release = None  # track for double clicks
         self._pyglet_batches = []
+        # draw backgrounds, scene objects, foregrounds and menu using as few draw calls as possible
+        self._renderers = {"background": RenderPipeline(), "objects": RenderPipeline(),
+                           "foreground": RenderPipeline(), "menu": RenderPipeline()}
+        self._hit_index = HitIndex()  # clickable areas for the mouse handlers
+        self._solid_index = SolidIndex()  # solid areas for WalkAreaManager.valid
         self._gui_batch = pyglet.graphics.Batch()
 
         # event handling
@@ -9086,9 +11300,10 @@ class Game(metaclass=use_on_events):
         self._skip_callback = None
         self._skipping = False
 
-        self._events = []
+        self._events = EventQueue()
         self._event = None
-        self._event_index = 0
+        self._update_list = None  # cached objects to update each tick, see _get_update_list
+        self._update_signature = None
         self._drag = None  # is mouse dragging an object
         # how many events has the player triggered in this game (useful for
         # some game logic)
@@ -9115,6 +11330,7 @@ class Game(metaclass=use_on_events):
         self._edit_index = 0
         self._selector = False  # is the editor in selector mode?
         self._modules = {}
+        self._function_cache = FunctionCache()  # get_function lookups in the script modules
         self._sys_paths = []  # file paths to dynamically loaded modules
         self._walkthrough = []
         self._walkthrough_hints = {}  # (event, hint) auto-compiled from "help" attr on walkthrough
@@ -9123,6 +11339,12 @@ class Game(metaclass=use_on_events):
         # if auto-creating a savefile for this walkthrough
         self._walkthrough_target_name = None
         self._walkthrough_start_name = None  # fast load from a save file
+        self._walkthrough_segment = None  # (from savepoint, to savepoint) when run by tools/walkthrough_runner
+        self._walkthrough_report = None  # write per step timings to this file when the walkthrough finishes
+        self._walkthrough_recorder = None  # measures each walkthrough step for the report
+        self._handle_events_calls = 0  # counted for walkthrough benchmarks
+        self._events_done = 0
+        self._save_savepoints = False  # save the game at each savepoint the walkthrough reaches
         self._walkthrough_interactables = [] # all items and actors interacted on by the end of this walkthrough
         self._walkthrough_inventorables = [] # all items that were in the inventory at some point during the game
         self._test_inventory = False
@@ -9235,6 +11457,8 @@ class Game(metaclass=use_on_events):
 
         if "lowmemory" in CONFIG and CONFIG["lowmemory"]:  # use override from game.conf
             self.low_memory = CONFIG["lowmemory"]
+        if "resourcebudget" in CONFIG and CONFIG["resourcebudget"]:  # MB, override from game.conf
+            self._resource_cache.budget = int(CONFIG["resourcebudget"])
 
         fullscreen = self.settings.fullscreen if self.settings and self.settings.fullscreen else DEFAULT_FULLSCREEN
         self.autoscale = self.settings.autoscale if self.settings else DEFAULT_AUTOSCALE
@@ -9242,7 +11466,7 @@ class Game(metaclass=use_on_events):
         if "fullscreen" in CONFIG and CONFIG["fullscreen"]:  # use override from game.conf
             fullscreen = CONFIG["fullscreen"]
 
-        options = self.parser.parse_args()
+        options = self.options
 
         if options.output_version:
             print("%s, %s, %s" % (self.name, CONFIG["version"], CONFIG["date"]))
@@ -9344,6 +11568,11 @@ class Game(metaclass=use_on_events):
 
     player = property(get_player, set_player)
 
+    @property
+    def _event_index(self):
+        """ Number of started events still waiting on a busy owner """
+        return self._events.started
+
     def __getattr__(self, a):  # game.__getattr__
         # only called as a last resort, so possibly set up a queue function
         if a == "actors":
@@ -9632,7 +11861,7 @@ class Game(metaclass=use_on_events):
                 self._record_walkthrough = not self._record_walkthrough
             if symbol == pyglet.window.key.F12:
                 self._event = None
-                self._events = []
+                self._events.clear()
 
         # if we are allowing events to be skipped, check for that first.
         if self._skip_key and self._skip_key == symbol:
@@ -9771,11 +12000,12 @@ class Game(metaclass=use_on_events):
             return
         # check modals as first priority
         modal_collide = False
+        modal_hits = set(obj.name for obj in self._hit_index.hits(self, "modals", window_x, window_y))
         for name in self._modals:
             obj = get_object(self, name)
             allow_collide = True if (obj.allow_look or obj.allow_use) \
                 else False
-            if obj.collide(window_x, window_y) and allow_collide:  # absolute screen values
+            if obj.name in modal_hits and allow_collide:  # absolute screen values
                 self.mouse_cursor = MOUSE_CROSSHAIR
                 if obj._mouse_motion and not modal_collide:
                     fn = get_function(self, obj._mouse_motion, obj)
@@ -9790,6 +12020,7 @@ class Game(metaclass=use_on_events):
         if len(self._modals) == 0:
             # check menu as second priority.
             menu_collide = False
+            menu_hits = set(obj.name for obj in self._hit_index.hits(self, "menu", window_x, window_y))
             for obj_name in self._menu:
                 obj = get_object(self, obj_name)
                 if not obj:
@@ -9797,7 +12028,7 @@ class Game(metaclass=use_on_events):
                     return
                 allow_collide = True if (obj.allow_interact) \
                     else False
-                if obj.collide(window_x, window_y) and allow_collide:  # absolute screen values
+                if obj.name in menu_hits and allow_collide:  # absolute screen values
                     self.mouse_cursor = MOUSE_CROSSHAIR if self.mouse_cursor == MOUSE_POINTER else self.mouse_cursor
 
                     allow_over = obj._actions or hasattr(obj,
@@ -9829,9 +12060,8 @@ class Game(metaclass=use_on_events):
             if len(self._menu) > 0 and self._menu_modal:
                 return  # menu is in modal mode so block other objects
 
-            #            scene_objects = copy.copy(self.scene._objects)
-            scene_objects = self.scene.objects_sorted
-            #            scene_objects.reverse()
+            # only the scene objects under the mouse, highest z first
+            scene_objects = self._hit_index.hits(self, "scene", scene_x, scene_y)
             if (ALLOW_USE_ON_PLAYER and self.player) or \
                     (self._allow_one_player_interaction is True):  # add player object
                 if self.player in scene_objects:
@@ -10019,12 +12249,11 @@ class Game(metaclass=use_on_events):
             return
 
         # modals are absolute (they aren't displaced by camera)
-        for name in self._modals:
-            obj = get_object(self, name)
+        for obj in self._hit_index.hits(self, "modals", window_x, window_y):
             allow_collide = True if (obj.allow_look or obj.allow_use) \
                 else False
             #            print(obj.name, allow_collide, obj.collide(window_x, window_y), window_x, window_y, obj.interact)
-            if allow_collide and obj.collide(window_x, window_y):
+            if allow_collide:
                 user_trigger_interact(self, obj)
                 return
         # don't process other objects while there are modals
@@ -10040,11 +12269,10 @@ class Game(metaclass=use_on_events):
             return
 
         # try menu events
-        for obj_name in self._menu:
-            obj = get_object(self, obj_name)
+        for obj in self._hit_index.hits(self, "menu", window_x, window_y):
             # (obj.allow_look or obj.allow_use)
             allow_collide = True if obj.allow_interact else False
-            if allow_collide and obj.collide(window_x, window_y):
+            if allow_collide:
                 user_trigger_interact(self, obj)
                 return
 
@@ -10074,22 +12302,22 @@ class Game(metaclass=use_on_events):
             else:
                 return
         if self.scene:
-            #            scene_objects = copy.copy(self.scene._objects)
-            scene_objects = self.scene.objects_sorted
-            #            scene_objects.reverse()
+            # only the scene objects under the mouse, highest z first
+            scene_objects = self._hit_index.hits(self, "scene", scene_x, scene_y)
+            allow_one_player_interaction = self._allow_one_player_interaction
+            if len(self.scene._objects) > 0:  # switch off special player interact
+                self._allow_one_player_interaction = False
             if (ALLOW_USE_ON_PLAYER and self.player) or \
-                    (self._allow_one_player_interaction == True):  # add player object
+                    (allow_one_player_interaction == True):  # add player object
                 if self.player in scene_objects:
                     scene_objects.insert(0, self.player.name)  # prioritise player over other items
             for obj_name in scene_objects:
                 obj = get_object(self, obj_name)
                 if self.mouse_mode == MOUSE_USE and self._mouse_object == obj: continue  # can't use item on self
                 allow_player_use = (self.player and self.player == obj) and (
-                            ALLOW_USE_ON_PLAYER or self._allow_one_player_interaction)
+                            ALLOW_USE_ON_PLAYER or allow_one_player_interaction)
                 allow_use = (obj.allow_draw and (
                             obj.allow_interact or obj.allow_use or obj.allow_look)) or allow_player_use
-                if self._allow_one_player_interaction:  # switch off special player interact
-                    self._allow_one_player_interaction = False
                 if obj.collide(scene_x, scene_y) and allow_use:
                     # if wanting to interact or use an object go to it. If engine
                     # says to go to object for look, do that too.
@@ -10208,6 +12436,13 @@ class Game(metaclass=use_on_events):
         self.reset_window(self.fullscreen)
         pyglet.window.Window.on_resize(self._window, width, height)
 
+    @property
+    def options(self):
+        """ The command line options, parsed the first time they are needed (see get_runtime_options) """
+        if self._options is None:
+            self._options = get_runtime_options(self.parser)
+        return self._options
+
     def add_arguments(self):
         """ Add allowable commandline arguments """
         self.parser.add_argument(
@@ -10258,6 +12493,18 @@ class Game(metaclass=use_on_events):
 
         self.parser.add_argument(
             "-s", "--step", dest="target_step", nargs='+', help="Jump to step in walkthrough")
+        self.parser.add_argument("-S", "--savepoints", action="store_true", dest="save_savepoints",
+                                 help="Save the game at each savepoint reached in the walkthrough", default=False)
+        self.parser.add_argument("--segment", dest="walkthrough_segment", nargs=2, metavar=("FROM", "TO"),
+                                 help="Run the walkthrough headless from savepoint FROM (- for the start) to savepoint "
+                                      "TO (- for the end) then exit, see tools/walkthrough_runner")
+        self.parser.add_argument("--report", dest="walkthrough_report",
+                                 help="Write the time taken by each walkthrough step to this file as JSON")
+        self.parser.add_argument("--benchmark", action="store_true", dest="benchmark",
+                                 help="Add event, get_object and get_function counts and memory use to each step in "
+                                      "the --report (default walkthrough_benchmark.json), see tools/benchmark_compare")
+        self.parser.add_argument("--list-savepoints", action="store_true", dest="list_savepoints",
+                                 help="Print the walkthrough's savepoints and the save directory as JSON then exit")
         self.parser.add_argument("-t", "--text", action="store_true", dest="text",
                                  help="Play game in text mode (for players with disabilities who use text-to-speech output)",
                                  default=False)
@@ -10323,6 +12570,8 @@ class Game(metaclass=use_on_events):
         #            self._load_editor()
         self._selected_options = []
         self._visited = []
+        self._invalidate_update_list()
+        self._scene_graph.invalidate()
 
     #        self._resident = [] #scenes to keep in memory
 
@@ -10458,26 +12707,28 @@ class Game(metaclass=use_on_events):
         self._selected_options = []
         self._visited = []
         self._resident = []  # scenes to keep in memory
+        if refresh:
+            self._metadata.recheck()
+            self._best_files.clear()
+            self._hit_index.clear()
+            self._solid_index.clear()
 
         portals = []
-        # estimate size of all loads
-
-        for obj_cls in [Actor, Item, Emitter, Portal, Scene]:
-            dname = "directory_%ss" % obj_cls.__name__.lower()
-            safe_dir = get_safe_path(getattr(self, dname))
-            if not os.path.exists(safe_dir):
-                continue  # skip directory if non-existent
-            for name in os.listdir(safe_dir):
-                if draw_progress_bar:  # estimate the size of the loading
-                    self._progress_bar_count += 1
-
+        # list each directory once, the lengths are an estimate of the size of all loads
+        listings = []
         for obj_cls in [Actor, Item, Emitter, Portal, Scene]:
             dname = "directory_%ss" % obj_cls.__name__.lower()
             #            dname = get_smart_directory(self, obj)
-            safe_dir = get_safe_path(getattr(self, dname))
-            if not os.path.exists(safe_dir):
-                continue  # skip directory if non-existent
-            for name in os.listdir(safe_dir):
+            names = self._metadata.listdir(getattr(self, dname))  # [] if non-existent
+            listings.append((obj_cls, names))
+            if draw_progress_bar:  # estimate the size of the loading
+                self._progress_bar_count += len(names)
+        # read the object directories in parallel, the objects are still created one at a time in listing order
+        self._metadata.scan([os.path.join(getattr(self, "directory_%ss" % obj_cls.__name__.lower()), name)
+                             for obj_cls, names in listings for name in names if not only or name in only])
+
+        for obj_cls, names in listings:
+            for name in names:
                 if only and name not in only:
                     continue  # only load specific objects
                 #                if draw_progress_bar:
@@ -10555,12 +12806,15 @@ class Game(metaclass=use_on_events):
             if ntime > self._modules[i]:
                 self._modules[i] = ntime
                 modified = True
+        if modified:
+            self._function_cache.clear()
         return modified
 
     def set_modules(self, modules):
         """ when editor reloads modules, which modules are game related? """
         for i in modules:
             self._modules[i] = 0
+        self._function_cache.clear()
         # if editor is available, watch code for changes
         if CONFIG["editor"] or self._allow_editing: 
             self.check_modules()  # set initial timestamp record
@@ -10605,6 +12859,7 @@ class Game(metaclass=use_on_events):
                     except AttributeError:
     
                         print("ERROR: unable to reload", module, new_fn)
+        self._function_cache.clear()
 
         # XXX update .uses{} values too.
         for i in (list(self._actors.values()) + list(self._items.values())):
@@ -10632,7 +12887,7 @@ class Game(metaclass=use_on_events):
 
     def run(self, splash=None, callback=None, icon=None):
         # event_loop.run()
-        options = self.parser.parse_args()
+        options = self.options
         #        self.mixer._force_mute =  #XXX sound disabled for first draft
         self.mixer._session_mute = True if options.mute == True else False
         if self.settings and not self.settings.disable_joystick:
@@ -10659,6 +12914,9 @@ class Game(metaclass=use_on_events):
             self.profile_scripts = True
         if options.language_code:
             set_language(options.language_code if options.language_code != "default" else None)
+        if options.memory_save:
+            print("Low memory mode, keeping %iMB of images loaded" % self._resource_cache.low_memory_budget)
+            self.low_memory = True
         if options.target_step:
             print("AUTO WALKTHROUGH")
             self._walkthrough_auto = True  # auto advance
@@ -10691,6 +12949,17 @@ class Game(metaclass=use_on_events):
             self._allow_editing = True
         if options.exit_step:
             self.exit_step = True
+        if options.list_savepoints:
+            print("SAVEPOINTS %s" % json.dumps({"savepoints": [x[1] for x in self._walkthrough if x[0] == savepoint],
+                                                 "save_directory": get_safe_path(self.save_directory)}))
+            return
+        if options.save_savepoints:
+            self._save_savepoints = True
+        if options.walkthrough_report or options.benchmark:
+            self._walkthrough_report = options.walkthrough_report or "walkthrough_benchmark.json"
+            self._walkthrough_recorder = WalkthroughRecorder(benchmark=options.benchmark)
+        if options.walkthrough_segment:
+            self._start_walkthrough_segment(*options.walkthrough_segment)
         if options.headless:
             self.on_set_headless(True)
             self._walkthrough_auto = True  # auto advance
@@ -10734,13 +13003,14 @@ class Game(metaclass=use_on_events):
         return r
 
     def on_quit(self):
-        if self.settings and self.settings.filename:
+        if self.settings and self.settings.filename and not self._walkthrough_segment:  # segments run in parallel
             print("SAVE SETTINGS")
             td = datetime.now() - self.settings._current_session_start
             s = milliseconds(td)
             self.settings.total_time_played += s
             self.settings._last_session_end = datetime.now()
             save_settings(self, self.settings.filename)
+        self._save_writer.wait()  # don't leave an autosave half written
         print("EXIT APP")
         if self.steam_api:
             print("SHUTDOWN STEAM API")
@@ -10775,6 +13045,43 @@ class Game(metaclass=use_on_events):
                 else:
                     print("Can't find all objects %s (%s) and/or %s (%s)" % (obj_name, obj, subject_name, subject))
 
+    def _savepoint_index(self, name):
+        for i, x in enumerate(self._walkthrough):
+            if x[0] == savepoint and x[1] == name:
+                return i
+        return None
+
+    def _start_walkthrough_segment(self, start, end):
+        """ Run the walkthrough headless from savepoint start's save game to savepoint end ("-" for either end) """
+        for name in [start, end]:
+            if name != "-" and self._savepoint_index(name) is None:
+                raise ValueError("No savepoint %s in the walkthrough" % name)
+        self._walkthrough_segment = (start, end)
+        self.on_set_headless(True)
+        self._walkthrough_auto = True
+        self.exit_step = True
+        self._walkthrough_target = len(self._walkthrough)
+        if end != "-":
+            self._walkthrough_target = self._savepoint_index(end) + 1
+            self._walkthrough_target_name = end  # save there for the next segment
+        if start != "-":
+            load_game(self, get_safe_path(os.path.join(self.save_directory, "%s.save" % start)))
+            self._walkthrough_index = self._savepoint_index(start) + 1
+
+    def _write_walkthrough_report(self, error=None):
+        if self._walkthrough_recorder:
+            self._walkthrough_recorder.write(self, self._walkthrough_report, error)
+
+    def _walkthrough_failed(self, error):
+        """ The walkthrough can't continue """
+        log.error(error)
+        self._walkthrough_target = 0
+        self._walkthrough_auto = False
+        self.headless = False
+        if self._walkthrough_segment:  # nobody is watching, so report it and stop
+            self._write_walkthrough_report(error)
+            self.on_quit()
+
     def _process_walkthrough(self):
         """ Do a step in the walkthrough """
         if len(self._walkthrough) == 0 or self._walkthrough_index >= len(
@@ -10801,6 +13108,15 @@ class Game(metaclass=use_on_events):
         self._walkthrough_index += 1
 
         if self._walkthrough_index > self._walkthrough_target or self._walkthrough_index > len(self._walkthrough):
+            if self._walkthrough_segment:  # run by tools/walkthrough_runner, so skip reloading assets and exit
+                log.info("FINISHED WALKTHROUGH SEGMENT %s to %s" % self._walkthrough_segment)
+                if self._walkthrough_target_name:
+                    save_game(self, get_safe_path(
+                        os.path.join(self.save_directory, "%s.save" % self._walkthrough_target_name)))
+                self._write_walkthrough_report()
+                self.on_quit()
+                return
+            self._write_walkthrough_report()
             if self._headless:
                 if self._test_inventory:
                     print("Test inventory. Walkthrough report:")
@@ -10869,6 +13185,25 @@ class Game(metaclass=use_on_events):
                         expensive[k] += v
                     for i in sorted(expensive.items(), key=itemgetter(1), reverse=True)[:profile_number]:
                         print(i)
+                    print("\nget_function cache: %i hits, %i misses" % (
+                        self._function_cache.hits, self._function_cache.misses))
+                    print("get_best_file cache: %i hits, %i misses" % (self._best_files.hits, self._best_files.misses))
+                    print("resource cache: %(hits)i hits, %(misses)i misses, %(evictions)i evictions, "
+                          "%(bytes)i bytes in %(objects)i objects and %(pages)i atlas pages" % self._resource_cache.stats)
+                    print("save cache: %(pickled)i objects pickled, %(reused)i reused, "
+                          "%(records)i records" % self._save_cache.stats)
+                    print("asset loader: %(queued)i spritesheets decoded in the background, %(taken)i used, "
+                          "%(pending)i pending" % self._asset_loader.stats)
+                    print("scene prefetch: %(hits)i hits, %(misses)i misses, "
+                          "%(bytes)i bytes held for %(scenes)i scenes" % self._prefetcher.stats)
+                    print("metadata bundle: %(hits)i hits, %(misses)i misses, %(directories)i directories and "
+                          "%(files)i files bundled, %(scanned)i directories scanned" % self._metadata.stats)
+                    print("solid index: %i walkarea points tested" % self._solid_index.queries)
+                    print("label pool: %(hits)i labels reused as laid out, %(relayouts)i laid out again, "
+                          "%(created)i created, %(free)i free, %(sizes)i text sizes cached" % _label_pool.stats)
+                    print("\nNames get_object couldn't find (%i misses):" % self._name_index.misses)
+                    for i in sorted(self._name_index.missed.items(), key=itemgetter(1), reverse=True)[:profile_number]:
+                        print(i)
                 if self.exit_step is True:
                     self.on_quit()
 
@@ -10903,9 +13238,7 @@ class Game(metaclass=use_on_events):
         else:
             self._trunk_step = True
 
-        options = self.parser.parse_args()
-
-        if options.imagereactor == True and "screenshot" in extras:
+        if self.options.imagereactor == True and "screenshot" in extras:
             """ save a screenshot as requested by walkthrough """
             if self._headless is True:
                 print("WARNING, ART REACTOR CAN'T RUN IN HEADLESS MODE")
@@ -10913,8 +13246,12 @@ class Game(metaclass=use_on_events):
             if not os.path.isdir(d):
                 os.mkdir(d)
             self.camera.on_screenshot(os.path.join(d, "image%0.5i.png" % self._walkthrough_index))
+        if self._walkthrough_recorder:
+            self._walkthrough_recorder.start(self, self._walkthrough_index - 1, function_name, walkthrough[1])
         if function_name == "savepoint":
             human_readable_name = walkthrough[1]
+            if self._save_savepoints:
+                save_game(self, get_safe_path(os.path.join(self.save_directory, "%s.save" % human_readable_name)))
         elif function_name == "interact":
             button = pyglet.window.mouse.LEFT
             modifiers = 0
@@ -10938,10 +13275,7 @@ class Game(metaclass=use_on_events):
                         obj = o
             obj = get_object(self, actor_name) if not obj else obj
             if not obj:
-                log.error("Unable to find %s in game" % actor_name)
-                self._walkthrough_target = 0
-                self._walkthrough_auto = False
-                self.headless = False
+                self._walkthrough_failed("Unable to find %s in game" % actor_name)
                 return
             # if not in same scene as camera, and not in modals or menu, log
             # the error
@@ -11057,6 +13391,7 @@ class Game(metaclass=use_on_events):
         """ Handle game events """
         safe_to_call_again = False  # is it safe to call _handle_events immediately after this?
         waiting_for_user = True
+        self._handle_events_calls += 1
         #        log.info("There are %s events, game._waiting is %s, index is %s and current event is %s",len(self._events), self._waiting, self._event_index, self._event)
         if self.resizable and self._window.on_resize != self.on_resize:  # now allow our override
             print("enable resizeable")
@@ -11067,16 +13402,7 @@ class Game(metaclass=use_on_events):
 
         if self._waiting:
             """ check all the Objects with existing events, if any of them are busy, don't process the next event """
-            none_busy = True
-            # event_index is point to the game.wait event at the moment
-            for event in self._events[:self._event_index]:
-                # first arg is always the object that called the event
-                obj = event[1][0]
-                # this object is busy so don't remove its event and don't let
-                # game stop waiting if it's waiting
-                if obj.busy > 0:
-                    none_busy = False
-            if none_busy == True:
+            if not self._events.any_busy():
                 if logging:
                     log.info(
                         "Game has no busy events, so setting game.waiting to False.")
@@ -11089,31 +13415,30 @@ class Game(metaclass=use_on_events):
         del_events = 0
         # if there are events and we are not at the end of them
         if len(self._events) > 0:
-            if self._event_index > 0:
-                # check the previous events' objects, delete if not busy
-                for event in self._events[:self._event_index]:
-                    if event[1][0].busy == 0:
-                        if hasattr(self, "del_events"):
-                            print("DEL", event)
-
-                        del_events += 1
-                        self._events.remove(event)
-                        self._event_index -= 1
-
-            if self._event_index < len(self._events):
+            # retire the started events whose objects are no longer busy
+            del_events = self._events.retire()
+
+            e = self._events.peek()
+            if e:
                 # possibly start the current event
                 # stored as [(function, args))]
-                e = self._events[self._event_index]
                 obj = e[1][0]
                 if obj.busy > 0:
                     # don't do this event yet if the owner is busy
                     return safe_to_call_again
+                self._events.start()
                 self._event = e
                 #                print("Start",e[0], e[1][0].name, datetime.now(), e[1][0].busy)
                 done_events += 1
+                self._events_done += 1
                 #                print("DOING",e)
                 #                print("doing event",e)
                 # call the function with the args and kwargs
+                for arg in e[1]:  # the event may change its owner and any game objects it is passed
+                    if isinstance(arg, (Actor, Scene)):
+                        self._save_cache.mark(arg.name)
+                    elif isinstance(arg, WalkAreaManager) and arg._scene:  # saved as part of its scene
+                        self._save_cache.mark(arg._scene)
                 profiling_start = datetime.now()
                 try:
                     e[0](*e[1], **e[2])
@@ -11125,9 +13450,6 @@ class Game(metaclass=use_on_events):
                 if self.profile_scripts:
                     self._profiled_scripts.append({e[0].__name__:datetime.now()-profiling_start})
 
-                #                if self._event_index < len(self._events) - 1:
-                self._event_index += 1  # potentially start next event
-                #                print("SETTING EVENT_INDEX", self._event_index, len(self._events))
                 # if, after running the event, the obj is not busy, then it's
                 # OK to do the next event immediately.
                 if obj.busy == 0:
@@ -11159,6 +13481,43 @@ class Game(metaclass=use_on_events):
 
     #        print("Done %s, deleted %s"%(done_events, del_events))
 
+    def _invalidate_update_list(self):
+        """ Force _get_update_list to rebuild on the next tick """
+        self._update_list = None
+
+    def _get_update_list(self):
+        """ The objects to update each tick: layers, scene objects, menu, modals, camera, mixer, event owners
+            and the edit menu, each once and in that order. Only rebuilt when one of those changes.
+            Changes are spotted by the identity and length of each list, so swapping a name in place
+            (eg scene._objects[0] = "other") isn't noticed; call _invalidate_update_list after doing that.
+        """
+        scene = self.scene
+        signature = (scene, id(scene._layer) if scene else None, len(scene._layer) if scene else 0,
+                     id(scene._objects) if scene else None, len(scene._objects) if scene else 0,
+                     id(self._menu), len(self._menu), id(self._modals), len(self._modals),
+                     len(self._edit_menu), self._events.version)
+        if self._update_list is not None and signature == self._update_signature:
+            return self._update_list
+
+        # (objects, complain if one is missing)
+        items_list = [(scene._layer if scene else [], True), (scene._objects if scene else [], False),
+                      (self._menu, True), (self._modals, False), ([self.camera], True), ([self.mixer], True),
+                      (self._events.owners(), True), (self._edit_menu, True)]
+        items_to_update = OrderedDict()  # id(obj): obj, keeps the first position of each object
+        for items, complain in items_list:
+            for item in items:
+                if isinstance(item, str):  # try to find object
+                    item = get_object(self, item)
+                if item is None:
+                    if complain:
+                        log.error("Some item(s) in scene %s are None, which is odd." % self.name)
+                    continue
+                if id(item) not in items_to_update:
+                    items_to_update[id(item)] = item
+        self._update_list = list(items_to_update.values())
+        self._update_signature = signature
+        return self._update_list
+
     def update(self, dt, single_event=False):  # game.update
         """ Run update on scene objects """
         #        print("GAME UPDATE")
@@ -11176,15 +13535,20 @@ class Game(metaclass=use_on_events):
                 editor_queue.join()
                 print("editor finished with game object")
 
-        scene_objects = []
         fn = get_function(self, "game_update")  # special update function game can use
         if fn:
             fn(self, dt, single_event)
 
+        if self._save_writer.pending:
+            self._save_writer.finished(self)  # queue the callbacks of finished autosaves
+
         if self._generator:
+            deadline = time.perf_counter() + self._generator_budget
             try:
                 for i in range(1, 10):
                     next(self._generator)
+                    if time.perf_counter() > deadline:
+                        break  # carry on next frame
             except StopIteration:
                 self._generator = None
                 self._generator_progress = None
@@ -11211,34 +13575,10 @@ class Game(metaclass=use_on_events):
 
         #        dt = self.fps #time passed (in milliseconds)
         if self.scene:
-            for obj_name in self.scene._objects:
-                obj = get_object(self, obj_name)
-                if obj:
-                    scene_objects.append(obj)
             self.scene._update(dt)
 
-        modal_objects = []
-        if self._modals:
-            for obj_name in self._modals:
-                obj = get_object(self, obj_name)
-                if obj:
-                    modal_objects.append(obj)
-
-        layer_objects = self.scene._layer if self.scene else []
         # update all the objects in the scene or the event queue.
-        items_list = [layer_objects, scene_objects, self._menu, modal_objects,
-                      [self.camera], [self.mixer], [obj[1][0] for obj in self._events], self._edit_menu]
-        items_to_update = []
-        for items in items_list:
-            for item in items:  # _to_update:
-                if isinstance(item, str):  # try to find object
-                    item = get_object(self, item)
-                if item not in items_to_update:
-                    items_to_update.append(item)
-        for item in items_to_update:
-            if item == None:
-                log.error("Some item(s) in scene %s are None, which is odd." % self.name)
-                continue
+        for item in self._get_update_list():
             item.game = self
             """
             if item._update:
@@ -11331,13 +13671,15 @@ class Game(metaclass=use_on_events):
         pyglet.gl.glColor4f(1.0, 1.0, 1.0, 1.0)
         # draw scene backgroundsgrounds (layers with z equal or less than 1.0)
         background_obj = None
+        backgrounds = []
         for item in self.scene._layer:
             background_obj = get_object(self, item)
             background_obj.game = self
             if background_obj.z <= 1.0:
-                background_obj.pyglet_draw(absolute=False)
+                backgrounds.append(background_obj)
             else:
                 break
+        self._renderers["background"].draw(backgrounds, absolute=False)
 
         if self.scene and self.settings and self.settings.high_contrast:
             # get the composited background
@@ -11379,25 +13721,20 @@ class Game(metaclass=use_on_events):
                     scene_objects.append(obj)
         # - x._parent.y if x._parent else 0
         try:
-            objects = sorted(scene_objects, key=lambda x: x.rank, reverse=False)
-            objects = sorted(objects, key=lambda x: x.z, reverse=False)
+            objects = self._renderers["objects"].sort(scene_objects)
         except AttributeError:
             import pdb;
             pdb.set_trace()
-        portals = []
-        for item in objects:
-            item.pyglet_draw(absolute=False)
-            if isinstance(item, Portal):
-                portals.append(item)
-
-        #        for batch in self._pyglet_batches: #if Actor._batch is set, it will be drawn here.
-        #            batch.draw()
+        self._renderers["objects"].draw(objects, absolute=False)
+        portals = [item for item in objects if isinstance(item, Portal)]
 
         # draw scene foregrounds (layers with z greater than 1.0)    
+        foregrounds = []
         for item in self.scene._layer:
             obj = get_object(self, item)
             if obj.z > 1.0:
-                obj.pyglet_draw(absolute=False)
+                foregrounds.append(obj)
+        self._renderers["foreground"].draw(foregrounds, absolute=False)
 
         if self.settings and self.settings.show_portals:
             for item in portals:
@@ -11412,10 +13749,12 @@ class Game(metaclass=use_on_events):
         if popMatrix is True:
             glPopMatrix()  # finish the scene draw
 
+        menu = []
         for item_name in self._menu:
             item = get_object(self, item_name)
             item.game = self
-            item.pyglet_draw(absolute=True)
+            menu.append(item)
+        self._renderers["menu"].draw(menu, absolute=True)
 
         for name in self._modals:
             modal = get_object(self, name)
@@ -11517,14 +13856,19 @@ class Game(metaclass=use_on_events):
         """ Removes objects from the game's storage (it may still exist in other lists, etc) """
         objects_iterable = [objects] if not isinstance(
             objects, Iterable) else objects
+        self._invalidate_update_list()
+        self._scene_graph.invalidate()
         for obj in objects_iterable:
             name = obj if type(obj) == str else obj.name
             if name in self._actors.keys():
-                self._actors.pop(name)
+                obj = self._actors.pop(name)
             elif name in self._items.keys():
-                self._items.pop(name)
+                obj = self._items.pop(name)
             elif name in self._scenes.keys():
-                self._scenes.pop(name)
+                obj = self._scenes.pop(name)
+            else:
+                continue
+            self._name_index.remove(self, obj)
 
     def remove(self, objects):  # game.remove (not an event driven function)
         return self._remove(objects)
@@ -11532,6 +13876,8 @@ class Game(metaclass=use_on_events):
     def _add(self, objects, replace=False):  # game.add
         objects_iterable = [objects] if not isinstance(
             objects, Iterable) else objects
+        self._invalidate_update_list()
+        self._scene_graph.invalidate()
 
         for obj in objects_iterable:
             # check if it is an existing object
@@ -11546,6 +13892,7 @@ class Game(metaclass=use_on_events):
             except:
                 import pdb
                 pdb.set_trace()
+            self._save_cache.mark(obj.name)
             if isinstance(obj, Scene):
                 self._scenes[obj.name] = obj
             #                if self.analyse_scene == obj.name:
@@ -11554,12 +13901,16 @@ class Game(metaclass=use_on_events):
             #                    obj._total_items = []
             elif isinstance(obj, MenuFactory):
                 self._menu_factories[obj.name] = obj
+                continue
             elif isinstance(obj, Portal):
                 self._items[obj.name] = obj
             elif isinstance(obj, Item):
                 self._items[obj.name] = obj
             elif isinstance(obj, Actor):
                 self._actors[obj.name] = obj
+            else:
+                continue
+            self._name_index.add(self, obj)
         return objects
 
     # game.add (not an event driven function)
@@ -11619,6 +13970,7 @@ class Game(metaclass=use_on_events):
         i = get_object(self, item)
         if i and i.name in self._modals:
             self._modals.remove(i.name)
+            self._invalidate_update_list()
 
     def on_menu_modal(self, modal=True):
         """ Set if the menu is currently in modal mode (ie non-menu events are blocked """
@@ -11866,17 +14218,26 @@ class Game(metaclass=use_on_events):
             self.on_set_headless(False)
             self._walkthrough_auto = False  # stop auto advance
 
-    def on_autosave(self, actor, tilesize, exclude_from_screenshot=[], fname=None, fast=True, action="portrait"):
+    def on_autosave(self, actor, tilesize, exclude_from_screenshot=[], fname=None, fast=True, action="portrait",
+                    callback=None):
+        """ Save the game and a screenshot. Only the snapshot of the game and the screen grab happen now,
+            the files are written on the save writer thread. callback(game, filename) is queued as an event
+            once the save is on disk. """
         game = self
         fname = fname if fname else datetime.now().strftime("%Y%m%d_%H%M%S")
-        save_game(game, get_safe_path(os.path.join(self.save_directory, "%s.save" % fname)))
+        save_fname = get_safe_path(os.path.join(self.save_directory, "%s.save" % fname))
+        log.info("Autosaving game to %s" % save_fname)
+        game._last_autosave = save_fname
+        self._save_writer.submit(write_save_game, snapshot_game(game), save_fname, game._save_cache,
+                                 callback=callback, fname=save_fname)
         for i in exclude_from_screenshot:
             obj = get_object(game, i)
             obj.hide()
         if not fast:  # take some time to do a nicer screen grab
             game.menu.on_hide()
             game.pause(0.4)
-        game.camera.screenshot(get_safe_path(os.path.join(self.save_directory, "%s.png" % fname)), tilesize)
+        game.camera.screenshot(get_safe_path(os.path.join(self.save_directory, "%s.png" % fname)), tilesize,
+                               background=True)
         for i in exclude_from_screenshot:
             obj = get_object(game, i)
             obj.show()
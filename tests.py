@@ -4,6 +4,7 @@ python3 -m unittest tests.SaveTest
 
 import unittest, pickle, sys, tempfile
 import gc, glob
+import importlib.machinery, importlib.util
 import resource
 
 from __init__ import *
@@ -469,6 +470,62 @@ class EventTest(unittest.TestCase):
         self.assertEqual([x[0].__name__ for x in self.game._events], []) #empty event queue
 
 
+class EventQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.game = Game("Unit Tests", fps=60, afps=16, resolution=RESOLUTION)
+        self.game.settings = Settings()
+        self.actor = Actor("_test_actor").smart(self.game)
+        self.scene = Scene("_test_scene")
+        self.game.add([self.scene, self.actor])
+
+    def test_retire_on_wake(self):
+        self.actor.relocate(self.scene)
+        self.actor.says("Hello World", ok=None)
+        events = self.game._events
+        events.start()
+        self.actor.busy += 1
+        self.assertEqual(events.retire(), 0) #actor is still busy
+        self.assertEqual(events.started, 1)
+        self.assertTrue(events.any_busy())
+        self.actor.busy -= 1 #wakes the queue
+        self.assertFalse(events.any_busy())
+        self.assertEqual(events.retire(), 1)
+        self.assertEqual([x[0].__name__ for x in events], ['on_says'])
+
+    def test_polled_owner(self):
+        self.scene.busy += 1
+        self.game._events.append((lambda obj: None, (self.scene,), {}))
+        self.game._events.start()
+        self.assertEqual(self.game._events.retire(), 0)
+        self.scene.busy -= 1 #scenes don't wake the queue, so they are polled
+        self.assertEqual(self.game._events.retire(), 1)
+        self.assertEqual(len(self.game._events), 0)
+
+
+class GetObjectTest(unittest.TestCase):
+    def setUp(self):
+        self.game = Game("Unit Tests", fps=60, afps=16, resolution=RESOLUTION)
+        self.game.settings = Settings()
+        self.actor = Actor("_test_actor", display_text="Test Actor")
+        self.scene = Scene("_test_scene")
+        self.game.add([self.scene, self.actor])
+
+    def test_display_text(self):
+        self.assertEqual(get_object(self.game, "Test Actor"), self.actor)
+        self.actor.display_text = "Renamed Actor"
+        self.assertEqual(get_object(self.game, "Renamed Actor"), self.actor)
+        self.assertEqual(get_object(self.game, "Test Actor"), None)
+
+    def test_case_insensitive(self):
+        self.assertEqual(get_object(self.game, "_TEST_SCENE", case_insensitive=True), self.scene)
+        self.assertEqual(get_object(self.game, "test actor", case_insensitive=True), self.actor)
+
+    def test_misses(self):
+        self.game.remove(self.actor)
+        self.assertEqual(get_object(self.game, "Test Actor"), None)
+        self.assertEqual(self.game._name_index.missed, {"Test Actor": 1})
+
+
 class EmitterTest(unittest.TestCase):
     def setUp(self):
         self.game = Game("Unit Tests", fps=60, afps=16, resolution=RESOLUTION)
@@ -539,6 +596,71 @@ class EmitterTest(unittest.TestCase):
 
 
 
+def _test_terminate(game, emitter, particle):  # same as terminate_by_frame, but not vectorised
+    return particle.index >= emitter.frames
+
+
+class ParticleArraysTest(unittest.TestCase):
+    def make_emitter(self, arrays, **kwargs):
+        em = {"speed": 10, "number": 3, "frames": 4, "fov": 0, "direction": 45, "acceleration": (1, 2),
+              "alpha_start": 1.0, "alpha_end": 0, "random_index": False, "random_age": False,
+              "random_motion_index": False, "behaviour": BEHAVIOUR_FIRE}
+        em.update(kwargs)
+        e = Emitter("_test_emitter", **em)
+        e._solid_area = Rect(0, 0, 0, 0)
+        if not arrays:
+            e._particles = []  # as if numpy isn't there
+        e._add_particles(e.number)
+        return e
+
+    def tick(self, e):
+        if type(e._particles) == list:
+            for p in list(e._particles):
+                e._update_particle(0, p)
+        else:
+            e._update_particles()
+
+    def state(self, e):
+        return [(round(p.x, 6), round(p.y, 6), round(p.alpha, 6), p.index, p.hidden) for p in e.particles]
+
+    def test_same_as_list(self):
+        arrays, objects = self.make_emitter(True), self.make_emitter(False)
+        self.assertIsInstance(arrays._particles, ParticleArrays)
+        for i in range(10):  # long enough to reset
+            self.tick(arrays)
+            self.tick(objects)
+            self.assertEqual(self.state(arrays), self.state(objects))
+        arrays._particles.terminate[1:] = True  # as limit_particles(1) does, the rest go instead of resetting
+        for p in objects._particles[1:]:
+            p.terminate = True
+        for i in range(5):
+            self.tick(arrays)
+            self.tick(objects)
+        self.assertEqual(len(arrays.particles), 1)
+        self.assertEqual(self.state(arrays), self.state(objects))
+
+    def test_view(self):
+        e = self.make_emitter(True)
+        view = e.particles[1]
+        view.x = 50
+        self.assertEqual(e._particles.x[1], 50)
+        self.assertIsInstance(view.hidden, bool)
+
+    def test_cycle_staggered(self):
+        # a custom test_terminate isn't vectorised, but must still reset particles while fast forwarding
+        e = self.make_emitter(True, number=20, frames=10, random_age=True, behaviour=BEHAVIOUR_CYCLE,
+                              test_terminate=_test_terminate)
+        self.assertFalse(e._vectorised)
+        self.assertTrue((e._particles.index < e.frames).any())
+
+    def test_old_save(self):
+        e = self.make_emitter(False)
+        objects = e._particles
+        e.__setstate__(dict(e.__dict__))  # a save from before arrays
+        self.assertIsInstance(e._particles, ParticleArrays)
+        self.assertEqual(list(e._particles.x), [p.x for p in objects])
+
+
 class WalkthroughTest(unittest.TestCase):
     def setUp(self):
         self.game = Game("Unit Tests", fps=60, afps=16, resolution=RESOLUTION)
@@ -727,6 +849,669 @@ class GotoTest(unittest.TestCase):
         self.actor.goto(200,100)
         self.actor.says("Goodbye World")
 
+
+class VisibilityGraphTest(unittest.TestCase):
+    def setUp(self):
+        self.graph = VisibilityGraph()
+        self.graph._polygon = [(0, 0), (1000, 0), (1000, 1000), (0, 1000)]
+        self.graph._add_solid("box", Rect(400, 0, 200, 800))
+        for pt in [(380, 820), (620, 820), (100, 100), (900, 100)]:
+            self.graph._add_node(pt)
+
+    def test_path_around_solid(self):
+        self.assertEqual(self.graph.path((100, 500), (900, 500)), [(100, 500), (380, 820), (620, 820), (900, 500)])
+
+    def test_solid_removed(self):
+        self.graph._remove_solid("box")
+        self.assertEqual(self.graph.path((100, 500), (900, 500)), [(100, 500), (900, 500)])
+
+    def test_no_path(self):
+        self.graph._add_solid("wall", Rect(300, 0, 20, 1000))
+        self.assertEqual(self.graph.path((100, 500), (900, 500)), [])
+
+
+def _test_function_cache_hook(game, obj, player):
+    pass
+
+
+class FunctionCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.game = Game("Unit Tests", fps=60, afps=16, resolution=RESOLUTION)
+        self.main = sys.modules["__main__"]
+        self.main._test_function_cache_hook = _test_function_cache_hook
+
+    def tearDown(self):
+        for name in ["_test_function_cache_hook", "_test_function_cache_later"]:
+            if hasattr(self.main, name):
+                delattr(self.main, name)
+
+    def test_hit(self):
+        cache = self.game._function_cache
+        self.assertIs(get_function(self.game, "_test_function_cache_hook"), _test_function_cache_hook)
+        self.assertIs(get_function(self.game, "_test_function_cache_hook"), _test_function_cache_hook)
+        self.assertEqual((cache.misses, cache.hits), (1, 1))
+
+    def test_miss_not_remembered(self):
+        self.assertIsNone(get_function(self.game, "_test_function_cache_later"))
+        self.main._test_function_cache_later = _test_function_cache_hook  # defined after the first look
+        self.assertIs(get_function(self.game, "_test_function_cache_later"), _test_function_cache_hook)
+
+    def test_cleared(self):
+        cache = self.game._function_cache
+        get_function(self.game, "_test_function_cache_hook")
+        self.game.set_modules([])
+        self.assertEqual(cache._functions, {})
+        get_function(self.game, "_test_function_cache_hook")
+        module = MetadataBundle.__module__  # a module with a file, changed since time 0
+        self.game._modules[module] = 0
+        self.assertTrue(self.game.check_modules())
+        self.assertEqual(cache._functions, {})
+
+
+class UpdateListTest(unittest.TestCase):
+    def setUp(self):
+        self.game = Game("Unit Tests", fps=60, afps=16, resolution=RESOLUTION)
+        self.game.settings = Settings()
+        self.scene = Scene("_test_scene")
+        self.first = Item("first")
+        self.second = Item("second")
+        self.game.add([self.scene, self.first, self.second])
+        self.scene._add(self.first)
+        self.game.camera._scene(self.scene)
+
+    def test_changes(self):
+        self.assertIn(self.first, self.game._get_update_list())
+        self.assertNotIn(self.second, self.game._get_update_list())
+        self.scene._add(self.second)
+        self.assertIn(self.second, self.game._get_update_list())
+        self.scene._remove(self.first)
+        self.assertNotIn(self.first, self.game._get_update_list())
+        self.game._modals.append("first")
+        self.assertIn(self.first, self.game._get_update_list())
+        self.game._modals.remove("first")
+        self.game._menu.append("first")
+        self.assertIn(self.first, self.game._get_update_list())
+
+    def test_replaced_objects(self):
+        self.game._get_update_list()
+        self.scene._objects = ["second"]  # a new list of the same length is noticed
+        self.assertEqual(self.game._get_update_list().count(self.second), 1)
+        self.assertNotIn(self.first, self.game._get_update_list())
+        self.scene._objects[0] = "first"  # changing it in place isn't, unless told
+        self.assertNotIn(self.first, self.game._get_update_list())
+        self.game._invalidate_update_list()
+        self.assertIn(self.first, self.game._get_update_list())
+
+
+class RenderPipelineTest(unittest.TestCase):
+    def setUp(self):
+        self.objects = [Actor("a"), Actor("b"), Actor("c")]
+        self.objects[0].z, self.objects[0].y = 1.0, 200  # rank is y
+        self.objects[1].z, self.objects[1].y = 1.0, 100
+        self.objects[2].z, self.objects[2].y = 0.5, 300
+        self.renderer = RenderPipeline()
+
+    def test_sort(self):
+        self.assertEqual([x.name for x in self.renderer.sort(self.objects)], ["c", "b", "a"])
+
+    def test_resort_on_change(self):
+        self.renderer.sort(self.objects)
+        self.objects[2].z = 2.0
+        self.assertEqual([x.name for x in self.renderer.sort(self.objects)], ["b", "a", "c"])
+
+    def test_sprite_changes_batch(self):
+        drawn = []
+
+        class FakeBatch(object):
+            def draw(batch):
+                drawn.append(sorted(sprite.name for sprite in sprites if sprite.batch is batch))
+
+        class FakeSprite(object):
+            def __init__(self, name):
+                self.name, self.batch, self.group, self._vertex_list = name, None, None, True
+
+        class FakeObject(object):
+            def __init__(self, name, batchable):
+                self.name, self.allow_draw, self.batchable = name, True, batchable
+                self.resource = FakeSprite(name) if batchable else None
+
+            def _batchable(self):
+                return self.batchable
+
+            def _pyglet_batch_position(self, sprite, absolute=False):
+                pass
+
+            def pyglet_draw(self, absolute=False):
+                drawn.append(self.name)
+
+        a, b, walker = FakeObject("a", True), FakeObject("b", True), FakeObject("walker", False)
+        sprites = [a.resource, b.resource]
+        self.renderer._batches = [FakeBatch(), FakeBatch()]
+        self.renderer.draw([a, walker])
+        del drawn[:]
+        self.renderer.draw([b, walker, a])  # walker has moved behind a, so a is now in the second batch
+        self.assertEqual(drawn, [["b"], "walker", ["a"]])
+
+
+class HitIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.game = Game("Unit Tests", fps=60, afps=16, resolution=RESOLUTION)
+        self.game.settings = Settings()
+        self.scene = Scene("_test_scene")
+        self.front = Item("front")
+        self.back = Item("back")
+        self.game.add([self.scene, self.front, self.back])
+        for obj in [self.back, self.front]:
+            obj._clickable_area = Rect(0, 0, 100, 100)
+            obj.x, obj.y = 100, 100
+            self.scene._add(obj)
+        self.front.z = 2.0
+        self.game.camera._scene(self.scene)
+
+    def test_hits_by_z(self):
+        self.assertEqual(self.game._hit_index.hits(self.game, "scene", 150, 150), [self.front, self.back])
+        self.assertEqual(self.game._hit_index.hits(self.game, "scene", 50, 50), [])
+
+    def test_moved(self):
+        self.game._hit_index.hits(self.game, "scene", 150, 150)
+        self.front.x = 500
+        self.assertEqual(self.game._hit_index.hits(self.game, "scene", 150, 150), [self.back])
+        self.assertEqual(self.game._hit_index.hits(self.game, "scene", 550, 150), [self.front])
+
+    def test_clear(self):
+        self.game._hit_index.hits(self.game, "scene", 150, 150)
+        self.front.__dict__["_x"] = 500  # as if loaded from a save game, so not reported as moved
+        self.game._hit_index.clear()
+        self.assertEqual(self.game._hit_index.hits(self.game, "scene", 550, 150), [self.front])
+
+
+class ResourceCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.game = Game("Unit Tests", fps=60, afps=16, resolution=RESOLUTION)
+        self.game.settings = Settings()
+        self.game._headless = False
+        self.scene = Scene("_test_scene")
+        self.old = Item("old")
+        self.pinned = Item("pinned")
+        self.game.add([self.scene, self.old, self.pinned])
+        self.scene._add(self.pinned)
+        self.game.camera._scene(self.scene)
+        self.cache = ResourceCache(budget=3)
+        self.cache._objects["pinned"] = 2 * 1024 * 1024  # least recently used, but in the current scene
+        self.cache._objects["old"] = 2 * 1024 * 1024
+        self.cache.bytes = 4 * 1024 * 1024
+
+    def test_evict_unpinned(self):
+        self.cache.trim(self.game)
+        self.assertEqual(list(self.cache._objects.keys()), ["pinned"])
+        self.assertEqual(self.cache.evicted, set(["old"]))
+        self.assertEqual(self.cache.evictions, 1)
+
+    def test_reloaded_not_restored(self):
+        self.game._resource_cache = self.cache
+        self.cache.trim(self.game)
+        self.assertIn("old", self.cache.evicted)
+        misses = self.cache.misses
+        self.old.load_assets(self.game)  # eg by its scene on a camera change
+        self.assertNotIn("old", self.cache.evicted)
+        self.old.resource
+        self.assertEqual(self.cache.misses, misses + 1)
+
+    def test_low_memory(self):
+        self.cache.budget = 10
+        self.cache.trim(self.game)
+        self.assertEqual(self.cache.evictions, 0)
+        self.game.low_memory = True
+        self.cache.low_memory_budget = 3
+        self.cache.trim(self.game)
+        self.assertEqual(self.cache.evictions, 1)
+
+
+class AssetLoaderTest(unittest.TestCase):
+    def setUp(self):
+        self.game = Game("Unit Tests", fps=60, afps=16, resolution=RESOLUTION)
+        self.game.settings = Settings()
+        self.actor = Actor("_test_actor").smart(self.game)
+        self.loader = AssetLoader(workers=2)
+
+    def test_headless(self):
+        self.game._headless = True
+        self.assertEqual(self.loader.submit(self.game, self.actor), [])
+
+    def test_take(self):
+        self.game._headless = False
+        files = self.loader.submit(self.game, self.actor)
+        self.assertEqual(len(files), len(self.actor._actions))
+        self.assertTrue(self.loader.take(files[0]))
+        self.assertIsNone(self.loader.take(files[0]))  # only handed out once
+        self.loader.cancel()
+        self.assertTrue(self.loader.ready(files))
+
+
+class SceneGraphTest(unittest.TestCase):
+    def setUp(self):
+        self.game = Game("Unit Tests", fps=60, afps=16, resolution=RESOLUTION)
+        self.game.settings = Settings()
+        self.scenes = [Scene("_test_scene_%s" % i) for i in "abcd"]
+        self.game.add(self.scenes)
+        for (a, b) in [("a", "b"), ("b", "a"), ("b", "c"), ("c", "b"), ("a", "c"), ("c", "a")]:
+            portal = Portal("%s_to_%s" % (a, b))
+            self.game.add(portal)
+            self.game._scenes["_test_scene_%s" % a]._add(portal)
+        for (a, b) in [("a", "b"), ("b", "c"), ("a", "c")]:
+            get_object(self.game, "%s_to_%s" % (a, b)).link = "%s_to_%s" % (b, a)
+            get_object(self.game, "%s_to_%s" % (b, a)).link = "%s_to_%s" % (a, b)
+        self.graph = self.game._scene_graph
+
+    def test_shortest_path(self):
+        self.assertEqual(self.graph.path(self.game, "_test_scene_a", "_TEST_SCENE_C"),
+                         [("a_to_c", "_test_scene_c")])
+        self.assertEqual(self.graph.path(self.game, "_test_scene_a", "_TEST_SCENE_A"), [])
+        self.assertIsNone(self.graph.path(self.game, "_test_scene_a", "_TEST_SCENE_D"))
+
+    def test_relink(self):
+        self.graph.path(self.game, "_test_scene_a", "_TEST_SCENE_C")
+        get_object(self.game, "a_to_c").link = None
+        self.assertEqual(self.graph.path(self.game, "_test_scene_a", "_TEST_SCENE_C"),
+                         [("a_to_b", "_test_scene_b"), ("b_to_c", "_test_scene_c")])
+        self.assertEqual(self.graph.builds, 2)
+
+    def test_scene_search(self):
+        self.assertEqual(scene_search(self.game, self.scenes[1], "_TEST_SCENE_C"), self.scenes[2])
+        self.assertEqual(sys.modules[scene_search.__module__].scene_path, [self.scenes[1], self.scenes[2]])
+
+
+class ScenePrefetcherTest(unittest.TestCase):
+    def setUp(self):
+        self.game = Game("Unit Tests", fps=60, afps=16, resolution=RESOLUTION)
+        self.game.settings = Settings()
+        self.scenes = [Scene("_test_scene_%s" % i) for i in "abc"]
+        self.game.add(self.scenes)
+        for (a, b) in [("a", "b"), ("b", "a"), ("b", "c"), ("c", "b")]:
+            portal = Portal("%s_to_%s" % (a, b))
+            self.game.add(portal)
+            self.game._scenes["_test_scene_%s" % a]._add(portal)
+        for (a, b) in [("a", "b"), ("b", "c")]:
+            get_object(self.game, "%s_to_%s" % (a, b)).link = "%s_to_%s" % (b, a)
+            get_object(self.game, "%s_to_%s" % (b, a)).link = "%s_to_%s" % (a, b)
+
+    def test_neighbours(self):
+        prefetcher = ScenePrefetcher(hops=1)
+        self.assertEqual(prefetcher.neighbours(self.game, self.scenes[0]), ["_test_scene_b"])
+        self.assertEqual(prefetcher.neighbours(self.game, self.scenes[1]), ["_test_scene_a", "_test_scene_c"])
+        prefetcher.hops = 2
+        self.assertEqual(prefetcher.neighbours(self.game, self.scenes[0]), ["_test_scene_b", "_test_scene_c"])
+
+    def test_arrived(self):
+        prefetcher = ScenePrefetcher()
+        self.game._headless = True
+        prefetcher.arrived(self.game, self.scenes[0])
+        self.assertEqual(prefetcher.stats["misses"], 1)
+        self.assertEqual(prefetcher.stats["scenes"], 0)  # nothing decoded in headless mode
+
+
+class SaveGameTest(unittest.TestCase):
+    def setUp(self):
+        self.game = Game("Unit Tests", fps=60, afps=16, resolution=RESOLUTION)
+        self.game.settings = Settings()
+        self.actor = Actor("_test_actor").smart(self.game)
+        self.game.add(self.actor)
+        f, self.fname = tempfile.mkstemp(suffix=".save")
+        os.close(f)
+
+    def tearDown(self):
+        os.remove(self.fname)
+
+    def test_meta_only(self):
+        save_game(self.game, self.fname)
+        self.assertEqual(load_game_meta_pickle(self.game, self.fname)["title"], "Unit Tests")
+
+    def test_unchanged_objects_reused(self):
+        save_game(self.game, self.fname)
+        pickled = self.game._save_cache.pickled
+        save_game(self.game, self.fname)
+        self.assertEqual(self.game._save_cache.pickled, pickled)
+        self.actor.x = 100
+        save_game(self.game, self.fname)
+        self.assertEqual(self.game._save_cache.pickled, pickled + 1)
+
+    def test_changed_in_script(self):
+        self.actor.notes = []
+        save_game(self.game, self.fname)
+        main = sys.modules["__main__"]
+        basic = "interact_%s" % slugify(self.actor.name)
+
+        def interact(game, actor, player):
+            actor.notes.append("poked")  # in place, so no __setattr__ to mark the actor
+
+        setattr(main, basic, interact)
+        try:
+            self.actor.trigger_interact()
+        finally:
+            delattr(main, basic)
+        save_game(self.game, self.fname)
+        load_game(self.game, self.fname)
+        self.assertEqual(get_object(self.game, "_test_actor").notes, ["poked"])
+
+    def test_walkarea_marks_scene(self):
+        scene = Scene("_test_scene")
+        self.game.add(scene)
+        save_game(self.game, self.fname)
+        scene.walkarea.lock()
+        self.game.update(0)
+        save_game(self.game, self.fname)
+        load_game(self.game, self.fname)
+        self.assertEqual(get_object(self.game, "_test_scene").walkarea._state, LOCKED)
+
+    def test_save_writer(self):
+        self.game._save_writer.submit(write_save_game, snapshot_game(self.game), self.fname, self.game._save_cache,
+                                      callback=lambda game, fname: None, fname=self.fname)
+        self.game._save_writer.wait()
+        self.game._save_writer.finished(self.game)
+        self.assertEqual(self.game._save_writer.pending, 0)
+        self.assertEqual(load_game_meta_pickle(self.game, self.fname)["title"], "Unit Tests")
+        self.assertEqual(len(self.game._events), 1)  # the callback is queued as an event
+
+
+class RuntimeOptionsTest(unittest.TestCase):
+    def test_environment(self):
+        parser = ArgumentParser()
+        parser.add_argument("-H", "--headless", action="store_true", dest="headless")
+        parser.add_argument("-s", "--step", dest="target_step", nargs='+')
+        os.environ[OPTIONS_ENVIRONMENT] = "-H -s 12"
+        argv, sys.argv = sys.argv, sys.argv[:1]
+        try:
+            options = get_runtime_options(parser)
+        finally:
+            sys.argv = argv
+            del os.environ[OPTIONS_ENVIRONMENT]
+        self.assertTrue(options.headless)
+        self.assertEqual(options.target_step, ["12"])
+        with self.assertRaises(AttributeError):
+            options.headless = False
+
+
+class WalkthroughRecorderTest(unittest.TestCase):
+    def test_benchmark(self):
+        game = Game("Unit Tests", fps=60, afps=16, resolution=RESOLUTION)
+        recorder = WalkthroughRecorder(benchmark=True)
+        recorder.start(game, 0, "interact", "_test_actor")
+        get_object(game, "_test_missing")
+        recorder.start(game, 1, "look", "_test_actor")
+        recorder.finish(game)
+        self.assertEqual([step["index"] for step in recorder.steps], [0, 1])
+        self.assertEqual(recorder.steps[0]["get_object"], 1)
+        self.assertEqual(recorder.steps[1]["get_object"], 0)
+        f, fname = tempfile.mkstemp(suffix=".json")
+        os.close(f)
+        recorder.write(game, fname)
+        with open(fname, "r") as f:
+            report = json.loads(f.read())
+        os.remove(fname)
+        self.assertEqual(report["totals"]["get_object"], 1)
+        self.assertIsNone(report["error"])
+
+
+class MotionTest(unittest.TestCase):
+    def test_goto_deltas(self):
+        motion = Motion("_test_motion")
+        motion.add_deltas([(3, 4), (None, 5), (6, 8)])
+        self.assertEqual(motion.deltas[1], (None, 5.0, None, None, None, None, None))
+        self.assertEqual(motion.distance, 20)
+        deltas, travelled_y = motion.goto_deltas(27.5)  # a whole pass, the first step, then half the second
+        self.assertEqual(deltas, [(3, 4), (0, 5), (6, 8), (3, 4), (0, 2.5)])
+        self.assertEqual(travelled_y, 23.5)
+
+    def test_legacy_state(self):
+        motion = Motion.__new__(Motion)
+        motion.__setstate__({"name": "_test_motion", "deltas": [[1, 2, None, None, None, None, None]],
+                             "_average_dx": 1})
+        self.assertEqual(motion.num_of_deltas, 1)
+        self.assertEqual(motion._average_dy, 2)
+
+
+class MetadataBundleTest(unittest.TestCase):
+    def test_bundle(self):
+        root = tempfile.mkdtemp()
+        actor = os.path.join(root, "data", "actors", "_test_actor")
+        os.makedirs(actor)
+        with open(os.path.join(actor, "idle.montage"), "w") as f:
+            f.write("3\n10\n20\n")
+        bundle = MetadataBundle(os.path.join(root, METADATA_BUNDLE), root=root)
+        bundle.build(os.path.join(root, "data"))
+        bundle.write()
+
+        bundle = MetadataBundle(os.path.join(root, METADATA_BUNDLE), root=root)
+        self.assertEqual(bundle.listdir(actor), ["idle.montage"])
+        self.assertEqual(bundle.read(os.path.join(actor, "idle.montage")), "3\n10\n20\n")
+        self.assertIsNone(bundle.read(os.path.join(actor, "idle.defaults")))
+        self.assertEqual(bundle.mtime(os.path.join(actor, "idle.montage")),
+                         os.path.getmtime(os.path.join(actor, "idle.montage")))
+        self.assertIsNone(bundle.mtime(os.path.join(actor, "idle.atlas")))
+        self.assertEqual(bundle.misses, 0)
+        os.utime(os.path.join(actor, "idle.montage"), (0, 0))  # changed since the bundle was built
+        bundle.recheck()
+        self.assertEqual(bundle.read(os.path.join(actor, "idle.montage")), "3\n10\n20\n")
+        self.assertEqual(bundle.misses, 1)
+
+    def test_scan(self):
+        root = tempfile.mkdtemp()
+        actors = [os.path.join(root, "data", "actors", "_test_actor%i" % i) for i in range(8)]
+        for i, actor in enumerate(actors):
+            os.makedirs(actor)
+            with open(os.path.join(actor, "idle.montage"), "w") as f:
+                f.write("%i\n10\n20\n" % i)
+        bundle = MetadataBundle(None, root=root)
+        bundle.scan(actors, workers=4)
+        self.assertEqual(bundle.scanned, 8)
+        self.assertEqual(bundle.read(os.path.join(actors[5], "idle.montage")), "5\n10\n20\n")
+        self.assertEqual(bundle.misses, 0)
+        bundle.scan(actors, workers=4)  # already up to date
+        self.assertEqual(bundle.scanned, 8)
+
+    def test_scan_off(self):
+        root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(root, "data"))
+        module = sys.modules[MetadataBundle.__module__]
+        workers, module.SMART_LOAD_WORKERS = module.SMART_LOAD_WORKERS, 0  # turned off at runtime
+        try:
+            bundle = MetadataBundle(None, root=root)
+            bundle.scan([os.path.join(root, "data")])
+            self.assertEqual(bundle.scanned, 0)
+        finally:
+            module.SMART_LOAD_WORKERS = workers
+
+
+def load_tool(name):
+    """ import one of the scripts in tools/ """
+    loader = importlib.machinery.SourceFileLoader("tool_%s" % name, os.path.join(os.path.dirname(
+        os.path.abspath(__file__)), "tools", name))
+    module = importlib.util.module_from_spec(importlib.util.spec_from_loader(loader.name, loader))
+    loader.exec_module(module)
+    return module
+
+
+class AtlasFrame(object):
+    def __init__(self, w, h):
+        self.size = (w, h)
+
+
+class AtlasToolTest(unittest.TestCase):
+    def setUp(self):
+        try:
+            self.atlas = load_tool("atlas")
+        except ImportError:
+            self.skipTest("tools/atlas needs PIL")
+
+    def test_next_power_of_two(self):
+        self.assertEqual([self.atlas.next_power_of_two(v) for v in [1, 5, 64, 65]], [1, 8, 64, 128])
+
+    def test_block(self):
+        block = self.atlas.Block("idle.png", [AtlasFrame(10, 20)] * 5, 32, 1)
+        self.assertEqual((block.columns, block.rows, block.w, block.h), (3, 2, 32, 41))
+        self.assertEqual(list(block.frame_positions(100, 0)),
+                         [(100, 0), (111, 0), (122, 0), (100, 21), (111, 21)])
+
+    def test_pack(self):
+        blocks = [self.atlas.Block(name, [AtlasFrame(30, 30)], 64, 1) for name in "abcde"]
+        sizes, placed = self.atlas.pack(blocks, 64, 1)
+        self.assertEqual(sizes, [(64, 64), (32, 32)])
+        self.assertEqual([(block.fname, page, x, y) for block, page, x, y in placed],
+                         [("a", 0, 0, 0), ("b", 0, 31, 0), ("c", 0, 0, 31), ("d", 0, 31, 31), ("e", 1, 0, 0)])
+
+    def test_read_montage(self):
+        fname = os.path.join(tempfile.mkdtemp(), "idle.png")
+        self.assertEqual(self.atlas.read_montage(fname), 1)  # no .montage, so a single frame
+        with open(os.path.splitext(fname)[0] + ".montage", "w") as f:
+            f.write("3\n10\n20\n")
+        self.assertEqual(self.atlas.read_montage(fname), 3)
+
+
+class AtlasTexture(object):
+    width, height = 64, 32
+
+    def get_region(self, x, y, w, h):
+        return (x, y, w, h)
+
+
+class LoadAtlasTest(unittest.TestCase):
+    def setUp(self):
+        self.module = sys.modules[Action.__module__]
+        self.game = Game("Unit Tests", fps=60, afps=16, resolution=RESOLUTION)
+        self.game.settings = Settings()
+        self.root = tempfile.mkdtemp()
+        self.image = os.path.join(self.root, "idle.png")
+        self.page = os.path.join(self.root, "atlas_0.png")
+        for fname in [self.image, self.page]:
+            open(fname, "w").close()
+        self.write_atlas([[0, 0, 10, 20], [11, 0, 10, 20]])
+        self.fname = os.path.splitext(self.image)[0]
+        self.action = self.make_action("_test_atlas_actor")
+        self.module._atlas_pages[self.page] = AtlasTexture()  # already loaded, so no png is decoded
+
+    def tearDown(self):
+        self.module._atlas_pages.pop(self.page, None)
+        self.module._atlas_page_users.pop(self.page, None)
+
+    def write_atlas(self, frames):
+        atlas = os.path.join(self.root, "idle.atlas")
+        with open(atlas, "w") as f:
+            f.write(json.dumps({"page": "atlas_0.png", "size": [64, 32], "frames": frames}))
+        os.utime(self.image, (0, 0))  # packed after the spritesheet last changed
+
+    def make_action(self, actor):
+        action = Action("idle")
+        action.actor = actor
+        action._image = self.image
+        action.num_of_frames = 2
+        return action
+
+    def test_load(self):
+        frames = self.action._load_atlas(self.game, self.fname)
+        self.assertEqual(frames, [(0, 12, 10, 20), (11, 12, 10, 20)])  # y from the bottom of the page
+        self.assertEqual(self.action._atlas_page, self.page)
+
+    def test_stale(self):
+        newer = os.path.getmtime(os.path.join(self.root, "idle.atlas")) + 10
+        os.utime(self.image, (newer, newer))  # spritesheet changed since it was packed
+        self.assertIsNone(self.action._load_atlas(self.game, self.fname))
+        self.assertIsNone(self.action._atlas_page)
+
+    def test_frame_count(self):
+        self.action.num_of_frames = 3  # montage changed since it was packed
+        self.assertIsNone(self.action._load_atlas(self.game, self.fname))
+        self.assertNotIn(self.page, self.module._atlas_page_users)
+
+    def test_release(self):
+        other = self.make_action("_test_atlas_other")
+        self.action._load_atlas(self.game, self.fname)
+        other._load_atlas(self.game, self.fname)
+        self.action.unload_assets()
+        self.assertIn(self.page, self.module._atlas_pages)  # still used by the other action
+        other.unload_assets()
+        self.assertNotIn(self.page, self.module._atlas_pages)
+
+    def test_budget(self):
+        item = Item("_test_atlas_item")
+        item._actions = {"idle": self.action}
+        self.action.actor = item.name
+        self.action._load_atlas(self.game, self.fname)
+        cache = ResourceCache()
+        cache.loaded(self.game, item)
+        self.assertEqual(cache.bytes, 64 * 32 * 4)  # the whole page, not just its frames
+        self.action.unload_assets()
+        cache.forget(item)
+        self.assertEqual(cache.bytes, 0)
+        self.assertEqual(cache.stats["pages"], 0)
+
+
+class BestFileCacheTest(unittest.TestCase):
+    def test_settings_key(self):
+        game = Game("Unit Tests", fps=60, afps=16, resolution=RESOLUTION)
+        game.settings = Settings()
+        fname = get_best_file(game, "data/actors/_test_actor/idle.png")
+        self.assertEqual(get_best_file(game, "data/actors/_test_actor/idle.png"), fname)
+        self.assertEqual(game._best_files.hits, 1)
+        game.low_memory = True  # a different answer might be needed, so look again
+        get_best_file(game, "data/actors/_test_actor/idle.png")
+        self.assertEqual(game._best_files.misses, 2)
+
+
+class DepthFieldTest(unittest.TestCase):
+    def test_depth_scale(self):
+        walkarea = WalkAreaManager(Scene("_test_scene"))
+        walkarea._waypoints = [(0, 0, 0.5), (100, 0, 1.5), (50, 50)]
+        self.assertAlmostEqual(walkarea.depth_scale(25, 30), 0.75)
+        self.assertEqual(walkarea.depth_scale(-10, 0), 0.5)  # past the end, so use the nearest
+        walkarea._waypoints.append((100, 100, 1.0))
+        walkarea._depth_field = None  # as on_add_waypoint does
+        self.assertAlmostEqual(walkarea.depth_scale(3, 3), 0.5 + 8 / 200, places=6)  # centre of the first cell
+
+
+class SolidIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.game = Game("Unit Tests", fps=60, afps=16, resolution=RESOLUTION)
+        self.game.settings = Settings()
+        self.scene = Scene("_test_scene")
+        self.box = Item("box")
+        self.game.add([self.scene, self.box])
+        self.box._solid_area = Rect(0, 0, 50, 50)
+        self.box.x, self.box.y = 100, 100
+        self.scene._add(self.box)
+        self.scene.walkarea.on_polygon([(0, 0), (400, 0), (400, 400), (0, 400)])
+
+    def test_valid(self):
+        walkarea = self.scene.walkarea
+        self.assertEqual(walkarea.valid_points([(10, 10), (120, 120), (500, 10), (200, 200)]),
+                         [True, False, False, True])
+        self.box.x = 300  # moved, so the index needs to catch up
+        self.assertTrue(walkarea.valid(120, 120))
+        self.assertFalse(walkarea.valid(320, 120))
+        self.box.allow_update = False
+        self.assertTrue(walkarea.valid(320, 120))
+
+    def test_clear(self):
+        walkarea = self.scene.walkarea
+        self.assertFalse(walkarea.valid(120, 120))
+        self.box.__dict__["_x"] = 300  # as if loaded from a save game, so not reported as moved
+        self.game._solid_index.clear()
+        self.assertTrue(walkarea.valid(120, 120))
+
+
+class LabelPoolTest(unittest.TestCase):
+    def test_reuse(self):
+        pool = LabelPool()
+        w, h = pool.measure("Hello", "Times New Roman", 13, 800)
+        self.assertEqual(pool.measure("Hello", "Times New Roman", 13, 800), (w, h))
+        label = pool.take("Hello", "Times New Roman", 13, 800, (255, 0, 0, 255))
+        self.assertEqual((pool.created, pool.hits), (1, 1))  # laid out by measure, so handed back as it is
+        self.assertEqual(tuple(label.color), (255, 0, 0, 255))
+        pool.release(label)
+        other = pool.take("Goodbye", "Times New Roman", 13, 800)
+        self.assertIs(other, label)
+        self.assertEqual((other.text, pool.relayouts), ("Goodbye", 1))
+
+
 class PortalTest(unittest.TestCase):
     def setUp(self):
         self.game = Game("Unit Tests", fps=60, afps=16, resolution=RESOLUTION)